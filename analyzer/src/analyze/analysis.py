@@ -14,6 +14,7 @@ class Analysis:
         self.columns: Set[SqlColumn] = set()
         self.joins: Set[SqlJoin] = set()
         self.primary_key_column: SqlColumn = None
+        self.watermark_column: SqlColumn = None
         self.squash_rules = None
         self.reference_paths: Set[str] = set()
         self.is_static = False
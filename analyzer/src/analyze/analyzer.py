@@ -70,6 +70,9 @@ class Analyzer:
             # Get primary key table
             self.get_primary_key(resource_mapping)
 
+            # Get the column used for incremental extractions, if any
+            self.get_watermark_column(resource_mapping)
+
             # Add primary key to columns to fetch if needed
             self._cur_analysis.add_column(self._cur_analysis.primary_key_column)
 
@@ -157,3 +160,21 @@ class Analyzer:
         )
 
         return self._cur_analysis.primary_key_column
+
+    def get_watermark_column(self, resource_mapping):
+        """ Get the column (such as an "updated at" timestamp or a monotonically increasing
+        id) used to only extract the rows which changed since the last extraction.
+        This column is optional.
+        """
+        if not resource_mapping.get("watermarkTable") or not resource_mapping.get(
+            "watermarkColumn"
+        ):
+            return None
+
+        self._cur_analysis.watermark_column = SqlColumn(
+            resource_mapping["watermarkTable"],
+            resource_mapping["watermarkColumn"],
+            resource_mapping.get("watermarkOwner"),
+        )
+
+        return self._cur_analysis.watermark_column
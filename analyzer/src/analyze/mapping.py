@@ -1,5 +1,9 @@
 from collections import defaultdict
 
+# Column added by the extractor to the records whose joined rows were aggregated by
+# primary key in the extraction query
+SQUASHED_COLUMN = "__squashed__"
+
 
 def build_squash_rules(columns, joins, main_table):
     """
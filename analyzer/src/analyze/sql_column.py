@@ -43,3 +43,21 @@ class SqlColumn:
         This method helps retrieving the needed columns from the dataframe.
         """
         return f"{self.table}_{self.column}"
+
+    def cleaned_column_name(self):
+        """ Name of the column in which the extractor puts the values cleaned by the
+        cleaning script, when it applies the script in the extraction query.
+        """
+        if self.cleaning_script is None:
+            return None
+        return f"{self.dataframe_column_name()}__{self.cleaning_script.name}"
+
+    def translated_column_name(self):
+        """ Name of the column in which the extractor puts the values (cleaned by the
+        cleaning script if any) translated by the concept map, when it applies the
+        concept map in the extraction query.
+        """
+        if self.concept_map is None:
+            return None
+        column_name = self.cleaned_column_name() or self.dataframe_column_name()
+        return f"{column_name}__{self.concept_map.id}"
@@ -49,6 +49,25 @@ def test_get_primary_key(mock_login):
         analyzer.get_primary_key(resource_mapping)
 
 
+@mock.patch("analyzer.src.analyze.graphql.PyrogClient.login")
+def test_get_watermark_column(mock_login):
+    analyzer = Analyzer(PyrogClient())
+
+    resource_mapping = {
+        "watermarkOwner": "owner",
+        "watermarkTable": "table",
+        "watermarkColumn": "updated_at",
+    }
+    watermark_column = analyzer.get_watermark_column(resource_mapping)
+
+    assert watermark_column == SqlColumn("table", "updated_at", "owner")
+
+    # The watermark column is optional
+    analyzer._cur_analysis.watermark_column = None
+    assert analyzer.get_watermark_column({"watermarkTable": "table"}) is None
+    assert analyzer._cur_analysis.watermark_column is None
+
+
 @mock.patch("analyzer.src.analyze.concept_map.requests.get", mock_api_get_maps)
 @mock.patch("analyzer.src.analyze.graphql.PyrogClient.login")
 def test_analyze_mapping(mock_login, patient_mapping):
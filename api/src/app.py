@@ -76,8 +76,8 @@ def trigger_batch_extractor():
     batch_id = uuid.uuid4().hex
 
     try:
-        for resource_id in resource_ids:
-            create_extractor_trigger(resource_id, batch_id)
+        # A single trigger lets the extractor share the scans of the resources
+        create_batch_trigger(resource_ids, batch_id)
         return "Success", 200
 
     except Exception as e:
@@ -89,18 +89,16 @@ def handle_bad_request(e):
     return str(e), 400
 
 
-def create_extractor_trigger(resource_id, batch_id=None, primary_key_values=None):
+def create_batch_trigger(resource_ids, batch_id):
     """
-    Produce event to trigger extractor
+    Produce event to trigger the extraction of several resources
+    :param resource_ids:
     :param batch_id:
-    :param resource_id:
-    :param primary_key_values:
     :return:
     """
 
     event = dict()
     event["batch_id"] = batch_id
-    event["resource_id"] = resource_id
-    event["primary_key_values"] = primary_key_values
+    event["resource_ids"] = resource_ids
 
     get_producer().produce_event(topic=PRODUCED_TOPIC, event=event)
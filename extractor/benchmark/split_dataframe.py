@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Compare the vectorized Extractor.split_records to the former row by row implementation.
+
+Usage: python -m extractor.benchmark.split_dataframe [n_rows]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from analyzer.src.analyze.analysis import Analysis
+from analyzer.src.analyze.sql_column import SqlColumn
+
+from extractor.src.extract.extractor import CHUNK_SIZE, Extractor
+
+N_ROWS = 1000000
+# Average number of rows per primary key (as produced by one-to-many joins)
+ROWS_PER_KEY = 3
+
+
+def iterrows_split_dataframe(df_chunks, analysis):
+    """ The implementation of the grouping of split_records before its vectorization.
+    """
+    pk_col = analysis.primary_key_column.dataframe_column_name()
+
+    prev_pk_val = None
+    acc = []
+    columns = None
+    for df in df_chunks:
+        columns = df.columns
+        for _, row in df.iterrows():
+            if acc and row[pk_col] != prev_pk_val:
+                yield pd.DataFrame(acc, columns=columns)
+                acc = []
+            acc.append(row)
+            prev_pk_val = row[pk_col]
+    if acc:
+        yield pd.DataFrame(acc, columns=columns)
+
+
+def build_chunks(n_rows):
+    pk_values = np.sort(np.random.randint(0, n_rows // ROWS_PER_KEY, size=n_rows))
+    df = pd.DataFrame(
+        {
+            "patients_subject_id": pk_values,
+            "patients_gender": np.random.choice(["M", "F"], size=n_rows),
+            "admissions_admittime": pd.date_range("2150-01-01", periods=n_rows, freq="min"),
+            "admissions_diagnosis": np.random.choice(["SEPSIS", "FEVER", None], size=n_rows),
+        }
+    )
+    ends = range(CHUNK_SIZE, n_rows + CHUNK_SIZE, CHUNK_SIZE)
+    return [df.iloc[end - CHUNK_SIZE:end] for end in ends]
+
+
+def run(split, chunks, analysis):
+    start = time.perf_counter()
+    n_groups = sum(1 for _ in split(chunks, analysis))
+    return n_groups, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else N_ROWS
+
+    analysis = Analysis()
+    analysis.primary_key_column = SqlColumn("patients", "subject_id")
+    chunks = build_chunks(n_rows)
+
+    n_groups, vectorized_time = run(Extractor.split_records, chunks, analysis)
+    print(f"vectorized: {n_groups} groups from {n_rows} rows in {vectorized_time:.2f}s")
+
+    n_groups, iterrows_time = run(iterrows_split_dataframe, chunks, analysis)
+    print(f"iterrows:   {n_groups} groups from {n_rows} rows in {iterrows_time:.2f}s")
+
+    print(f"speedup: x{iterrows_time / vectorized_time:.1f}")
@@ -17,6 +17,7 @@ class ExtractorConsumer:
         offset_start=-1,
         process_event=None,
         manage_error=None,
+        on_poll=None,
     ):
         """
         Instantiate the class and create the consumer object
@@ -29,6 +30,8 @@ class ExtractorConsumer:
             to process the event
         :param manage_error: function taking as an argument adeserialized message
             to manage any error
+        :param on_poll: function called after each poll of the consumer, even if
+            no message was received
         """
         self.broker = broker
         self.topics = topics
@@ -37,6 +40,7 @@ class ExtractorConsumer:
         self.offset_start = offset_start
         self.process_event = process_event
         self.manage_error = manage_error
+        self.on_poll = on_poll
 
         # Create consumer
         self.consumer = Consumer(self._generate_config())
@@ -66,6 +70,9 @@ class ExtractorConsumer:
             # Deserialize Event
             msg = self.consumer.poll(timeout=1.0)
 
+            if self.on_poll:
+                self.on_poll()
+
             # Process Event or Raise Error
             if msg is None:
                 continue
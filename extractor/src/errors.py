@@ -28,3 +28,11 @@ class EmptyResult(Exception):
     """
 
     pass
+
+
+class RowLimitExceeded(Exception):
+    """
+    Error used when the extraction of a resource fetched more rows than allowed.
+    """
+
+    pass
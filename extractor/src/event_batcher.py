@@ -0,0 +1,100 @@
+import json
+import os
+
+from extractor.src.producer_class import ExtractorProducer
+
+# Maximum number of records (primary key groups) packed in an extract event
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", 100))
+# Maximum size (in bytes) of the records packed in an extract event. Note that Kafka
+# rejects messages larger than 1MB by default.
+EVENT_BATCH_BYTES = int(os.getenv("EVENT_BATCH_BYTES", 512 * 1024))
+
+
+class EventBatcher:
+    """ Pack the records of a resource in extract events of the form
+    {
+        "batch_id": ..., "resource_type": ..., "resource_id": ...,
+        "columns": [column 1, column 2, ...],
+        "dataframes": [
+            [[column 1 values], [column 2 values], ...],  # first record
+            [[column 1 values], [column 2 values], ...],  # second record
+            ...
+        ],
+        "hashes": [first record hash, second record hash, ...]  # optional
+    }
+    so that the event fields and the column names are sent once for many records.
+    """
+
+    def __init__(
+        self, produce, header, max_records=EVENT_BATCH_SIZE, max_bytes=EVENT_BATCH_BYTES
+    ):
+        """
+        :param produce: function taking an event serialized in json as argument
+        :param header: dict of the fields (batch_id, resource_type, resource_id) of the events
+        :param max_records: maximum number of records in an event
+        :param max_bytes: maximum size of the serialized records of an event. An event
+            always contains at least one record.
+        """
+        self.produce = produce
+        self.header = header
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+
+        self.columns = None
+        self.serialized_records = []
+        self.hashes = []
+        self.size = 0
+
+    @staticmethod
+    def serialize(record):
+        """ Serialize the values of a {column: [values]} record for add_serialized(). This
+        is the costly part of adding a record and it doesn't depend on the state of the
+        batcher, so it can be run in other threads.
+
+        :return: a (columns, serialized record) tuple
+        """
+        columns = list(record)
+        serialized_record = json.dumps(
+            [record[column] for column in columns], default=ExtractorProducer.default_json_encoder
+        )
+        return columns, serialized_record
+
+    def add_serialized(self, columns, serialized_record, record_hash=None):
+        """ Add a record serialized by serialize() to the current event, which is
+        produced when it is full. If provided, record_hash (see RecordHashIndex) is sent
+        along with the record.
+        """
+        if columns != self.columns:
+            self.flush()
+            self.columns = columns
+
+        if self.serialized_records and self.size + len(serialized_record) > self.max_bytes:
+            self.flush()
+
+        self.serialized_records.append(serialized_record)
+        if record_hash is not None:
+            self.hashes.append(record_hash)
+        self.size += len(serialized_record)
+
+        if len(self.serialized_records) >= self.max_records:
+            self.flush()
+
+    def flush(self):
+        """ Produce the current event if it contains records.
+        """
+        if not self.serialized_records:
+            return
+
+        # The records are already serialized, we only need to insert them in the
+        # serialized header (which ends with a "}").
+        header = {**self.header, "columns": self.columns}
+        if self.hashes:
+            header["hashes"] = self.hashes
+        serialized_header = json.dumps(header)
+        self.produce(
+            f"{serialized_header[:-1]}, \"dataframes\": [{', '.join(self.serialized_records)}]}}"
+        )
+
+        self.serialized_records = []
+        self.hashes = []
+        self.size = 0
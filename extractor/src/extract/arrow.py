@@ -0,0 +1,66 @@
+"""
+Arrow-backed extraction: the rows fetched from the source DB are stored in Arrow record
+batches, which are grouped by primary key and serialized without building pandas
+dataframes.
+"""
+
+from decimal import Decimal
+
+import numpy as np
+import pyarrow as pa
+
+from extractor.src.extract.grouping import group_boundaries, split_groups
+
+
+def fetch_record_batches(result, chunk_sizer):
+    """ Fetch the rows of a sql alchemy result by chunks of chunk_sizer.size rows (see
+    budget.ChunkSizer) and yield them as Arrow record batches.
+    """
+    columns = list(result.keys())
+    while True:
+        rows = result.fetchmany(chunk_sizer.size)
+        if not rows:
+            break
+        arrays = [to_arrow_array(values) for values in zip(*rows)]
+        batch = pa.RecordBatch.from_arrays(arrays, names=columns)
+        chunk_sizer.observe(batch.num_rows, batch.nbytes)
+        yield batch
+
+
+def to_arrow_array(values):
+    # NUMERIC values are converted to floats, as pandas does with coerce_float. This is
+    # done before building the array as old versions of pyarrow can't cast decimals.
+    values = [float(value) if isinstance(value, Decimal) else value for value in values]
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError, TypeError):
+        # Values which have no arrow type (or mixed types) are stored as strings. Note
+        # that the transformer casts all the values to strings anyway.
+        return pa.array([str(value) if value is not None else None for value in values])
+
+
+def split_record_batches(batches, pk_col):
+    """ Regroup the rows of the record batches by primary key value and yield one
+    {column: [values]} dict per primary key, as Extractor.split_records does for dataframes.
+    """
+    return split_groups(batches, pk_col, group_by_primary_key)
+
+
+def group_by_primary_key(batch, pk_col):
+    """ Slice a record batch in {column: [values]} dicts of rows sharing the same primary
+    key value. Primary key values are dictionary encoded to find the groups.
+    """
+    if batch.num_rows == 0:
+        return
+    pk_array = batch.column(batch.schema.get_field_index(pk_col))
+    codes = pk_array.dictionary_encode().indices.to_numpy(zero_copy_only=False)
+    # Missing primary key values have a null code, which becomes NaN in numpy
+    codes = np.nan_to_num(codes, nan=-1).astype(np.int64)
+
+    order, starts, ends = group_boundaries(codes)
+    if order is not None:
+        batch = batch.take(pa.array(order))
+
+    columns = batch.to_pydict()
+    for start, end in zip(starts, ends):
+        yield {col: values[start:end] for col, values in columns.items()}
@@ -0,0 +1,93 @@
+"""
+Limits on the resources used by an extraction, so that a mapping fetching huge rows or
+too many rows can't exhaust the memory of the extractor or hold the source DB forever:
+- the number of rows of the chunks fetched by a query adapts to a memory budget,
+- the queries of a resource can have a statement timeout and a maximum number of rows.
+"""
+
+import json
+import os
+import threading
+
+from extractor.src.errors import RowLimitExceeded
+
+# Maximum size in bytes of a chunk of rows in memory (0 disables the adaptive chunk size).
+# Each thread extracting a primary key range holds about one chunk at a time.
+EXTRACT_MEMORY_BUDGET = int(os.getenv("EXTRACT_MEMORY_BUDGET", 128 * 2 ** 20))
+# Number of rows of the first chunk of a query, used to estimate the size of the rows
+SAMPLE_CHUNK_SIZE = int(os.getenv("SAMPLE_CHUNK_SIZE", 1000))
+# Default statement timeout in seconds of the queries of a resource (0 means none)
+EXTRACT_STATEMENT_TIMEOUT = float(os.getenv("EXTRACT_STATEMENT_TIMEOUT", 0))
+# Default maximum number of rows fetched by the extraction of a resource (0 means none)
+EXTRACT_MAX_ROWS = int(os.getenv("EXTRACT_MAX_ROWS", 0))
+# Limits of specific resources, overriding the defaults, as a json object like
+# {"<resource id>": {"statement_timeout": 600, "max_rows": 1000000}}
+EXTRACT_RESOURCE_LIMITS = json.loads(os.getenv("EXTRACT_RESOURCE_LIMITS", "{}"))
+
+
+class ChunkSizer:
+    """ Number of rows of the next chunk fetched by a query. It is at most max_size and,
+    if memory_budget is set, it is adapted to the average size of the rows of the
+    previous chunks so that a chunk fits in memory_budget bytes. The first chunk is
+    then small, to estimate the size of the rows before fetching a lot of them.
+    """
+
+    def __init__(self, max_size, memory_budget=None, sample_size=SAMPLE_CHUNK_SIZE):
+        self.max_size = max_size
+        self.memory_budget = memory_budget
+        self.size = max_size if memory_budget is None else min(max_size, sample_size)
+        self.row_bytes = None
+
+    @property
+    def adaptive(self):
+        return self.memory_budget is not None
+
+    def observe(self, n_rows, n_bytes):
+        """ Adapt the chunk size to a chunk of n_rows rows using n_bytes in memory.
+        """
+        if not self.adaptive or n_rows == 0:
+            return
+        row_bytes = n_bytes / n_rows
+        # Smooth the estimation, the size of the rows may vary along the table
+        self.row_bytes = row_bytes if self.row_bytes is None else (self.row_bytes + row_bytes) / 2
+        self.size = max(1, min(self.max_size, int(self.memory_budget / self.row_bytes)))
+
+
+class ResourceLimits:
+    """ Limits of the extraction of a resource: the statement timeout of its queries and
+    the maximum number of rows fetched by all of them (the queries of the primary key
+    ranges of a resource share the same ResourceLimits).
+    """
+
+    def __init__(self, statement_timeout=None, max_rows=None):
+        self.statement_timeout = statement_timeout
+        self.max_rows = max_rows
+        self.n_rows = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_resources(cls, resource_ids):
+        """ Build the limits of the extraction of resources, the strictest limits of the
+        resources being used if they are extracted together (see shared scans).
+        """
+        timeouts, max_rows = [], []
+        for resource_id in resource_ids:
+            limits = EXTRACT_RESOURCE_LIMITS.get(resource_id, {})
+            timeouts.append(limits.get("statement_timeout", EXTRACT_STATEMENT_TIMEOUT))
+            max_rows.append(limits.get("max_rows", EXTRACT_MAX_ROWS))
+        return cls(
+            min((timeout for timeout in timeouts if timeout), default=None),
+            min((rows for rows in max_rows if rows), default=None),
+        )
+
+    def count_rows(self, n_rows):
+        """ Count fetched rows and raise a RowLimitExceeded error if there are too many.
+        """
+        if self.max_rows is None:
+            return
+        with self.lock:
+            self.n_rows += n_rows
+            if self.n_rows > self.max_rows:
+                raise RowLimitExceeded(
+                    f"The extraction fetched more than {self.max_rows} rows, it was stopped."
+                )
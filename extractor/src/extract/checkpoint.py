@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+
+from extractor.src.config.logger import create_logger
+
+logger = create_logger("checkpoint")
+
+# Number of times the extraction of a resource in a batch is attempted before its
+# checkpoint is dropped
+CHECKPOINT_MAX_ATTEMPTS = int(os.getenv("CHECKPOINT_MAX_ATTEMPTS", 3))
+# Number of seconds after which the checkpoint of an unfinished extraction is dropped
+CHECKPOINT_TTL = int(os.getenv("CHECKPOINT_TTL", 24 * 3600))
+
+
+class Checkpoint:
+    """ Progress of the extraction of a resource in a batch, persisted in a StateStore so
+    that an interrupted extraction can be resumed. It holds the primary key ranges and
+    the watermark bounds of the extraction, and the last primary key which was fully
+    processed in each range.
+    A checkpoint is dropped once the extraction was attempted CHECKPOINT_MAX_ATTEMPTS
+    times or CHECKPOINT_TTL seconds after it was started.
+    """
+
+    def __init__(self, store, batch_id, analysis):
+        self.store = store
+        self.key = f"{batch_id}:{analysis.resource_id}"
+        self.batch_id = batch_id
+        self.resource_id = analysis.resource_id
+        self.pk_col = analysis.primary_key_column.dataframe_column_name()
+        self.lock = threading.Lock()
+        # None until the extraction is started
+        self.state = store.get(self.key)
+
+    @property
+    def pk_ranges(self):
+        return self.state["pk_ranges"]
+
+    @property
+    def watermark(self):
+        return self.state["watermark"]
+
+    def start(self, pk_ranges, watermark):
+        self.state = {
+            "batch_id": self.batch_id,
+            "resource_id": self.resource_id,
+            "pk_ranges": pk_ranges,
+            "watermark": watermark,
+            "last_pks": [None] * len(pk_ranges),
+            "started_at": time.time(),
+            "attempts": 1,
+        }
+        self.store.set(self.key, self.state)
+
+    def resume(self):
+        with self.lock:
+            self.state["attempts"] += 1
+            self.store.set(self.key, self.state)
+
+    @property
+    def expired(self):
+        return is_expired(self.state)
+
+    def fail(self):
+        """ Drop the checkpoint of a failed extraction if it cannot be attempted again.
+        """
+        if self.expired:
+            logger.warning(
+                f"Dropping the checkpoint of {self.resource_id} in batch {self.batch_id} "
+                f"after {self.state['attempts']} failed attempts"
+            )
+            self.delete()
+
+    def last_pk(self, range_index):
+        return self.state["last_pks"][range_index]
+
+    def save(self, range_index, record):
+        """ Save the primary key of a record as the last one processed in its range.
+        The records of a range are ordered by primary key.
+        """
+        with self.lock:
+            self.state["last_pks"][range_index] = record[self.pk_col][0]
+            self.store.set(self.key, self.state)
+
+    def delete(self):
+        self.store.delete(self.key)
+
+
+def is_expired(state):
+    """ Whether the extraction saved in a checkpoint state should not be resumed.
+    """
+    return (
+        state.get("attempts", 0) >= CHECKPOINT_MAX_ATTEMPTS
+        or time.time() - state.get("started_at", 0) > CHECKPOINT_TTL
+    )
+
+
+class SharedProgress:
+    """ Progress of several consumers of the same records (see pipeline.fan_out): a record
+    is saved as processed once all the consumers have processed it.
+    """
+
+    def __init__(self, n_consumers, pk_col, save_progress):
+        """
+        :param n_consumers: number of consumers of the records
+        :param pk_col: name of the primary key column of the records
+        :param save_progress: function saving a record as processed, see Checkpoint.save
+        """
+        self.pk_col = pk_col
+        self.save_progress = save_progress
+        self.lock = threading.Lock()
+        # Position of the primary keys which were not processed by all the consumers
+        self.positions = {}
+        self.consumer_positions = [-1] * n_consumers
+        self.saved_position = -1
+
+    def track(self, records):
+        """ Number the records given to the consumers.
+        """
+        for position, record in enumerate(records):
+            with self.lock:
+                self.positions[record[self.pk_col][0]] = position
+            yield record
+
+    def save(self, consumer_index, record):
+        """ Save that a consumer processed a record and the ones before it.
+        """
+        with self.lock:
+            self.consumer_positions[consumer_index] = self.positions[record[self.pk_col][0]]
+            position = min(self.consumer_positions)
+            if position <= self.saved_position:
+                return
+
+            for pk, pk_position in list(self.positions.items()):
+                if pk_position == position:
+                    self.save_progress({self.pk_col: [pk]})
+                if pk_position <= position:
+                    del self.positions[pk]
+            self.saved_position = position
@@ -0,0 +1,70 @@
+import os
+import weakref
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from extractor.src.config.logger import create_logger
+from extractor.src.extract.lru_cache import LRUCache
+
+logger = create_logger("engine_registry")
+
+# Maximum number of source databases the extractor keeps connections to
+MAX_ENGINES = int(os.getenv("EXTRACT_MAX_ENGINES", 8))
+# Connection pool settings of each source database
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+
+
+class EngineRegistry:
+    """ Registry of the sql alchemy engines used by the extractor, indexed by db url.
+    Each engine comes with a connection pool and a scoped session, which provides
+    a distinct session to each thread. The least recently used engines are disposed
+    when more than max_engines sources are used, along with the sessions of all the
+    threads.
+    """
+
+    def __init__(
+        self, max_engines=MAX_ENGINES, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW
+    ):
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.engines = LRUCache(max_engines, on_evict=self.dispose)
+
+    def get(self, db_string):
+        """ Get the (engine, scoped session) couple for a db url.
+        """
+        engine, session, _ = self.engines.get_or_set(db_string, lambda: self.create(db_string))
+        return engine, session
+
+    def create(self, db_string):
+        logger.debug("Creating engine for %s", db_string)
+        engine = create_engine(
+            db_string,
+            pool_size=self.pool_size,
+            max_overflow=self.max_overflow,
+            # Check that pooled connections are still alive before using them
+            pool_pre_ping=True,
+        )
+        session_factory = sessionmaker(engine)
+        # The sessions created for the threads, which are closed with the engine
+        sessions = weakref.WeakSet()
+
+        def create_session():
+            session = session_factory()
+            sessions.add(session)
+            return session
+
+        return engine, scoped_session(create_session), sessions
+
+    @staticmethod
+    def dispose(registered_engine):
+        engine, session, sessions = registered_engine
+        logger.debug("Disposing engine for %s", engine.url)
+        # session.remove() only closes the session of the current thread, the other
+        # threads' sessions are closed so that they give their connections back
+        session.remove()
+        for thread_session in list(sessions):
+            thread_session.close()
+        # Connections currently checked out are closed when they are given back
+        engine.dispose()
@@ -0,0 +1,54 @@
+"""
+Estimation of the cost of the extraction queries with the EXPLAIN statement of the DB
+dialects which have one.
+"""
+
+import uuid
+
+from extractor.src.config.logger import create_logger
+
+logger = create_logger("explain")
+
+
+def explain_query(connection, compiled_query, params=None):
+    """ Get the estimations of the planner of the DB for a compiled query.
+
+    Returns:
+        a {"rows": estimated number of rows, "cost": estimated cost, "plan": raw plan}
+        dict, or None if the dialect of the connection has no supported EXPLAIN
+    """
+    if connection.dialect.name not in ("postgresql", "oracle"):
+        logger.info(f"EXPLAIN is not supported for {connection.dialect.name}")
+        return None
+
+    sql = compiled_query.string
+    params = compiled_query.construct_params(params or {})
+    if connection.dialect.name == "postgresql":
+        return explain_postgresql(connection, sql, params)
+    return explain_oracle(connection, sql, params)
+
+
+def explain_postgresql(connection, sql, params):
+    # The JSON plan is parsed by psycopg2
+    (plan,) = connection.execute(f"EXPLAIN (FORMAT JSON) {sql}", params).scalar()
+    return {"rows": plan["Plan"]["Plan Rows"], "cost": plan["Plan"]["Total Cost"], "plan": plan}
+
+
+def explain_oracle(connection, sql, params):
+    # The plan is written in the plan table, where it is identified by a statement id
+    statement_id = uuid.uuid4().hex[:30]
+    connection.execute(f"EXPLAIN PLAN SET STATEMENT_ID = '{statement_id}' FOR {sql}", params)
+    try:
+        rows = connection.execute(
+            "SELECT id, operation, options, object_name, cardinality, cost FROM plan_table "
+            "WHERE statement_id = :statement_id ORDER BY id",
+            statement_id=statement_id,
+        ).fetchall()
+    finally:
+        connection.execute(
+            "DELETE FROM plan_table WHERE statement_id = :statement_id",
+            statement_id=statement_id,
+        )
+    plan = [dict(row) for row in rows]
+    # The first step of the plan gives the estimations of the whole statement
+    return {"rows": plan[0]["cardinality"], "cost": plan[0]["cost"], "plan": plan}
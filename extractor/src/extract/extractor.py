@@ -1,14 +1,39 @@
+import copy
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import deque
+from itertools import zip_longest
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import List
 
 import pandas as pd
 
-from sqlalchemy import create_engine, MetaData, Table, Column as AlchemyColumn
-from sqlalchemy.orm import sessionmaker, Query
+from sqlalchemy import bindparam, func, literal, select, Table
+from sqlalchemy import Boolean, Date, DateTime, Enum, Integer, Numeric, String, Time
+from sqlalchemy import Column as AlchemyColumn
+from sqlalchemy.dialects.postgresql import array_agg
+from sqlalchemy.engine import Compiled, Engine
+from sqlalchemy.orm import Query
 
+from analyzer.src.analyze.mapping import build_join_graph, SQUASHED_COLUMN
 from analyzer.src.analyze.sql_column import SqlColumn
 from analyzer.src.analyze.sql_join import SqlJoin
 
 from extractor.src.config.logger import create_logger
+from extractor.src.extract import arrow, pg_copy, pushdown
+from extractor.src.extract.explain import explain_query
+from extractor.src.extract.budget import ChunkSizer, EXTRACT_MEMORY_BUDGET, ResourceLimits
+from extractor.src.extract.checkpoint import Checkpoint, is_expired
+from extractor.src.extract.engine_registry import EngineRegistry
+from extractor.src.extract.grouping import group_boundaries, same_value, split_groups
+from extractor.src.extract.lru_cache import LRUCache
+from extractor.src.extract.schema_cache import SchemaCache
+from extractor.src.extract.source_limiter import source_key, SourceLimiter
+from extractor.src.extract.state_store import StateStore
 
 logger = create_logger("extractor")
 
@@ -25,14 +50,102 @@ SQL_RELATIONS_TO_METHOD = {
     "LIKE": "like",
 }
 DB_DRIVERS = {"POSTGRES": "postgresql", "ORACLE": "oracle+cx_oracle"}
+# Maximum number of rows fetched from the source DB at once
+CHUNK_SIZE = int(os.getenv("EXTRACT_CHUNK_SIZE", 10000))
+# "pandas" fetches the rows in pandas dataframes, "arrow" in Arrow record batches, which
+# are grouped and serialized without boxing every value in pandas object columns.
+# "copy" exports the rows of PostgreSQL sources with COPY (see pg_copy) and parses them in
+# pandas dataframes of strings when all the extracted columns are strings; other queries
+# are fetched as with "pandas".
+EXTRACT_BACKEND = os.getenv("EXTRACT_BACKEND", "pandas")
+# Number of primary key ranges extracted concurrently when a whole table is extracted.
+# Note that the connection pool (see DB_POOL_SIZE) should be large enough. If it is not
+# set, it is chosen by the automatic strategy (see AUTO_STRATEGY) or defaults to 1.
+EXTRACT_PARTITIONS = int(os.getenv("EXTRACT_PARTITIONS", 0)) or None
+# If true, resources whose mapping has a watermark column are extracted incrementally:
+# a batch only fetches the rows whose watermark is greater than the one of the last batch.
+INCREMENTAL_EXTRACTION = os.getenv("INCREMENTAL_EXTRACTION", "true").lower() == "true"
+# Watermark columns of the resources whose mapping doesn't define one (Pyrog doesn't
+# expose them yet), as a json object like
+# {"<resource id>": {"owner": "<owner>", "table": "<table>", "column": "<column>"}}
+EXTRACT_WATERMARK_COLUMNS = json.loads(os.getenv("EXTRACT_WATERMARK_COLUMNS", "{}"))
+# Lists of primary key values longer than this are extracted by chunks (note that
+# Oracle does not accept more than 1000 elements in an IN clause)
+PK_VALUES_CHUNK_SIZE = int(os.getenv("PK_VALUES_CHUNK_SIZE", 1000))
+# Number of chunks of primary key values extracted concurrently
+PK_VALUES_WORKERS = int(os.getenv("PK_VALUES_WORKERS", 4))
+# Maximum number of compiled queries kept in cache
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 256))
+# If true, each independent branch of the joins of a resource is extracted by its own
+# query, so that the rows of the one-to-many joins of different branches are not
+# multiplied together (see Extractor.extract_branches). If it is not set, it is chosen by
+# the automatic strategy (see AUTO_STRATEGY) or defaults to false.
+DECOMPOSE_JOINS = {"true": True, "false": False}.get(os.getenv("DECOMPOSE_JOINS", "").lower())
+# If true, the cleaning scripts which have an SQL equivalent for the DB dialect are applied
+# in the extraction query (see pushdown.CLEANING_SCRIPTS_SQL)
+PUSHDOWN_CLEANING_SCRIPTS = os.getenv("PUSHDOWN_CLEANING_SCRIPTS", "true").lower() == "true"
+# Concept maps with at most this number of codes are applied in the extraction query,
+# the bigger ones are applied by the transformer (0 disables it)
+CONCEPT_MAP_PUSHDOWN_MAX_SIZE = int(os.getenv("CONCEPT_MAP_PUSHDOWN_MAX_SIZE", 200))
+# If true, the rows of the joined tables are aggregated in arrays by primary key in the
+# extraction query when possible (see aggregate_joins)
+AGGREGATE_JOINS = os.getenv("AGGREGATE_JOINS", "false").lower() == "true"
+# Types of columns which can be aggregated in arrays decoded by the driver (apart from the
+# enums, whose arrays are not decoded), the other joined columns prevent the aggregation
+AGGREGATED_TYPES = (Boolean, Date, DateTime, Integer, Numeric, String, Time)
+# If true, the number of partitions and the decomposition of the joins of the extraction of
+# a whole table are chosen from the estimations of the DB planner (see Extractor.explain),
+# unless EXTRACT_PARTITIONS and DECOMPOSE_JOINS are set
+AUTO_STRATEGY = os.getenv("AUTO_STRATEGY", "false").lower() == "true"
+# Estimated number of rows extracted by each partition with the automatic strategy
+STRATEGY_ROWS_PER_PARTITION = int(os.getenv("STRATEGY_ROWS_PER_PARTITION", 500000))
+# Maximum number of partitions with the automatic strategy
+STRATEGY_MAX_PARTITIONS = int(os.getenv("STRATEGY_MAX_PARTITIONS", 8))
+# The joins are decomposed by the automatic strategy if it divides the number of
+# extracted rows by at least this factor
+STRATEGY_DECOMPOSE_GAIN = float(os.getenv("STRATEGY_DECOMPOSE_GAIN", 2))
+# Number of seconds during which the strategy chosen for a resource is reused
+STRATEGY_TTL = int(os.getenv("STRATEGY_TTL", 3600))
+# Separator of the resource ids in the id of a shared scan (see Extractor.shared_analysis)
+SHARED_SCAN_SEPARATOR = ","
 
 
 class Extractor:
     def __init__(self):
-        self.db_string = None
-        self.engine = None
-        self.metadata = None
-        self.session = None
+        # Engines and reflected tables are shared by all the threads, but each thread
+        # has its own current connection (see update_connection).
+        self.engines = EngineRegistry()
+        self.schema_cache = SchemaCache()
+        # High-water marks of the incremental extractions
+        self.watermarks = StateStore("watermarks")
+        self.checkpoints = StateStore("checkpoints")
+        # Compiled queries by (db, resource id, mapping version, bound parameters)
+        self.compiled_queries = LRUCache(QUERY_CACHE_SIZE)
+        # Limits of the queries run on each source DB
+        self.limiter = SourceLimiter()
+        # Automatic strategies by (db, resource id, mapping version)
+        self.strategies = LRUCache(QUERY_CACHE_SIZE, ttl=STRATEGY_TTL)
+        self._local = threading.local()
+
+    @property
+    def db_string(self):
+        return getattr(self._local, "db_string", None)
+
+    @property
+    def engine(self):
+        return getattr(self._local, "engine", None)
+
+    @engine.setter
+    def engine(self, engine):
+        self._local.engine = engine
+
+    @property
+    def session(self):
+        return getattr(self._local, "session", None)
+
+    @session.setter
+    def session(self, session):
+        self._local.session = session
 
     @staticmethod
     def build_db_url(credentials):
@@ -52,29 +165,59 @@ class Extractor:
 
         return f"{db_handler}://{login}:{password}@{host}:{port}/{database}"
 
+    @staticmethod
+    def source(credentials):
+        """ Identify the source DB described by credentials, see SourceLimiter.
+        """
+        return source_key(credentials["host"], credentials["port"], credentials["database"])
+
+    @staticmethod
+    def engine_source(engine):
+        return source_key(engine.url.host, engine.url.port, engine.url.database)
+
     def update_connection(self, credentials):
+        """ Make the current thread use the source DB described by credentials.
+        Engines are kept in a registry so switching back to a previous source does
+        not create new connections. The queries run on the source are limited by the
+        SourceLimiter of the extractor.
+        """
         new_db_string = self.build_db_url(credentials)
         logger.debug("Updating connection to %s", new_db_string)
 
-        if new_db_string != self.db_string:
-            self.db_string = new_db_string
-            self.engine = create_engine(self.db_string)
-            self.metadata = MetaData(bind=self.engine)
-            self.session = sessionmaker(self.engine)()
+        self._local.db_string = new_db_string
+        self.engine, self.session = self.engines.get(new_db_string)
 
-    def extract(self, resource_mapping, analysis, pk_values=None):
+    def extract(
+        self,
+        resource_mapping,
+        analysis,
+        pk_values=None,
+        pk_range=None,
+        watermark=None,
+        pk_after=None,
+        limits=None,
+    ):
         """ Main method of the Extractor class.
         It builds the sql alchemy query that will fetch the columns needed from the
-        source DB, run it and return the result as a pandas dataframe.
+        source DB, run it and return the result as a stream of pandas dataframes.
 
         Args:
             resource_mapping: the mapping.
             analysis: an Analyis instance built by the Analyzer.
             pk_values: it not None, the Extractor will fetch only the rows for which
                 the primary key values are in pk_values.
+            pk_range: if not None, a (low, high) couple, the Extractor will fetch only
+                the rows for which low <= primary key < high. Bounds can be None.
+            watermark: if not None, a (low, high) couple, the Extractor will fetch only
+                the rows for which low < watermark column <= high. low can be None.
+            pk_after: if not None, the Extractor will fetch only the rows for which
+                the primary key is greater than pk_after.
+            limits: the ResourceLimits of the extraction, see resource_limits.
 
         Returns:
-            a pandas dataframe where there all the columns asked for in the mapping
+            a generator of chunks of at most CHUNK_SIZE rows (pandas dataframes or Arrow
+            record batches, see EXTRACT_BACKEND) with all the columns asked for in the
+            mapping
         """
         if self.session is None:
             raise ValueError(
@@ -83,16 +226,770 @@ class Extractor:
 
         logger.info(f"Extracting resource: {resource_mapping['definitionId']}")
 
-        # Build sqlalchemy query
-        query = self.sqlalchemy_query(
+        compiled_query, params = self.prepare_query(
+            resource_mapping,
+            analysis,
             analysis.columns,
             analysis.joins,
-            analysis.primary_key_column,
-            resource_mapping,
             pk_values,
+            pk_range,
+            watermark,
+            pk_after,
+            aggregate=self.aggregate_joins(analysis),
+        )
+        return self.run_sql_query(
+            compiled_query, params, limits=limits or self.resource_limits(analysis)
+        )
+
+    def prepare_query(
+        self,
+        resource_mapping,
+        analysis,
+        columns,
+        joins,
+        pk_values=None,
+        pk_range=None,
+        watermark=None,
+        pk_after=None,
+        variant=None,
+        aggregate=False,
+    ):
+        """ Get the compiled query fetching columns (through joins) from the cache, or
+        build it. variant distinguishes the different queries of a same resource. If
+        aggregate is true, the rows of the joined tables are aggregated by primary key
+        (see aggregated_query).
+
+        Returns:
+            a (compiled query, bound parameters values) couple
+        """
+        # The values which change from an extraction to another are bound parameters
+        # so that the compiled query can be reused.
+        params = {}
+
+        def bind(name, value, expanding=False):
+            if value is None:
+                return None
+            params[name] = value
+            return bindparam(name, expanding=expanding)
+
+        pk_values = bind("pk_values", pk_values, expanding=True)
+        if pk_range is not None:
+            pk_range = (bind("pk_low", pk_range[0]), bind("pk_high", pk_range[1]))
+        if watermark is not None:
+            watermark = (
+                analysis.watermark_column,
+                bind("watermark_low", watermark[0]),
+                bind("watermark_high", watermark[1]),
+            )
+        pk_after = bind("pk_after", pk_after)
+        cleaned_columns = self.cleaned_columns(analysis, columns)
+        translated_columns = self.translated_columns(analysis, columns)
+        main_column_names = self.main_table_column_names(analysis) if aggregate else None
+
+        def compile_query():
+            logger.debug(f"Building query for resource {analysis.resource_id}")
+            query = self.sqlalchemy_query(
+                columns,
+                joins,
+                analysis.primary_key_column,
+                resource_mapping,
+                pk_values,
+                pk_range,
+                watermark,
+                pk_after,
+                cleaned_columns,
+                translated_columns,
+                main_column_names,
+            )
+            return query.statement.compile(dialect=self.engine.dialect)
+
+        cache_key = (
+            self.db_string,
+            analysis.resource_id,
+            self.mapping_version(resource_mapping),
+            variant,
+            aggregate,
+            # The columns of a shared scan don't only depend on resource_mapping
+            tuple(sorted(str(column) for column in columns)),
+            tuple(sorted(column.cleaned_column_name() for column in cleaned_columns)),
+            # The concept maps are fetched separately from the mapping
+            tuple(
+                sorted(
+                    (column.translated_column_name(), self.concept_map_version(column))
+                    for column in translated_columns
+                )
+            ),
+            tuple(sorted(params)),
+        )
+        return self.compiled_queries.get_or_set(cache_key, compile_query), params
+
+    @staticmethod
+    def shared_scan_key(resource_mapping, analysis):
+        """ Key identifying the rows fetched to extract a resource: resources with the same
+        key (same source, primary key, joins, filters and watermark) can be extracted by a
+        single query fetching the union of their columns (see shared_analysis).
+        """
+        filters = sorted(
+            (
+                filter["sqlColumn"]["owner"] or "",
+                filter["sqlColumn"]["table"],
+                filter["sqlColumn"]["column"],
+                filter["relation"],
+                json.dumps(filter["value"], default=str),
+            )
+            for filter in resource_mapping["filters"]
+        )
+        return (
+            json.dumps(resource_mapping["source"]["credential"], sort_keys=True, default=str),
+            str(analysis.primary_key_column),
+            tuple(sorted(str(join) for join in analysis.joins)),
+            tuple(filters),
+            str(analysis.watermark_column),
+        )
+
+    @staticmethod
+    def shared_analysis(analyses):
+        """ Build the analysis of the shared scan of resources with the same
+        shared_scan_key. Its resource_id is the list of their ids joined by
+        SHARED_SCAN_SEPARATOR.
+        """
+        shared_analysis = copy.copy(analyses[0])
+        shared_analysis.resource_id = SHARED_SCAN_SEPARATOR.join(
+            sorted(analysis.resource_id for analysis in analyses)
+        )
+        shared_analysis.columns = set().union(*(analysis.columns for analysis in analyses))
+        shared_analysis.attributes = [
+            attribute for analysis in analyses for attribute in analysis.attributes
+        ]
+        return shared_analysis
+
+    @staticmethod
+    def mapping_version(resource_mapping):
+        """ Hash of the mapping, which changes whenever the mapping is modified.
+        """
+        serialized = json.dumps(resource_mapping, sort_keys=True, default=str)
+        return hashlib.sha1(serialized.encode()).hexdigest()
+
+    @staticmethod
+    def resource_version(resource_mapping, analysis):
+        """ Hash of the mapping and of the concept maps of a resource, which changes
+        whenever the documents built from the same rows may change.
+        """
+        concept_map_versions = sorted(
+            {
+                (column.concept_map.id, Extractor.concept_map_version(column))
+                for attribute in analysis.attributes
+                for column in attribute.columns
+                if column.concept_map is not None
+            }
+        )
+        serialized = json.dumps(
+            [Extractor.mapping_version(resource_mapping), concept_map_versions]
+        )
+        return hashlib.sha1(serialized.encode()).hexdigest()
+
+    @staticmethod
+    def concept_map_version(column: SqlColumn):
+        """ Hash of the codes of the concept map of a column, which changes whenever the
+        concept map is modified.
+        """
+        serialized = json.dumps(column.concept_map.mapping, sort_keys=True, default=str)
+        return hashlib.sha1(serialized.encode()).hexdigest()
+
+    def extract_partitions(
+        self,
+        resource_mapping,
+        analysis,
+        process_records,
+        pk_values=None,
+        partitions=None,
+        decompose=None,
+        batch_id=None,
+    ):
+        """ Extract a resource by splitting the primary key space in several ranges,
+        extracted concurrently. The records (see split_records) of each range are
+        processed with process_records in the thread which extracted them.
+        The table is extracted at once if pk_values is provided or if the primary key
+        is not an integer.
+        If the resource has a watermark column, only the rows which changed since the
+        last extraction of the whole table are extracted.
+        If decompose is true (defaults to DECOMPOSE_JOINS), the join branches of the
+        resource are extracted by different queries when possible (see extract_branches).
+        When a whole table is extracted, partitions (defaults to EXTRACT_PARTITIONS) and
+        decompose are chosen from the estimations of the DB if AUTO_STRATEGY is true and
+        they are neither provided nor configured.
+        A static resource (whose mapping has no column) is not extracted from the DB:
+        process_records gets a single empty record, from which its instance is built.
+        If batch_id is provided when a whole table is extracted, the progress of the
+        extraction is saved in a Checkpoint, and an interrupted extraction of the same
+        batch resumes after the last saved primary key of each range. process_records
+        is then called with a second argument, a function taking a record which saves it
+        as processed (the records after it are extracted again if the extraction is
+        resumed).
+
+        Returns:
+            the list of the values returned by process_records for each range. The
+            list is empty if no row changed since the last incremental extraction.
+        """
+        if analysis.is_static:
+            logger.debug(f"Resource {analysis.resource_id} is static")
+            return [process_records(iter([{}]))]
+
+        partitions, branches = self.extraction_strategy(
+            resource_mapping, analysis, pk_values, partitions, decompose
+        )
+
+        checkpoint = None
+        if batch_id is not None and pk_values is None:
+            checkpoint = Checkpoint(self.checkpoints, batch_id, analysis)
+
+        plan = self.plan_partitions(resource_mapping, analysis, pk_values, partitions, checkpoint)
+        if plan is None:
+            return []
+        watermark, pk_ranges = plan
+
+        extract_records = partial(
+            self.extract_records,
+            watermark=watermark,
+            branches=branches,
+            limits=self.resource_limits(analysis),
+        )
+        engine, session = self.engine, self.session
+
+        def extract_range(range_index):
+            # Worker threads use the connection of the calling thread
+            self.engine, self.session = engine, session
+            if pk_values is not None and len(pk_values) > PK_VALUES_CHUNK_SIZE:
+                records = self.extract_pk_values_chunks(
+                    resource_mapping, analysis, pk_values, extract_records
+                )
+            elif checkpoint:
+                records = extract_records(
+                    resource_mapping,
+                    analysis,
+                    pk_range=pk_ranges[range_index],
+                    pk_after=checkpoint.last_pk(range_index),
+                )
+                return process_records(records, partial(checkpoint.save, range_index))
+            else:
+                records = extract_records(
+                    resource_mapping, analysis, pk_values, pk_ranges[range_index]
+                )
+            return process_records(records)
+
+        results = self.run_ranges(extract_range, len(pk_ranges), checkpoint)
+
+        if watermark is not None:
+            # The whole table was extracted successfully, we can move the high-water mark
+            self.watermarks.set(self.watermark_key(analysis), watermark[1])
+        if checkpoint:
+            checkpoint.delete()
+
+        return results
+
+    def extraction_strategy(self, resource_mapping, analysis, pk_values, partitions, decompose):
+        """ Get the number of partitions (None for the default) and the join branches
+        (None if the joins are not decomposed) of an extraction, see extract_partitions.
+        """
+        if decompose is None:
+            decompose = DECOMPOSE_JOINS
+        if pk_values is None:
+            if partitions is None:
+                partitions = EXTRACT_PARTITIONS
+            if partitions is None or decompose is None:
+                # The automatic strategy only chooses what is not configured explicitly
+                auto_partitions, auto_decompose = self.auto_strategy(resource_mapping, analysis)
+                partitions = auto_partitions if partitions is None else partitions
+                decompose = auto_decompose if decompose is None else decompose
+        branches = self.join_branches(resource_mapping, analysis) if decompose else None
+        return partitions, branches
+
+    def auto_strategy(self, resource_mapping, analysis):
+        """ Choose the number of partitions and the decomposition of the joins of the
+        extraction of a whole table (see explain).
+
+        Returns:
+            a (partitions, decompose) couple, (None, None) if the strategy can't be
+            chosen automatically
+        """
+        if not AUTO_STRATEGY:
+            return None, None
+
+        def choose():
+            try:
+                explanation = self.explain(resource_mapping, analysis)
+            except Exception as e:
+                logger.warning(f"Could not estimate the cost of {analysis.resource_id}: {e}")
+                return None, None
+            if explanation["strategy"] is None:
+                return None, None
+            logger.info(
+                f"Extracting {analysis.resource_id} with a {explanation['strategy']} query "
+                f"({explanation['estimated_rows']} estimated rows)"
+            )
+            return explanation["partitions"], explanation["decompose"]
+
+        cache_key = (
+            self.db_string,
+            analysis.resource_id,
+            self.mapping_version(resource_mapping),
+        )
+        return self.strategies.get_or_set(cache_key, choose)
+
+    def explain(self, resource_mapping, analysis):
+        """ Estimate the cost of the extraction of a whole table with the EXPLAIN of the
+        DB and choose the extraction strategy:
+        - "decomposed" if extracting the join branches separately (see join_branches)
+          fetches STRATEGY_DECOMPOSE_GAIN times less rows than the joined query,
+        - "partitioned" if the table is big enough to be split in several primary key
+          ranges of about STRATEGY_ROWS_PER_PARTITION rows,
+        - "single" otherwise.
+
+        Returns:
+            a dict with the query, the estimated rows and cost, the estimated rows of the
+            primary key table alone and of the join branches, the join fan-out (rows
+            per primary key), and the chosen strategy, partitions and decompose. The
+            estimations and the strategy are None if the dialect has no EXPLAIN.
+        """
+        query, params = self.prepare_query(
+            resource_mapping, analysis, analysis.columns, analysis.joins
+        )
+        pk_query = self.session.query(self.get_column(analysis.primary_key_column))
+        branches = self.join_branches(resource_mapping, analysis) or []
+
+        with self.engine.connect() as connection:
+            estimation = explain_query(connection, query, params)
+            pk_estimation = explain_query(
+                connection, pk_query.statement.compile(dialect=self.engine.dialect)
+            )
+            branch_estimations = [
+                explain_query(
+                    connection,
+                    *self.prepare_query(
+                        resource_mapping, analysis, columns, joins, variant=f"branch-{index}"
+                    ),
+                )
+                for index, (columns, joins) in enumerate(branches)
+            ]
+
+        explanation = {
+            "query": str(query),
+            "estimated_rows": estimation and estimation["rows"],
+            "estimated_cost": estimation and estimation["cost"],
+            "primary_key_table_rows": pk_estimation and pk_estimation["rows"],
+            "join_fan_out": None,
+            "branches": [
+                {
+                    "tables": sorted({column.table_name() for column in columns}),
+                    "estimated_rows": branch_estimation and branch_estimation["rows"],
+                }
+                for (columns, _), branch_estimation in zip(branches, branch_estimations)
+            ],
+        }
+        if explanation["estimated_rows"] is not None and explanation["primary_key_table_rows"]:
+            explanation["join_fan_out"] = (
+                explanation["estimated_rows"] / explanation["primary_key_table_rows"]
+            )
+        return {**explanation, **self.choose_strategy(explanation)}
+
+    @staticmethod
+    def choose_strategy(explanation):
+        """ Choose the extraction strategy from the estimations of explain.
+
+        Returns:
+            a {"strategy", "partitions", "decompose"} dict
+        """
+        rows = explanation["estimated_rows"]
+        if rows is None:
+            return {"strategy": None, "partitions": None, "decompose": None}
+
+        branch_rows = [branch["estimated_rows"] for branch in explanation["branches"]]
+        decompose = (
+            bool(branch_rows)
+            and None not in branch_rows
+            and sum(branch_rows) * STRATEGY_DECOMPOSE_GAIN <= rows
+        )
+        if decompose:
+            rows = sum(branch_rows)
+        partitions = math.ceil(rows / STRATEGY_ROWS_PER_PARTITION)
+        partitions = max(1, min(STRATEGY_MAX_PARTITIONS, partitions))
+
+        if decompose:
+            strategy = "decomposed"
+        elif partitions > 1:
+            strategy = "partitioned"
+        else:
+            strategy = "single"
+        return {"strategy": strategy, "partitions": partitions, "decompose": decompose}
+
+    @staticmethod
+    def run_ranges(extract_range, n_ranges, checkpoint=None):
+        """ Call extract_range with the index of each primary key range, concurrently if
+        there are several ranges. The checkpoint is told if the extraction fails.
+        """
+        try:
+            if n_ranges == 1:
+                return [extract_range(0)]
+            logger.info(f"Extracting {n_ranges} primary key ranges concurrently")
+            with ThreadPoolExecutor(max_workers=n_ranges) as executor:
+                return list(executor.map(extract_range, range(n_ranges)))
+        except Exception:
+            if checkpoint:
+                checkpoint.fail()
+            raise
+
+    def plan_partitions(
+        self, resource_mapping, analysis, pk_values=None, partitions=None, checkpoint=None
+    ):
+        """ Compute the watermark bounds (see watermark_bounds) and the primary key ranges
+        of an extraction, or get them from the checkpoint if the extraction is resumed.
+
+        Returns:
+            a (watermark, primary key ranges) couple, or None if no row changed since
+            the last incremental extraction
+        """
+        if checkpoint and checkpoint.state and not checkpoint.expired:
+            logger.info(
+                f"Resuming the extraction of {checkpoint.resource_id} "
+                f"in batch {checkpoint.batch_id}"
+            )
+            checkpoint.resume()
+            return checkpoint.watermark, checkpoint.pk_ranges
+
+        watermark = None
+        if pk_values is None and INCREMENTAL_EXTRACTION and analysis.watermark_column:
+            watermark = self.watermark_bounds(resource_mapping, analysis)
+            low, high = watermark
+            if high is None or (low is not None and high <= low):
+                logger.info(f"No row changed since the last extraction (watermark: {low})")
+                return None
+            logger.info(f"Extracting rows with a watermark in ]{low}, {high}]")
+
+        if partitions is None:
+            partitions = (EXTRACT_PARTITIONS or 1) if pk_values is None else 1
+        pk_ranges = [(None, None)]
+        if partitions > 1:
+            pk_ranges = self.primary_key_ranges(resource_mapping, analysis, partitions, watermark)
+
+        if checkpoint:
+            checkpoint.start(pk_ranges, watermark)
+        return watermark, pk_ranges
+
+    def unfinished_checkpoints(self):
+        """ List the extractions of batches which were interrupted and can be resumed.
+        The checkpoints which expired (see Checkpoint) are dropped.
+
+        Returns:
+            a list of (batch_id, resource_id) couples
+        """
+        unfinished = []
+        for key, state in self.checkpoints.items():
+            if is_expired(state):
+                logger.warning(
+                    f"Dropping the expired checkpoint of {state['resource_id']} "
+                    f"in batch {state['batch_id']}"
+                )
+                self.checkpoints.delete(key)
+            else:
+                unfinished.append((state["batch_id"], state["resource_id"]))
+        return unfinished
+
+    def extract_records(
+        self,
+        resource_mapping,
+        analysis,
+        pk_values=None,
+        pk_range=None,
+        watermark=None,
+        pk_after=None,
+        branches=None,
+        limits=None,
+    ):
+        """ Extract the records (see split_records) of a resource, with one query per
+        join branch if branches (see join_branches) is provided.
+        """
+        if branches:
+            return self.extract_branches(
+                resource_mapping,
+                analysis,
+                branches,
+                pk_values,
+                pk_range,
+                watermark,
+                pk_after,
+                limits,
+            )
+        df_chunks = self.extract(
+            resource_mapping, analysis, pk_values, pk_range, watermark, pk_after, limits
+        )
+        return self.split_records(df_chunks, analysis)
+
+    def extract_pk_values_chunks(self, resource_mapping, analysis, pk_values, extract=None):
+        """ Extract the rows of a long list of primary key values by running one query per
+        chunk of PK_VALUES_CHUNK_SIZE values, PK_VALUES_WORKERS queries at a time.
+        The values are sorted before being split, and the results are yielded in the
+        order of the chunks, so the rows of a primary key are never split between
+        several queries and are still ordered by primary key.
+        extract(resource_mapping, analysis, pk_values) extracts a chunk, it defaults to
+        Extractor.extract, and what it yields is yielded.
+        """
+        extract = extract or self.extract
+
+        try:
+            pk_values = sorted(set(pk_values))
+        except TypeError:
+            # Values of different types can't be sorted, we only remove duplicates
+            pk_values = list(dict.fromkeys(pk_values))
+
+        values_chunks = []
+        for start in range(0, len(pk_values), PK_VALUES_CHUNK_SIZE):
+            end = start + PK_VALUES_CHUNK_SIZE
+            values_chunks.append(pk_values[start:end])
+        logger.info(f"Extracting {len(pk_values)} primary keys in {len(values_chunks)} queries")
+
+        # The connection is captured now since the chunks may be consumed from another thread
+        engine, session = self.engine, self.session
+
+        def extract_chunk(values_chunk):
+            self.engine, self.session = engine, session
+            return list(extract(resource_mapping, analysis, values_chunk))
+
+        def extract_chunks():
+            with ThreadPoolExecutor(max_workers=PK_VALUES_WORKERS) as executor:
+                # At most PK_VALUES_WORKERS results are waiting to be consumed
+                futures = deque()
+                for values_chunk in values_chunks:
+                    futures.append(executor.submit(extract_chunk, values_chunk))
+                    if len(futures) >= PK_VALUES_WORKERS:
+                        yield from futures.popleft().result()
+                while futures:
+                    yield from futures.popleft().result()
+
+        return extract_chunks()
+
+    @staticmethod
+    def join_branches(resource_mapping, analysis):
+        """ Split the columns and joins of a resource in independent branches: the main
+        table, and one branch for each table joined on the main table along with the
+        tables joined on it (recursively).
+
+        Returns:
+            a list of (columns, joins) couples, the first one being the main table. The
+            primary key column is in all of them. None is returned if the resource
+            can't be decomposed: if it has less than 2 branches, or if a filter is not
+            on the main table (it would not apply to the rows of the other branches).
+        """
+        main_table = analysis.primary_key_column.table_name()
+        join_graph = build_join_graph(analysis.joins)
+        if len(join_graph[main_table]) < 2:
+            return None
+
+        filter_columns = [
+            SqlColumn(
+                filter["sqlColumn"]["table"],
+                filter["sqlColumn"]["column"],
+                filter["sqlColumn"]["owner"],
+            )
+            for filter in resource_mapping["filters"]
+        ]
+        if analysis.watermark_column:
+            filter_columns.append(analysis.watermark_column)
+        if any(column.table_name() != main_table for column in filter_columns):
+            return None
+
+        branch_tables = [{main_table}]
+        for joined_table in join_graph[main_table]:
+            tables = set()
+            to_visit = [joined_table]
+            while to_visit:
+                table = to_visit.pop()
+                if table not in tables:
+                    tables.add(table)
+                    to_visit.extend(join_graph[table])
+            branch_tables.append(tables)
+
+        n_tables = sum(len(tables) for tables in branch_tables)
+        if len(set().union(*branch_tables)) != n_tables:
+            # Some tables are reached by several branches
+            return None
+        if any(
+            not any(column.table_name() in tables for tables in branch_tables)
+            for column in analysis.columns
+        ):
+            return None
+
+        pk_column = analysis.primary_key_column
+        return [
+            (
+                [pk_column]
+                + [
+                    column
+                    for column in analysis.columns
+                    if column.table_name() in tables and column != pk_column
+                ],
+                [join for join in analysis.joins if join.right.table_name() in tables],
+            )
+            for tables in branch_tables
+        ]
+
+    def extract_branches(
+        self,
+        resource_mapping,
+        analysis,
+        branches,
+        pk_values=None,
+        pk_range=None,
+        watermark=None,
+        pk_after=None,
+        limits=None,
+    ):
+        """ Extract a resource with one query per join branch (see join_branches) and
+        stitch the rows of the branches together by primary key. The number of rows of
+        a primary key is the maximum of the numbers of rows of its branches instead of
+        their product.
+        The queries are run in a single transaction so that they see the same rows
+        (with a repeatable read isolation on PostgreSQL and a read only transaction on
+        Oracle, which both give a snapshot).
+
+        Returns:
+            a generator of records, see split_records
+        """
+        logger.info(
+            f"Extracting resource {resource_mapping['definitionId']} "
+            f"in {len(branches)} join branches"
         )
+        queries = [
+            self.prepare_query(
+                resource_mapping,
+                analysis,
+                columns,
+                joins,
+                pk_values,
+                pk_range,
+                watermark,
+                pk_after,
+                variant=f"branch-{index}",
+            )
+            for index, (columns, joins) in enumerate(branches)
+        ]
+        limits = limits or self.resource_limits(analysis)
+        # The engine is captured now since the records may be consumed from another thread
+        engine = self.engine
+
+        def extract_records():
+            with engine.connect() as connection:
+                if connection.dialect.name == "postgresql":
+                    connection = connection.execution_options(isolation_level="REPEATABLE READ")
+                with connection.begin():
+                    if connection.dialect.name == "oracle":
+                        # Must be the first statement of the transaction
+                        connection.execute("SET TRANSACTION READ ONLY")
+                    branch_records = [
+                        self.split_records(
+                            self.run_sql_query(
+                                query, params, connectable=connection, limits=limits
+                            ),
+                            analysis,
+                        )
+                        for query, params in queries
+                    ]
+                    yield from self.stitch_branches(branch_records, analysis)
 
-        return self.run_sql_query(query)
+        # The queries of the branches share a single connection
+        return self.limiter.limit(self.engine_source(engine), extract_records())
+
+    @staticmethod
+    def stitch_branches(branch_records, analysis):
+        """ Merge the records of the branches of a resource which have the same primary
+        key. The columns of a branch with less rows than the others are padded by
+        repeating their last row so that, as with the rows of an outer join, a branch
+        with a single row gives the same value to all the rows.
+        """
+        pk_col = analysis.primary_key_column.dataframe_column_name()
+        for records in zip_longest(*branch_records):
+            if any(
+                record is None or not same_value(record[pk_col][0], records[0][pk_col][0])
+                for record in records
+            ):
+                raise ValueError(
+                    "The join branches returned different primary keys, the source "
+                    "rows may have changed during the extraction."
+                )
+
+            n_rows = max(len(record[pk_col]) for record in records)
+            stitched_record = {}
+            for record in records:
+                padding = n_rows - len(record[pk_col])
+                for column, values in record.items():
+                    if column not in stitched_record:
+                        stitched_record[column] = values + values[-1:] * padding
+            yield stitched_record
+
+    def primary_key_ranges(self, resource_mapping, analysis, partitions, watermark=None):
+        """ Split the values of the primary key column in contiguous (low, high) ranges
+        of similar widths. The first and last ranges are unbounded so that they include
+        rows inserted after the computation of the bounds.
+        The bounds are computed on the primary key table alone (and on its rows which
+        changed if the watermark column belongs to it): the joins and filters of the
+        resource would make the query much more expensive, and they can only narrow the
+        ranges.
+        """
+        pk_column = self.get_column(analysis.primary_key_column)
+        query = select([func.min(pk_column), func.max(pk_column)])
+        if (
+            watermark is not None
+            and analysis.watermark_column.table_name()
+            == analysis.primary_key_column.table_name()
+        ):
+            low, high = watermark
+            query = query.where(self.get_column(analysis.watermark_column) <= high)
+            if low is not None:
+                query = query.where(self.get_column(analysis.watermark_column) > low)
+        # The query runs on a connection of its own, which is given back to the pool
+        # right away instead of staying in the open transaction of the session
+        with self.engine.connect() as connection:
+            min_pk, max_pk = connection.execute(query).first()
+
+        if not isinstance(min_pk, int) or not isinstance(max_pk, int):
+            logger.info("Primary key is not an integer, the table can't be partitioned")
+            return [(None, None)]
+
+        step = (max_pk - min_pk + 1) / partitions
+        bounds = {min_pk + round(i * step) for i in range(1, partitions)}
+        bounds = sorted(bound for bound in bounds if min_pk < bound <= max_pk)
+        return list(zip([None] + bounds, bounds + [None]))
+
+    def watermark_bounds(self, resource_mapping, analysis):
+        """ Get the (low, high) bounds of the watermark column for an incremental
+        extraction: low is the high-water mark saved after the last extraction (None if
+        there was none) and high is the current max value of the watermark column.
+        Rows modified during the extraction will be fetched by the next one.
+        The max is computed on the table of the watermark column alone since the rows
+        excluded by the joins and filters are not extracted anyway.
+        """
+        query = select([func.max(self.get_column(analysis.watermark_column))])
+        # The query runs on a connection of its own, which is given back to the pool
+        # right away instead of staying in the open transaction of the session
+        with self.engine.connect() as connection:
+            high = connection.execute(query).scalar()
+
+        return self.watermarks.get(self.watermark_key(analysis)), high
+
+    @staticmethod
+    def configure_watermark(analysis):
+        """ Set the watermark column of an analysis from EXTRACT_WATERMARK_COLUMNS if its
+        mapping doesn't define one.
+        """
+        watermark = EXTRACT_WATERMARK_COLUMNS.get(analysis.resource_id)
+        if watermark and analysis.watermark_column is None and not analysis.is_static:
+            analysis.watermark_column = SqlColumn(
+                watermark["table"], watermark["column"], watermark.get("owner")
+            )
+        return analysis
+
+    @staticmethod
+    def watermark_key(analysis):
+        return f"{analysis.resource_id}:{analysis.watermark_column}"
 
     def sqlalchemy_query(
         self,
@@ -101,15 +998,106 @@ class Extractor:
         pk_column: SqlColumn,
         resource_mapping,
         pk_values,
+        pk_range=None,
+        watermark=None,
+        pk_after=None,
+        cleaned_columns=(),
+        translated_columns=(),
+        main_column_names=None,
     ) -> Query:
         """ Builds an sql alchemy query which will be run in run_sql_query.
+        The rows are ordered by primary key so that split_records can regroup them
+        while they are streamed. If main_column_names is provided, the rows of the
+        joined tables are aggregated by primary key (see aggregated_query).
         """
-        alchemy_cols = self.get_columns(columns)
+        alchemy_cols = self.get_columns(columns, cleaned_columns, translated_columns)
         base_query = self.session.query(*alchemy_cols)
         query_w_joins = self.apply_joins(base_query, joins)
-        query_w_filters = self.apply_filters(query_w_joins, resource_mapping, pk_column, pk_values)
+        query_w_filters = self.apply_filters(
+            query_w_joins,
+            resource_mapping,
+            pk_column,
+            pk_values,
+            pk_range,
+            watermark,
+            pk_after,
+            joins,
+        )
+
+        if main_column_names is not None:
+            return self.aggregated_query(query_w_filters, pk_column, main_column_names)
+        return query_w_filters.order_by(self.get_column(pk_column))
+
+    def aggregated_query(self, query: Query, pk_column: SqlColumn, main_column_names) -> Query:
+        """ Wrap a query so that it returns a single row per primary key value, where
+        the values of the columns of the joined tables are aggregated in arrays and the
+        columns of the table of the primary key (main_column_names) keep their single
+        value. All the arrays of a primary key list the joined rows in the same order.
+        A SQUASHED_COLUMN column is added to mark the rows as aggregated.
+        """
+        rows = query.subquery()
+        pk = rows.c[pk_column.dataframe_column_name()]
+        aggregated_cols = [pk]
+        for column in rows.c:
+            if column is pk:
+                continue
+            aggregated = array_agg(column)
+            if column.name in main_column_names:
+                # The rows of a primary key have the same values in the main table
+                aggregated = aggregated[1]
+            aggregated_cols.append(aggregated.label(column.name))
+        aggregated_cols.append(literal(True).label(SQUASHED_COLUMN))
+
+        return self.session.query(*aggregated_cols).group_by(pk).order_by(pk)
+
+    def aggregate_joins(self, analysis) -> bool:
+        """ Whether the rows of the joined tables of a resource can be aggregated by
+        primary key in its extraction query, which needs AGGREGATE_JOINS, PostgreSQL,
+        the pandas backend, tables joined directly to the table of the primary key (the
+        transformer only regroups a single level of joins) and columns whose types can
+        be aggregated in arrays.
+        """
+        if not (
+            AGGREGATE_JOINS
+            and analysis.joins
+            and EXTRACT_BACKEND == "pandas"
+            and self.engine.dialect.name == "postgresql"
+        ):
+            return False
+        if any(child_rules for _, child_rules in analysis.squash_rules[1]):
+            return False
+        main_table = analysis.primary_key_column.table_name()
+        return all(
+            self.is_aggregated_type(self.get_table(col).c[col.column].type)
+            for col in analysis.columns
+            if col.table_name() != main_table
+        )
+
+    @staticmethod
+    def is_aggregated_type(column_type) -> bool:
+        return isinstance(column_type, AGGREGATED_TYPES) and not isinstance(column_type, Enum)
 
-        return query_w_filters
+    @staticmethod
+    def main_table_column_names(analysis):
+        """ Get the names of the extracted columns of the table of the primary key,
+        including the columns cleaned or translated in the query.
+        """
+        main_table = analysis.primary_key_column.table_name()
+        columns = [
+            *analysis.columns,
+            *(col for attribute in analysis.attributes for col in attribute.columns),
+        ]
+        return {
+            name
+            for col in columns
+            if col.table_name() == main_table
+            for name in (
+                col.dataframe_column_name(),
+                col.cleaned_column_name(),
+                col.translated_column_name(),
+            )
+            if name is not None
+        }
 
     def apply_joins(self, query: Query, joins: List[SqlJoin]) -> Query:
         """ Augment the sql alchemy query with joins from the analysis.
@@ -124,13 +1112,38 @@ class Extractor:
         return query
 
     def apply_filters(
-        self, query: Query, resource_mapping, pk_column: SqlColumn, pk_values
+        self,
+        query: Query,
+        resource_mapping,
+        pk_column: SqlColumn,
+        pk_values,
+        pk_range=None,
+        watermark=None,
+        pk_after=None,
+        joins=(),
     ) -> Query:
         """ Augment the sql alchemy query with filters from the analysis.
+        pk_range is a (low, high) couple of primary key values and watermark is a
+        (watermark column, low, high) triple. pk_after is a primary key value after
+        which the rows are fetched. joins are the joins of the query, which are needed
+        when the watermark column belongs to a joined table.
         """
         if pk_values is not None:
             query = query.filter(self.get_column(pk_column).in_(pk_values))
 
+        if pk_range is not None:
+            low, high = pk_range
+            if low is not None:
+                query = query.filter(self.get_column(pk_column) >= low)
+            if high is not None:
+                query = query.filter(self.get_column(pk_column) < high)
+
+        if watermark is not None:
+            query = self.apply_watermark(query, pk_column, watermark, joins)
+
+        if pk_after is not None:
+            query = query.filter(self.get_column(pk_column) > pk_after)
+
         if resource_mapping["filters"]:
             for filter in resource_mapping["filters"]:
                 col = self.get_column(
@@ -145,29 +1158,256 @@ class Extractor:
 
         return query
 
-    def run_sql_query(self, query):
+    def apply_watermark(self, query: Query, pk_column: SqlColumn, watermark, joins) -> Query:
+        """ Only fetch the primary keys which have a row with a watermark in ]low, high].
+        If the watermark column belongs to a joined table, all the rows of these primary
+        keys are fetched, including the joined rows which didn't change, so that the
+        documents built from them are complete.
+        """
+        watermark_column, low, high = watermark
+        conditions = [self.get_column(watermark_column) <= high]
+        if low is not None:
+            conditions.append(self.get_column(watermark_column) > low)
+
+        if watermark_column.table_name() == pk_column.table_name():
+            return query.filter(*conditions)
+
+        changed_pks = self.apply_joins(self.session.query(self.get_column(pk_column)), joins)
+        # The subquery must not be correlated to the tables of the enclosing query
+        changed_pks = changed_pks.filter(*conditions).statement.correlate(None)
+        return query.filter(self.get_column(pk_column).in_(changed_pks))
+
+    def run_sql_query(
+        self, query, params=None, chunksize: int = None, connectable=None, limits=None
+    ):
         """
-        Run a sql query after opening a sql connection
+        Run a sql query through a server-side cursor and yield the result by chunks
 
         args:
-            query (str): a sql query to run
-            connection_type (str): the connection type / database to use
+            query (Query or Compiled): the sql alchemy query to run
+            params (dict): values of the bound parameters of the query
+            chunksize (int): the number of rows in a chunk, defaults to at most
+                CHUNK_SIZE rows fitting in EXTRACT_MEMORY_BUDGET bytes
+            connectable (Engine or Connection): where to run the query, defaults to
+                the engine of the Extractor
+            limits (ResourceLimits): the statement timeout and maximum number of rows
+                of the query
 
         return:
-            the result of the sql query
+            a generator of pandas dataframes (or Arrow record batches if EXTRACT_BACKEND
+            is "arrow")
         """
-        query = query.statement
+        if isinstance(query, Query):
+            query = query.statement
         logger.info(f"sql query: {query}")
 
-        pd_query = pd.read_sql_query(query, con=self.engine)
+        if chunksize is not None:
+            chunk_sizer = ChunkSizer(chunksize)
+        else:
+            chunk_sizer = ChunkSizer(CHUNK_SIZE, EXTRACT_MEMORY_BUDGET or None)
+        if connectable is not None:
+            # The connection is already limited by whoever opened it
+            return self.fetch_chunks(connectable, query, params, chunk_sizer, limits)
+        # The engine is captured now since the chunks may be consumed from another thread
+        return self.limiter.limit(
+            self.engine_source(self.engine),
+            self.fetch_chunks(self.engine, query, params, chunk_sizer, limits),
+        )
+
+    @staticmethod
+    def resource_limits(analysis):
+        """ Get the ResourceLimits of the extraction of the resource(s) of an analysis.
+        """
+        return ResourceLimits.for_resources(
+            (analysis.resource_id or "").split(SHARED_SCAN_SEPARATOR)
+        )
+
+    @staticmethod
+    def fetch_chunks(connectable, query, params, chunk_sizer, limits=None):
+        """ Generator of the chunks of the result of a query, see run_sql_query.
+        """
+        # Note that connecting from a Connection gives a branch of this connection
+        with connectable.connect() as connection:
+            if limits is not None and limits.statement_timeout:
+                Extractor.set_statement_timeout(connection, limits.statement_timeout)
+            try:
+                for chunk in Extractor.fetch_connection_chunks(
+                    connectable, connection, query, params, chunk_sizer
+                ):
+                    if limits is not None:
+                        limits.count_rows(len(chunk))
+                    yield chunk
+            finally:
+                if limits is not None and limits.statement_timeout:
+                    Extractor.set_statement_timeout(connection, None)
+
+    @staticmethod
+    def fetch_connection_chunks(connectable, connection, query, params, chunk_sizer):
+        # A COPY holds the DBAPI connection until its output is read, so it is not
+        # used on shared connections, where other queries are read at the same time.
+        if (
+            EXTRACT_BACKEND == "copy"
+            and connection.dialect.name == "postgresql"
+            and isinstance(connectable, Engine)
+        ):
+            if not isinstance(query, Compiled):
+                query = query.compile(dialect=connection.dialect)
+            if pg_copy.copy_supported(query):
+                yield from pg_copy.copy_chunks(
+                    connection.connection, query, params, chunk_sizer
+                )
+                return
+
+        # stream_results makes the driver use a server-side cursor so that
+        # rows are only fetched from the DB when the next chunk is needed
+        connection = connection.execution_options(stream_results=True)
+        result = connection.execute(query, params or {})
+        if EXTRACT_BACKEND == "arrow":
+            yield from arrow.fetch_record_batches(result, chunk_sizer)
+        else:
+            yield from Extractor.fetch_dataframes(result, chunk_sizer)
+
+    @staticmethod
+    def fetch_dataframes(result, chunk_sizer):
+        """ Fetch the rows of a sql alchemy result by chunks of chunk_sizer.size rows and
+        yield them as pandas dataframes, as pd.read_sql_query does.
+        """
+        columns = list(result.keys())
+        fetched = False
+        while True:
+            rows = result.fetchmany(chunk_sizer.size)
+            if not rows:
+                break
+            df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+            if chunk_sizer.adaptive:
+                chunk_sizer.observe(len(df), df.memory_usage(deep=True).sum())
+            fetched = True
+            yield df
+        if not fetched:
+            yield pd.DataFrame(columns=columns)
 
-        return pd.DataFrame(pd_query)
+    @staticmethod
+    def set_statement_timeout(connection, timeout):
+        """ Set (or reset if timeout is None) the timeout in seconds of the statements
+        run on a connection.
+        """
+        if connection.dialect.name == "postgresql":
+            # SET LOCAL only lasts until the end of the current transaction, which is
+            # rolled back when the connection is returned to the pool
+            if timeout is not None:
+                connection.execute(f"SET LOCAL statement_timeout = {int(timeout * 1000)}")
+        elif connection.dialect.name == "oracle":
+            dbapi_connection = connection.connection.connection
+            # Timeout of each round-trip to the DB, added in cx_Oracle 7.2
+            if hasattr(dbapi_connection, "callTimeout"):
+                dbapi_connection.callTimeout = int(timeout * 1000) if timeout is not None else 0
+            elif timeout is not None:
+                logger.warning("Statement timeouts on Oracle need cx_Oracle >= 7.2")
+        else:
+            logger.warning(f"Statement timeouts are not supported by {connection.dialect.name}")
 
-    def get_columns(self, columns: List[SqlColumn]) -> List[AlchemyColumn]:
+    def get_columns(
+        self,
+        columns: List[SqlColumn],
+        cleaned_columns: List[SqlColumn] = (),
+        translated_columns: List[SqlColumn] = (),
+    ) -> List[AlchemyColumn]:
         """ Get the sql alchemy columns corresponding to the SqlColumns (custom type)
-        from the analysis.
+        from the analysis, followed by the SQL expressions of the cleaning scripts of
+        cleaned_columns and of the concept maps of translated_columns which can be
+        applied in the query.
+        """
+        alchemy_cols = [self.get_column(col) for col in columns]
+        for col in cleaned_columns:
+            cleaned_col = self.get_cleaned_column(col)
+            if cleaned_col is not None:
+                alchemy_cols.append(cleaned_col.label(col.cleaned_column_name()))
+        for col in translated_columns:
+            translated_col = self.get_translated_column(col)
+            if translated_col is not None:
+                alchemy_cols.append(translated_col.label(col.translated_column_name()))
+        return alchemy_cols
+
+    def cleaned_columns(self, analysis, columns=None) -> List[SqlColumn]:
+        """ Get the columns of the attributes of the analysis (restricted to columns if
+        not None) whose cleaning script has an SQL equivalent for the DB dialect.
+        """
+        if not PUSHDOWN_CLEANING_SCRIPTS:
+            return []
+        return self.attribute_columns(
+            analysis,
+            columns,
+            lambda col: col.cleaning_script is not None and self.has_cleaning_script_sql(col),
+            SqlColumn.cleaned_column_name,
+        )
+
+    def translated_columns(self, analysis, columns=None) -> List[SqlColumn]:
+        """ Get the columns of the attributes of the analysis (restricted to columns if
+        not None) whose concept map is small enough to be applied in the query, after
+        the cleaning script if the script can be applied in the query as well.
+        """
+        return self.attribute_columns(
+            analysis,
+            columns,
+            lambda col: col.concept_map is not None
+            and 0 < len(col.concept_map.mapping) <= CONCEPT_MAP_PUSHDOWN_MAX_SIZE
+            and (
+                col.cleaning_script is None
+                or (PUSHDOWN_CLEANING_SCRIPTS and self.has_cleaning_script_sql(col))
+            ),
+            SqlColumn.translated_column_name,
+        )
+
+    @staticmethod
+    def attribute_columns(analysis, columns, predicate, column_name):
+        # Several attributes can use the same column, with different scripts or maps
+        attribute_columns = {}
+        for attribute in analysis.attributes:
+            for col in attribute.columns:
+                if predicate(col) and (columns is None or col in columns):
+                    attribute_columns[column_name(col)] = col
+        return list(attribute_columns.values())
+
+    def has_cleaning_script_sql(self, column: SqlColumn) -> bool:
+        return self.engine.dialect.name in pushdown.CLEANING_SCRIPTS_SQL.get(
+            column.cleaning_script.name, {}
+        )
+
+    def pushdown_column_names(self, analysis) -> List[str]:
+        """ Get the names of the columns which may be added to the extracted columns by
+        the cleaning scripts and concept maps applied in the query, and by the
+        aggregation of the joined rows.
+        """
+        return (
+            [col.cleaned_column_name() for col in self.cleaned_columns(analysis)]
+            + [col.translated_column_name() for col in self.translated_columns(analysis)]
+            + [SQUASHED_COLUMN]
+        )
+
+    def get_cleaned_column(self, column: SqlColumn):
+        """ Get the SQL expression applying the cleaning script of the SqlColumn, or None
+        if the script can't be applied to the type of the column.
+        """
+        table_column = self.get_table(column).c[column.column]
+        return pushdown.cleaning_script_sql(
+            column.cleaning_script.name, self.engine.dialect.name, table_column
+        )
+
+    def get_translated_column(self, column: SqlColumn):
+        """ Get the SQL expression applying the concept map of the SqlColumn to the column
+        cleaned by its cleaning script, or None if the script can't be applied in the
+        query or if the column is not a string.
         """
-        return [self.get_column(col) for col in columns]
+        if column.cleaning_script is not None:
+            value = self.get_cleaned_column(column)
+        else:
+            value = self.get_table(column).c[column.column]
+            # The transformer translates the values cast to strings
+            if not isinstance(value.type, String):
+                value = None
+        if value is None:
+            return None
+        return pushdown.concept_map_sql(column.concept_map.mapping, value)
 
     def get_column(self, column: SqlColumn) -> AlchemyColumn:
         """ Get the sql alchemy column corresponding to the SqlColumn (custom type)
@@ -180,25 +1420,49 @@ class Extractor:
 
     def get_table(self, column: SqlColumn) -> Table:
         """ Get the sql alchemy table corresponding to the SqlColumn (custom type)
-        from the analysis.
+        from the analysis. Tables are reflected only once thanks to the schema cache.
         """
-        return Table(
-            column.table, self.metadata, schema=column.owner, keep_existing=True, autoload=True,
-        )
+        return self.schema_cache.get_table(self.engine, column.owner, column.table)
 
     @staticmethod
-    def split_dataframe(df, analysis):
-        # Find primary key column
-        logger.debug("Splitting Dataframe")
-        # TODO I don't think it's necessarily present in the df
+    def split_records(chunks, analysis):
+        """ Regroup the rows of the extracted chunks by primary key value and yield one
+        {column: [values]} dict per primary key, ready to be serialized.
+        The rows aggregated in the query (see aggregated_query) are unnested: the
+        columns of the joined tables get one value per joined row, while the columns of
+        the table of the primary key keep a single value.
+        """
         pk_col = analysis.primary_key_column.dataframe_column_name()
+        if EXTRACT_BACKEND == "arrow":
+            yield from arrow.split_record_batches(chunks, pk_col)
+            return
+
+        main_column_names = None
+        for record in split_groups(chunks, pk_col, Extractor.group_by_primary_key):
+            if SQUASHED_COLUMN in record:
+                if main_column_names is None:
+                    main_column_names = Extractor.main_table_column_names(analysis)
+                for column, values in record.items():
+                    if column not in main_column_names and column != SQUASHED_COLUMN:
+                        record[column] = values[0]
+            yield record
+
+    @staticmethod
+    def group_by_primary_key(df, pk_col):
+        """ Slice a dataframe in {column: [values]} dicts of rows sharing the same primary
+        key value. Primary key values are factorized to integer codes (numbered by order
+        of first appearance) so that the group boundaries are found with vectorized
+        operations. Rows are only reordered if the rows of a primary key are not
+        contiguous. The columns are converted to lists once and sliced by group, which is
+        much faster than building a dataframe per group.
+        """
+        if df.empty:
+            return
+        codes, _ = pd.factorize(df[pk_col])
+        order, starts, ends = group_boundaries(codes)
+        if order is not None:
+            df = df.iloc[order]
 
-        prev_pk_val = None
-        acc = []
-        for _, row in df.iterrows():
-            if acc and row[pk_col] != prev_pk_val:
-                yield pd.DataFrame(acc, columns=df.columns)
-                acc = []
-            acc.append(row)
-            prev_pk_val = row[pk_col]
-        yield pd.DataFrame(acc, columns=df.columns)
+        columns = {col: df[col].tolist() for col in df.columns}
+        for start, end in zip(starts, ends):
+            yield {col: values[start:end] for col, values in columns.items()}
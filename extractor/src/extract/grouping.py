@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+
+def group_boundaries(codes):
+    """ Find the groups of rows sharing the same primary key, given the integer codes
+    of the primary key values (numbered by order of first appearance and -1 for missing
+    values, as done by pd.factorize).
+
+    Returns:
+        order: None if the rows of each primary key are contiguous, otherwise the
+            permutation which makes them contiguous (keeping their relative order)
+        starts, ends: the boundaries of each group once the rows are ordered
+    """
+    # Missing values are coded -1: they are put in a last group since the source DBs
+    # sort them after the other values.
+    codes = np.where(codes < 0, codes.max() + 1, codes)
+
+    order = None
+    if (np.diff(codes) < 0).any():
+        order = np.argsort(codes, kind="stable")
+        codes = codes[order]
+
+    boundaries = np.flatnonzero(np.diff(codes)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(codes)]))
+    return order, starts, ends
+
+
+def same_value(left, right):
+    """ Compare two primary key values, considering that missing values are equal.
+    """
+    return left == right or (pd.isna(left) and pd.isna(right))
+
+
+def split_groups(chunks, pk_col, group_by_primary_key):
+    """ Regroup the rows of chunks (dataframes or record batches) by primary key value and
+    yield one {column: [values]} dict per primary key. group_by_primary_key(chunk, pk_col)
+    slices a chunk in such dicts. The rows of a primary key may be split between two
+    consecutive chunks, so the last group of a chunk is only yielded once we know that
+    the next chunk does not continue it.
+    """
+    pending = None
+    for chunk in chunks:
+        groups = list(group_by_primary_key(chunk, pk_col))
+        if not groups:
+            continue
+
+        if pending is not None:
+            if same_value(pending[pk_col][0], groups[0][pk_col][0]):
+                groups[0] = {col: pending[col] + values for col, values in groups[0].items()}
+            else:
+                yield pending
+        pending = groups.pop()
+        yield from groups
+
+    if pending is not None:
+        yield pending
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """ Thread-safe mapping which keeps at most maxsize items, evicting the least
+    recently used ones first. If ttl is set, items older than ttl seconds are
+    considered missing. on_evict is called with each evicted or expired value.
+    """
+
+    def __init__(self, maxsize, ttl=None, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.lock = threading.RLock()
+        # key -> (insertion timestamp, value)
+        self.items = OrderedDict()
+        # key -> lock held while the value of key is built by get_or_set
+        self.build_locks = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+            inserted_at, value = self.items[key]
+            if self.ttl is not None and time.time() - inserted_at > self.ttl:
+                self.pop(key)
+                return default
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            if key in self.items:
+                self.pop(key)
+            self.items[key] = (time.time(), value)
+            while len(self.items) > self.maxsize:
+                self.pop(next(iter(self.items)))
+
+    def get_or_set(self, key, build):
+        """ Get the value stored for key or, if it is missing, build it with build()
+        and store it. Only the lock of key is held while the value is built, so that
+        the other keys can be used meanwhile, and concurrent calls for key build it once.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self.lock:
+            build_lock = self.build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            try:
+                value = self.get(key)
+                if value is None:
+                    value = build()
+                    self.set(key, value)
+                return value
+            finally:
+                with self.lock:
+                    if self.build_locks.get(key) is build_lock:
+                        del self.build_locks[key]
+
+    def pop(self, key):
+        with self.lock:
+            _, value = self.items.pop(key)
+            if self.on_evict:
+                self.on_evict(value)
+            return value
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.items):
+                self.pop(key)
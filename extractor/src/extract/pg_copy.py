@@ -0,0 +1,95 @@
+"""
+Bulk export of query results from PostgreSQL with COPY (...) TO STDOUT, which is much
+faster than fetching the rows through a cursor. The CSV output is streamed through a
+pipe and parsed by chunks of rows in pandas dataframes.
+"""
+
+import os
+import threading
+
+import pandas as pd
+from sqlalchemy import String
+
+# Representation of NULL values in the CSV output, so that they are not mistaken for
+# empty strings
+NULL_MARKER = "\\N"
+
+
+def copy_chunks(dbapi_connection, compiled_query, params, chunk_sizer):
+    """ Run a compiled query with COPY and yield its result in dataframes of
+    chunk_sizer.size rows (see budget.ChunkSizer).
+    Note that all the values are parsed as strings (or None), see copy_supported, and
+    that a string equal to NULL_MARKER is parsed as None.
+    """
+    cursor = dbapi_connection.cursor()
+    sql = render_query(cursor, compiled_query, params)
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def copy():
+        try:
+            with os.fdopen(write_fd, "wb") as pipe:
+                cursor.copy_expert(
+                    f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER, NULL '{NULL_MARKER}')",
+                    pipe,
+                )
+        except Exception as e:
+            errors.append(e)
+
+    copy_thread = threading.Thread(target=copy, daemon=True)
+    copy_thread.start()
+
+    try:
+        with os.fdopen(read_fd, "rb") as pipe:
+            try:
+                reader = pd.read_csv(
+                    pipe,
+                    dtype=str,
+                    keep_default_na=False,
+                    na_values=[NULL_MARKER],
+                    chunksize=chunk_sizer.size,
+                )
+                while True:
+                    chunk = reader.get_chunk(chunk_sizer.size)
+                    if chunk_sizer.adaptive:
+                        chunk_sizer.observe(len(chunk), chunk.memory_usage(deep=True).sum())
+                    yield chunk.astype(object).where(chunk.notna(), None)
+            except (pd.errors.EmptyDataError, StopIteration):
+                # The COPY failed before writing the header, or all the rows were read
+                pass
+    finally:
+        # If the generator is closed early, closing the pipe stops the COPY
+        copy_thread.join()
+        cursor.close()
+
+    if errors:
+        raise errors[0]
+
+
+def copy_supported(compiled_query):
+    """ Whether the result of a compiled query is the same when it is exported with COPY
+    as when it is fetched through a cursor, which is the case when all its columns are
+    strings: the other types (booleans, dates, numbers, arrays...) are formatted as text
+    by COPY.
+    """
+    return all(isinstance(column.type, String) for column in compiled_query.statement.c)
+
+
+def render_query(cursor, compiled_query, params):
+    """ Render a query compiled by the psycopg2 dialect with the values of its parameters.
+    As SQLAlchemy does when it executes a query, the expanding parameters (lists of
+    values used in IN clauses) are replaced by one parameter per value.
+    """
+    sql = compiled_query.string
+    values = {}
+    for name, value in compiled_query.construct_params(params).items():
+        token = f"[EXPANDING_{name}]"
+        if token not in sql:
+            values[name] = value
+            continue
+        names = [f"{name}_{index}" for index in range(len(value))]
+        sql = sql.replace(token, ", ".join(f"%({name})s" for name in names) or "NULL")
+        values.update(zip(names, value))
+
+    rendered_query = cursor.mogrify(sql, values)
+    return rendered_query.decode() if isinstance(rendered_query, bytes) else rendered_query
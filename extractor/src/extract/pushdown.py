@@ -0,0 +1,105 @@
+"""
+SQL equivalents of cleaning scripts, used to clean the values in the extraction query
+instead of applying the scripts to every value in the transformer.
+
+The transformer applies the scripts to the values cast to strings, after they went
+through the json encoding of the extract events (dates are in iso format). A SQL
+equivalent is registered for a dialect only if it gives the same results, and it can
+refuse some types of columns.
+"""
+
+from sqlalchemy import Date, DateTime, String, and_, case, func, literal, null, or_
+
+# Characters removed by str.strip() (apart from the non-ascii white spaces)
+WHITESPACES = " \t\n\r\x0b\x0c"
+# Strings considered as empty by scripts.utils.is_empty
+EMPTY_STRINGS = ["NaN", "NaT", "None", "(null)"]
+
+
+def cleaning_script_sql(script_name, dialect_name, column):
+    """ Build the SQL expression applying a cleaning script to a table column.
+
+    Returns:
+        the expression, or None if the script has no SQL equivalent for the dialect
+        or for the type of the column
+    """
+    build_expression = CLEANING_SCRIPTS_SQL.get(script_name, {}).get(dialect_name)
+    if build_expression is None:
+        return None
+    return build_expression(column)
+
+
+def concept_map_sql(mapping, value):
+    """ Build the SQL expression translating a string value with the mapping of a concept
+    map. The values which are not in the mapping (and NULL) give NULL: as ConceptMap.apply
+    leaves the whole column of a record untranslated if one of its values is unknown, the
+    transformer then applies the concept map itself (see dataframe.clean_data).
+    """
+    whens = [(value == literal(source), literal(target)) for source, target in mapping.items()]
+    return case(whens, else_=null())
+
+
+def is_empty_sql(column, dialect_name):
+    """ SQL equivalent of scripts.utils.is_empty for a string column
+    """
+    if dialect_name == "oracle":
+        # Oracle stores empty strings as NULL
+        blank = func.trim(column).is_(None)
+    else:
+        blank = func.btrim(column, " ") == ""
+    return or_(
+        column.is_(None),
+        column.in_(EMPTY_STRINGS),
+        # is_empty considers substrings of a string of 24 spaces as empty
+        and_(func.length(column) <= 24, blank),
+    )
+
+
+def strip_postgresql(column):
+    if not isinstance(column.type, String):
+        return None
+    return case(
+        [(column.is_(None), ""), (column == "NaN", "")], else_=func.btrim(column, WHITESPACES)
+    )
+
+
+def clean_date_postgresql(column):
+    if isinstance(column.type, DateTime):
+        if column.type.timezone:
+            return None
+        # Datetimes are in iso format in the events, clean_date only handles them if they
+        # don't have fractions of seconds
+        return case(
+            [
+                (column.is_(None), ""),
+                (column == func.date_trunc("second", column), func.to_char(column, "YYYY-MM-DD")),
+            ],
+            else_=func.to_char(column, 'YYYY-MM-DD"T"HH24:MI:SS.US'),
+        )
+    if isinstance(column.type, Date):
+        return case([(column.is_(None), "")], else_=func.to_char(column, "YYYY-MM-DD"))
+    return None
+
+
+def map_gender_sql(dialect_name):
+    def map_gender(column):
+        if not isinstance(column.type, String):
+            return None
+        return case(
+            [
+                (is_empty_sql(column, dialect_name), null()),
+                (column.in_(["M", "HL7:M"]), "male"),
+                (column.in_(["F", "HL7:F"]), "female"),
+            ],
+            else_="unknown",
+        )
+
+    return map_gender
+
+
+# Script name -> dialect name -> function building the SQL expression from a table column
+CLEANING_SCRIPTS_SQL = {
+    "strip": {"postgresql": strip_postgresql},
+    "clean_date": {"postgresql": clean_date_postgresql},
+    "map_gender": {"postgresql": map_gender_sql("postgresql"), "oracle": map_gender_sql("oracle")},
+}
@@ -0,0 +1,149 @@
+import os
+import pickle
+import threading
+import time
+
+from sqlalchemy import MetaData, Table
+
+from extractor.src.config.logger import create_logger
+
+logger = create_logger("schema_cache")
+
+# If set, the reflected tables are persisted in this file to speed up cold starts
+SCHEMA_CACHE_PATH = os.getenv("SCHEMA_CACHE_PATH")
+# Number of seconds after which a reflected table is reflected again
+SCHEMA_CACHE_TTL = int(os.getenv("SCHEMA_CACHE_TTL", 24 * 3600))
+
+
+class SchemaCache:
+    """ Cache of the tables reflected from the source databases.
+    Tables are stored by (database, owner, table) so that they survive the switches
+    of connection of the Extractor, and can be persisted in a local file.
+    A table is reflected while holding a lock of its own, so that the reflections of
+    other tables (of the same database or of other ones) are not blocked.
+    """
+
+    def __init__(self, path=SCHEMA_CACHE_PATH, ttl=SCHEMA_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        # Protects the dicts of the cache, it is never held during a reflection
+        self.lock = threading.Lock()
+        # Lock of each (db key, owner, table), held while the table is reflected
+        self.table_locks = {}
+        # Reflected table of each (db key, owner, table)
+        self.tables = {}
+        # Timestamp of the reflection of each (db key, owner, table)
+        self.reflected_at = {}
+        # Held by the thread writing the cache file, see save
+        self.save_lock = threading.Lock()
+        # Whether the cache changed since it was last written
+        self.dirty = False
+
+        if self.path:
+            self.load()
+
+    @staticmethod
+    def db_key(engine) -> str:
+        """ Identify a database by its url. Note that the password is masked in the url
+        representation so that it is never written to the cache file.
+        """
+        return repr(engine.url)
+
+    def get_table(self, engine, owner, table_name) -> Table:
+        """ Get a table from the cache, and reflect it from the database if it is
+        missing or if it is older than the TTL.
+        """
+        key = (self.db_key(engine), owner, table_name)
+
+        with self.table_lock(key):
+            table = self.tables.get(key)
+            if table is not None and time.time() - self.reflected_at.get(key, 0) < self.ttl:
+                return table
+
+            # Each table has its own MetaData so that tables can be reflected concurrently
+            table = self.reflect_table(engine, MetaData(), owner, table_name)
+            with self.lock:
+                self.tables[key] = table
+                self.reflected_at[key] = time.time()
+            if self.path:
+                self.save()
+
+            return table
+
+    def table_lock(self, key):
+        with self.lock:
+            return self.table_locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def reflect_table(engine, metadata, owner, table_name) -> Table:
+        logger.debug(f"Reflecting table {table_name} (owner: {owner})")
+        # resolve_fks=False avoids reflecting all the tables referenced by foreign keys
+        return Table(
+            table_name,
+            metadata,
+            schema=owner,
+            autoload=True,
+            autoload_with=engine,
+            resolve_fks=False,
+        )
+
+    def invalidate(self, engine=None, owner=None, table_name=None):
+        """ Remove tables from the cache. Only the tables matching all the provided
+        arguments are removed: invalidate() clears the whole cache whereas
+        invalidate(engine) only forgets the tables of a database.
+        """
+        db_key = self.db_key(engine) if engine is not None else None
+
+        with self.lock:
+            for key in list(self.tables):
+                key_db, key_owner, key_table = key
+                if (
+                    (db_key is None or key_db == db_key)
+                    and (owner is None or key_owner == owner)
+                    and (table_name is None or key_table == table_name)
+                ):
+                    del self.tables[key]
+                    self.reflected_at.pop(key, None)
+
+        if self.path:
+            self.save()
+
+    def save(self):
+        """ Write the cache to self.path. The file is written outside of self.lock so
+        that the reflections are not blocked by the I/O. If another thread is writing the
+        file, it writes the changes as well once it is done, so only one thread waits for
+        the I/O. The file is replaced atomically so that a crash during the write cannot
+        corrupt it.
+        """
+        with self.lock:
+            self.dirty = True
+        while self.save_lock.acquire(blocking=False):
+            try:
+                with self.lock:
+                    content = {
+                        "tables": dict(self.tables),
+                        "reflected_at": dict(self.reflected_at),
+                    }
+                    self.dirty = False
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(content, f)
+                os.replace(tmp_path, self.path)
+            finally:
+                self.save_lock.release()
+            # The changes made during the write are not in the file yet
+            with self.lock:
+                if not self.dirty:
+                    return
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                content = pickle.load(f)
+            self.tables = content["tables"]
+            self.reflected_at = content["reflected_at"]
+            logger.info(f"Loaded {len(self.reflected_at)} tables from schema cache {self.path}")
+        except Exception as e:
+            logger.error(f"Could not load schema cache from {self.path}: {e}")
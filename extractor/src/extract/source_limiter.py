@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from extractor.src.config.logger import create_logger
+
+logger = create_logger("source_limiter")
+
+# Maximum number of queries fetching rows at the same time from a source DB for all the
+# extractor processes (0 means no limit)
+SOURCE_MAX_CONCURRENCY = int(os.getenv("SOURCE_MAX_CONCURRENCY", 0))
+# Maximum number of queries started per second on a source DB by all the extractor
+# processes (0 means no limit)
+SOURCE_MAX_QUERIES_PER_SECOND = float(os.getenv("SOURCE_MAX_QUERIES_PER_SECOND", 0))
+# Limits of specific sources, overriding the defaults, as a json object like
+# {"<host>:<port>/<database>": {"max_concurrency": 2, "max_queries_per_second": 5}}
+SOURCE_LIMITS = json.loads(os.getenv("SOURCE_LIMITS", "{}"))
+# Number of extractor processes (replicas times uWSGI processes) which query the source
+# DBs. The processes don't coordinate: each one gets an equal share of the limits above,
+# so this must be updated when the extractor is scaled.
+EXTRACTOR_PROCESSES = int(os.getenv("EXTRACTOR_PROCESSES", 1))
+
+
+def source_key(host, port, database):
+    """ Identify a source DB, see SOURCE_LIMITS.
+    """
+    return f"{host}:{port}/{database}"
+
+
+class SourceLimiter:
+    """ Limit the number of queries run at the same time on each source DB, and the rate
+    at which they are started, so that a source is never overloaded by the extractor.
+    The limits are shared between the processes of the extractor (see EXTRACTOR_PROCESSES),
+    each process getting at least one query at a time.
+    """
+
+    def __init__(self, processes=EXTRACTOR_PROCESSES, clock=time.monotonic, sleep=time.sleep):
+        self.processes = max(1, processes)
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        # source -> (semaphore or None, minimum interval between two queries)
+        self.limits = {}
+        # source -> time at which the next query can start
+        self.next_starts = {}
+
+    def source_limits(self, source):
+        with self.lock:
+            if source not in self.limits:
+                limits = SOURCE_LIMITS.get(source, {})
+                max_concurrency = limits.get("max_concurrency", SOURCE_MAX_CONCURRENCY)
+                max_rate = limits.get("max_queries_per_second", SOURCE_MAX_QUERIES_PER_SECOND)
+                # Share of the limits of this process
+                semaphore = None
+                if max_concurrency:
+                    semaphore = threading.BoundedSemaphore(
+                        max(1, max_concurrency // self.processes)
+                    )
+                self.limits[source] = (
+                    semaphore,
+                    self.processes / max_rate if max_rate else 0,
+                )
+            return self.limits[source]
+
+    @contextmanager
+    def slot(self, source, start=True):
+        """ Wait until a query can be run on source and hold a slot while it runs. If
+        start is false, the query is already started and the rate limit doesn't apply.
+        """
+        semaphore, interval = self.source_limits(source)
+        if semaphore is not None and not semaphore.acquire(blocking=False):
+            logger.debug(f"Waiting for a free slot on {source}")
+            semaphore.acquire()
+        try:
+            if interval and start:
+                self.wait_for_rate(source, interval)
+            yield
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    def wait_for_rate(self, source, interval):
+        with self.lock:
+            now = self.clock()
+            start = max(now, self.next_starts.get(source, now))
+            self.next_starts[source] = start + interval
+        if start > now:
+            self.sleep(start - now)
+
+    def limit(self, source, iterable):
+        """ Iterate over iterable (typically the chunks of a query) holding a slot on
+        source while each item is fetched. The slot is released while the item is
+        processed, so that slow consumers don't keep the other queries waiting.
+        """
+        iterator = iter(iterable)
+        start = True
+        while True:
+            with self.slot(source, start):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            start = False
+            yield item
@@ -0,0 +1,80 @@
+import os
+import pickle
+import sqlite3
+import threading
+
+from extractor.src.config.logger import create_logger
+
+logger = create_logger("state_store")
+
+# File in which the extractor persists its state (watermarks...)
+STATE_STORE_PATH = os.getenv("EXTRACTOR_STATE_PATH", "extractor_state.sqlite")
+
+
+class StateStore:
+    """ Durable key-value store backed by a local sqlite database, used by the extractor
+    to persist its state between runs. Several stores can share the same file as long
+    as they have different namespaces. Values are pickled so they keep their type
+    (dates, decimals...).
+    """
+
+    def __init__(self, namespace, path=STATE_STORE_PATH):
+        self.namespace = namespace
+        self.path = path
+        self.lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def connection(self):
+        # The sqlite file is only created when the store is used
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS state "
+                "(namespace TEXT, key TEXT, value BLOB, PRIMARY KEY (namespace, key))"
+            )
+        return self._connection
+
+    def get(self, key, default=None):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+        return pickle.loads(row[0]) if row else default
+
+    def set(self, key, value):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)",
+                (self.namespace, key, pickle.dumps(value)),
+            )
+
+    def set_many(self, items):
+        """ Set the values of (key, value) items in a single transaction.
+        """
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)",
+                    [(self.namespace, key, pickle.dumps(value)) for key, value in items],
+                )
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def delete(self, key):
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM state WHERE namespace = ? AND key = ?", (self.namespace, key)
+            )
+
+    def items(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key, value FROM state WHERE namespace = ?", (self.namespace,)
+            ).fetchall()
+        return [(key, pickle.loads(value)) for key, value in rows]
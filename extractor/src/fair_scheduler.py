@@ -0,0 +1,87 @@
+import os
+import threading
+from collections import deque, OrderedDict
+
+from extractor.src.config.logger import create_logger
+
+logger = create_logger("fair_scheduler")
+
+# Number of threads running the scheduled extractions
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", 4))
+# Maximum number of scheduled extractions of a same source running at the same time
+SCHEDULER_MAX_TASKS_PER_SOURCE = int(os.getenv("SCHEDULER_MAX_TASKS_PER_SOURCE", 1))
+
+
+class FairScheduler:
+    """ Run tasks in a pool of worker threads. Each source (typically a source DB) has its
+    own queue of tasks, and the queues are served in turn, so that the tasks of a source
+    with a long queue don't delay the tasks of the other sources. At most
+    max_tasks_per_source tasks of a source run at the same time.
+    """
+
+    def __init__(
+        self, workers=SCHEDULER_WORKERS, max_tasks_per_source=SCHEDULER_MAX_TASKS_PER_SOURCE
+    ):
+        self.max_tasks_per_source = max_tasks_per_source
+        self.condition = threading.Condition()
+        # source -> deque of tasks, in the order in which the sources are served
+        self.queues = OrderedDict()
+        # source -> number of running tasks
+        self.running = {}
+        self.stopping = False
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, source, task):
+        """ Queue a task (a function without argument) of a source.
+        """
+        with self.condition:
+            self.queues.setdefault(source, deque()).append(task)
+            self.condition.notify()
+
+    def next_task(self):
+        # Take the first task of the first source which can run one more task, the
+        # source is then served last
+        for source, queue in self.queues.items():
+            if self.running.get(source, 0) < self.max_tasks_per_source:
+                task = queue.popleft()
+                del self.queues[source]
+                if queue:
+                    self.queues[source] = queue
+                self.running[source] = self.running.get(source, 0) + 1
+                return source, task
+        return None
+
+    def work(self):
+        while True:
+            with self.condition:
+                while True:
+                    next_task = self.next_task()
+                    if next_task is not None:
+                        break
+                    if self.stopping and not self.queues:
+                        return
+                    self.condition.wait()
+            source, task = next_task
+            try:
+                task()
+            except Exception as err:
+                logger.error(err)
+            finally:
+                with self.condition:
+                    self.running[source] -= 1
+                    # A task of this source may now be able to run
+                    self.condition.notify_all()
+
+    def stop(self):
+        """ Wait for the queued tasks to be done and stop the worker threads.
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            if thread.is_alive():
+                thread.join()
@@ -2,16 +2,28 @@
 
 import os
 import json
+from collections import defaultdict
+from functools import partial
 from uwsgidecorators import thread, postfork
 from confluent_kafka import KafkaException, KafkaError
 from flask import Flask, request, jsonify
 
 from analyzer.src.analyze import Analyzer
 from analyzer.src.analyze.graphql import PyrogClient
+from analyzer.src.analyze.sql_column import SqlColumn
 
 from extractor.src.extract import Extractor
+from extractor.src.extract.checkpoint import SharedProgress
+from extractor.src.extract.extractor import SHARED_SCAN_SEPARATOR
+from extractor.src.extract.state_store import StateStore
 from extractor.src.config.logger import create_logger
 from extractor.src.errors import MissingInformationError
+from extractor.src.event_batcher import EventBatcher
+from extractor.src.fair_scheduler import FairScheduler
+from extractor.src.pipeline import fan_out, run_pipeline
+from extractor.src.preview_cache import PreviewCache
+from extractor.src.record_hash_index import RecordHashIndex, SKIP_UNCHANGED_RECORDS
+from extractor.src.trigger_coalescer import TriggerCoalescer
 from extractor.src.producer_class import ExtractorProducer
 from extractor.src.consumer_class import ExtractorConsumer
 from extractor.src.errors import BadRequestError, EmptyResult
@@ -21,10 +33,15 @@ logger = create_logger("extractor")
 CONSUMER_GROUP_ID = "extractor"
 PRODUCED_TOPIC = "extract"
 CONSUMED_TOPIC = "batch"
+# Number of records after which the progress of the extraction of a batch is saved
+CHECKPOINT_INTERVAL = int(os.getenv("CHECKPOINT_INTERVAL", 10000))
 
 pyrog_client = PyrogClient()
 analyzer = Analyzer(pyrog_client)
 extractor = Extractor()
+preview_cache = PreviewCache()
+# Hashes of the records sent to the transformer, see RecordHashIndex
+record_hashes = StateStore("record_hashes")
 
 
 def create_app():
@@ -36,24 +53,106 @@ app = create_app()
 
 
 def process_event_with_producer(producer):
-    def broadcast_events(resource_mapping, dataframe, analysis, batch_id=None):
-        resource_type = resource_mapping["definitionId"]
-        resource_id = resource_mapping["id"]
-        list_records_from_db = extractor.split_dataframe(dataframe, analysis)
+    def broadcast_events(
+        resource_mapping, analysis, records, batch_id=None, save_progress=None
+    ):
+        header = dict()
+        header["batch_id"] = batch_id
+        header["resource_type"] = resource_mapping["definitionId"]
+        header["resource_id"] = resource_mapping["id"]
+        batcher = EventBatcher(
+            lambda value: producer.produce_serialized_event(topic=PRODUCED_TOPIC, value=value),
+            header,
+        )
 
-        for record in list_records_from_db:
-            logger.debug("One record from extract")
-            event = dict()
-            event["batch_id"] = batch_id
-            event["resource_type"] = resource_type
-            event["resource_id"] = resource_id
-            event["dataframe"] = record.to_dict(orient="list")
+        hash_index = (
+            create_hash_index(resource_mapping, analysis) if SKIP_UNCHANGED_RECORDS else None
+        )
+        add_hash = hash_index.add if hash_index else lambda record, record_hash: None
+        save_hashes = hash_index.save if hash_index else lambda: None
+        save_delivered = save_progress or hash_index
+        last_record = None
+        n_unsaved_records = 0
+
+        def save_delivered_progress():
+            # The progress and the hashes are saved once the events of the previous
+            # records are delivered
+            batcher.flush()
+            producer.flush()
+            save_hashes()
+            if save_progress:
+                save_progress(last_record)
+
+        def add_record(item):
+            nonlocal last_record, n_unsaved_records
+            last_record, serialized_record, record_hash = item
+            # Unchanged records are not serialized
+            if serialized_record is not None:
+                batcher.add_serialized(*serialized_record, record_hash)
+                add_hash(last_record, record_hash)
+            n_unsaved_records += 1
+            if save_delivered and n_unsaved_records >= CHECKPOINT_INTERVAL:
+                save_delivered_progress()
+                n_unsaved_records = 0
+
+        # The rows are fetched, serialized and produced by overlapping stages so that
+        # the source DB, the CPU and the broker are busy at the same time
+        n_records = run_pipeline(records, partial(serialize_record, hash_index), add_record)
+        batcher.flush()
+        if save_delivered and n_unsaved_records:
+            save_delivered_progress()
+
+        return n_records
+
+    def extract_and_broadcast(resource_ids, primary_key_values, batch_id, schedule=None):
+        def process_records(resource_mapping, analysis, records, save_progress=None):
+            return broadcast_events(
+                resource_mapping, analysis, records, batch_id, save_progress
+            )
+
+        extract_batch(resource_ids, primary_key_values, process_records, batch_id, schedule)
+
+    return extract_and_broadcast
+
+
+def serialize_record(hash_index, record):
+    """ Serialize a record for an EventBatcher, unless its hash is in hash_index (if
+    provided), in which case it is not sent again.
+
+    :return: a (record, serialized record or None, record hash or None) tuple
+    """
+    if not hash_index or not record:
+        return record, EventBatcher.serialize(record), None
+    record_hash = hash_index.record_hash(record)
+    if hash_index.is_unchanged(record, record_hash):
+        return record, None, record_hash
+    return record, EventBatcher.serialize(record), record_hash
 
-            producer.produce_event(topic=PRODUCED_TOPIC, event=event)
 
+def create_hash_index(resource_mapping, analysis):
+    """ Create the RecordHashIndex of the records of a resource sent to the transformer.
+    """
+    if not resource_mapping["primaryKeyTable"] or not resource_mapping["primaryKeyColumn"]:
+        # Static resources have no primary key
+        return None
+    pk_column = SqlColumn(
+        resource_mapping["primaryKeyTable"],
+        resource_mapping["primaryKeyColumn"],
+        resource_mapping["primaryKeyOwner"],
+    )
+    return RecordHashIndex(
+        record_hashes,
+        resource_mapping["id"],
+        pk_column.dataframe_column_name(),
+        salt=extractor.resource_version(resource_mapping, analysis),
+    )
+
+
+def process_event_with_coalescer(coalescer, extract_batch):
     def process_event(msg):
         msg_value = json.loads(msg.value())
         resource_id = msg_value.get("resource_id", None)
+        resource_ids = msg_value.get("resource_ids", None)
         primary_key_values = msg_value.get("primary_key_values", None)
         batch_id = msg_value.get("batch_id", None)
 
@@ -63,12 +162,10 @@ def process_event_with_producer(producer):
         logger.info(msg_topic)
         logger.info(msg_value)
 
-        try:
-            resource_mapping, analysis, df = extract_resource(resource_id, primary_key_values)
-            broadcast_events(resource_mapping, df, analysis, batch_id)
-
-        except Exception as err:
-            logger.error(err)
+        if resource_ids is not None:
+            extract_batch(resource_ids, primary_key_values, batch_id)
+        else:
+            coalescer.add(resource_id, primary_key_values, batch_id)
 
     return process_event
 
@@ -82,31 +179,202 @@ def manage_kafka_error(msg):
     logger.error(msg.error())
 
 
-def extract_resource(resource_id, primary_key_values):
+def analyze_resource(resource_id):
+    """ Fetch the mapping of a resource and analyze it.
+    """
+    resource_mapping = fetch_resource_mapping(resource_id)
+
+    logger.debug("Analyzing Mapping")
+    analysis = analyzer.analyze(resource_mapping)
+    return resource_mapping, extractor.configure_watermark(analysis)
+
+
+def fetch_resource_mapping(resource_id):
     logger.debug("Getting Mapping for resource %s", resource_id)
-    resource_mapping = pyrog_client.get_resource_from_id(resource_id=resource_id)
+    return pyrog_client.get_resource_from_id(resource_id=resource_id)
 
+
+def connect_to_source(resource_mapping):
     # Get credentials
     if not resource_mapping["source"]["credential"]:
         raise MissingInformationError("credential is required to run fhir-river by batch.")
 
-    credentials = resource_mapping["source"]["credential"]
-    extractor.update_connection(credentials)
+    extractor.update_connection(resource_mapping["source"]["credential"])
 
-    logger.debug("Analyzing Mapping")
-    analysis = analyzer.analyze(resource_mapping)
+
+def extract_resource(resource_id, primary_key_values, process_records, batch_id=None):
+    """ Fetch the mapping of the resource and stream its rows from the source DB.
+    The records (one {column: [values]} dict per primary key value) are given to
+    process_records(resource_mapping, analysis, records) as soon as they are extracted,
+    possibly from several threads if the table is extracted by partitions.
+    process_records should return the number of records it processed.
+    If batch_id is provided, the extraction of a whole table can be resumed and
+    process_records also gets a save_progress function as fourth argument (see
+    Extractor.extract_partitions).
+    """
+    resource_mapping, analysis = analyze_resource(resource_id)
+    extract_analyzed_resource(
+        resource_mapping, analysis, primary_key_values, process_records, batch_id
+    )
+
+
+def extract_analyzed_resource(
+    resource_mapping, analysis, primary_key_values, process_records, batch_id=None
+):
+    # The instance of a static resource is built without querying the source DB
+    if not analysis.is_static:
+        connect_to_source(resource_mapping)
 
     logger.debug("Extracting rows")
-    df = extractor.extract(resource_mapping, analysis, primary_key_values)
-    if df.empty:
+    n_records = extractor.extract_partitions(
+        resource_mapping,
+        analysis,
+        lambda records, *args: process_records(resource_mapping, analysis, records, *args),
+        primary_key_values,
+        batch_id=batch_id,
+    )
+    check_not_empty(n_records)
+
+
+def extract_batch(
+    resource_ids, primary_key_values, process_records, batch_id=None, schedule=None
+):
+    """ Extract some primary keys (or the whole tables, if primary_key_values is None)
+    of several resources, see extract_resource. The errors are logged. The extractions
+    of whole tables can be scheduled, see extract_resources.
+    """
+    if primary_key_values is None:
+        # The whole resources are extracted together so that they can share their scans
+        extract_resources(resource_ids, process_records, batch_id, schedule)
+        return
+
+    for resource_id in resource_ids:
+        try:
+            extract_resource(resource_id, primary_key_values, process_records, batch_id)
+        except Exception as err:
+            logger.error(err)
+
+
+def extract_resources(resource_ids, process_records, batch_id=None, schedule=None):
+    """ Extract the whole tables of several resources (see extract_resource). The
+    resources which fetch the same rows (see Extractor.shared_scan_key) are extracted
+    with a single scan of the source DB. The errors are logged for each resource (or
+    group of resources extracted together).
+    If schedule is provided, the extraction of each group is given to
+    schedule(source, task) (see FairScheduler.submit) instead of being run right away.
+    """
+    groups = defaultdict(list)
+    for resource_id in resource_ids:
+        try:
+            resource_mapping, analysis = analyze_resource(resource_id)
+        except Exception as err:
+            logger.error(err)
+            continue
+        if analysis.is_static:
+            # Static resources don't fetch any row
+            key = (resource_id,)
+        else:
+            key = extractor.shared_scan_key(resource_mapping, analysis)
+        groups[key].append((resource_mapping, analysis))
+
+    for group in groups.values():
+        task = partial(extract_group, group, process_records, batch_id)
+        if schedule is not None:
+            schedule(group_source(group), task)
+        else:
+            task()
+
+
+def extract_group(group, process_records, batch_id=None):
+    """ Extract a group of resources fetching the same rows, see extract_resources.
+    """
+    try:
+        if len(group) == 1:
+            resource_mapping, analysis = group[0]
+            extract_analyzed_resource(resource_mapping, analysis, None, process_records, batch_id)
+        else:
+            extract_shared_scan(group, process_records, batch_id)
+    except Exception as err:
+        logger.error(err)
+
+
+def group_source(group):
+    """ Identify the source DB queried by the extraction of a group of resources (see
+    FairScheduler). Static resources and resources without credential don't query any.
+    """
+    resource_mapping, analysis = group[0]
+    credential = resource_mapping["source"]["credential"]
+    if analysis.is_static or not credential:
+        return None
+    return extractor.source(credential)
+
+
+def extract_shared_scan(group, process_records, batch_id=None):
+    """ Extract resources which fetch the same rows with a single query fetching the
+    union of their columns. The records are projected on the columns of each resource
+    and processed concurrently for all the resources.
+    :param group: list of (resource mapping, analysis) couples
+    """
+    shared_analysis = extractor.shared_analysis([analysis for _, analysis in group])
+    logger.info(f"Extracting resources {shared_analysis.resource_id} with a shared scan")
+
+    def fan_out_records(records, save_progress=None):
+        progress = None
+        if save_progress:
+            # A record is processed once it is processed for all the resources
+            pk_col = shared_analysis.primary_key_column.dataframe_column_name()
+            progress = SharedProgress(len(group), pk_col, save_progress)
+            records = progress.track(records)
+
+        def resource_consumer(index, resource_mapping, analysis):
+            columns = [column.dataframe_column_name() for column in analysis.columns]
+            # Columns cleaned or translated in the query, which are only there for the
+            # types of columns which the scripts and concept maps can be applied to, and
+            # the marker of the rows aggregated in the query
+            columns += extractor.pushdown_column_names(analysis)
+
+            def consume(records):
+                records = (
+                    {column: record[column] for column in columns if column in record}
+                    for record in records
+                )
+                if progress:
+                    return process_records(
+                        resource_mapping, analysis, records, partial(progress.save, index)
+                    )
+                return process_records(resource_mapping, analysis, records)
+
+            return consume
+
+        return fan_out(
+            records,
+            [
+                resource_consumer(index, resource_mapping, analysis)
+                for index, (resource_mapping, analysis) in enumerate(group)
+            ],
+        )
+
+    resource_mapping = group[0][0]
+    connect_to_source(resource_mapping)
+    n_records = extractor.extract_partitions(
+        resource_mapping, shared_analysis, fan_out_records, batch_id=batch_id
+    )
+    # All the resources have the same number of records
+    check_not_empty([n_records_by_resource[0] for n_records_by_resource in n_records])
+
+
+def check_not_empty(n_records):
+    """ Raise an EmptyResult error if an extraction returned no record. n_records is the
+    list of the numbers of records of the primary key ranges of the extraction.
+    """
+    # Note that n_records is empty if nothing changed since the last incremental extraction
+    if n_records and sum(n_records) == 0:
         raise EmptyResult(
             "The sql query returned nothing. Maybe the primary key values "
             "you provided are not present in the database or the mapping "
             "is erroneous."
         )
 
-    return resource_mapping, analysis, df
-
 
 @app.route("/extract", methods=["POST"])
 def extract():
@@ -117,12 +385,28 @@ def extract():
         raise BadRequestError("primary_key_values is required in request body")
 
     try:
-        _, analysis, df = extract_resource(resource_id, primary_key_values)
-        rows = []
-        for record in extractor.split_dataframe(df, analysis):
-            logger.debug("One record from extract")
-            rows.append(record.to_dict(orient="list"))
-
+        resource_mapping = fetch_resource_mapping(resource_id)
+        # The concept maps of the analysis are part of the key of the cached previews
+        logger.debug("Analyzing Mapping")
+        analysis = analyzer.analyze(resource_mapping)
+
+        def extract_rows():
+            rows = []
+
+            def collect_rows(_, __, records):
+                for record in records:
+                    logger.debug("One record from extract")
+                    rows.append(record)
+                return len(rows)
+
+            extract_analyzed_resource(
+                resource_mapping, analysis, primary_key_values, collect_rows
+            )
+            return rows
+
+        rows = preview_cache.get_or_extract(
+            resource_id, resource_mapping, analysis, primary_key_values, extract_rows
+        )
         return jsonify({"rows": rows})
 
     except Exception as err:
@@ -130,6 +414,28 @@ def extract():
         raise err
 
 
+@app.route("/explain", methods=["POST"])
+def explain():
+    """ Estimate the cost of the extraction of a resource and the strategy which would
+    be used to extract it, see Extractor.explain.
+    """
+    body = request.get_json()
+    resource_id = body.get("resource_id", None)
+    if not resource_id:
+        raise BadRequestError("resource_id is required in request body")
+
+    try:
+        resource_mapping, analysis = analyze_resource(resource_id)
+        if analysis.is_static:
+            raise BadRequestError(f"Resource {resource_id} is static, it has no query")
+        connect_to_source(resource_mapping)
+        return jsonify(extractor.explain(resource_mapping, analysis))
+
+    except Exception as err:
+        logger.error(err)
+        raise err
+
+
 @app.errorhandler(Exception)
 def handle_bad_request(e):
     return str(e), 400
@@ -144,15 +450,36 @@ def run_consumer():
     logger.info("Running Consumer")
 
     producer = ExtractorProducer(broker=os.getenv("KAFKA_BOOTSTRAP_SERVERS"))
+    extract_and_broadcast = process_event_with_producer(producer)
+    # The extractions of whole tables run in the workers of the scheduler, which serves
+    # the source DBs in turn
+    scheduler = FairScheduler()
+    scheduler.start()
+    extract_and_schedule = partial(extract_and_broadcast, schedule=scheduler.submit)
+    # The triggers of some primary keys of a resource are merged during a time window
+    coalescer = TriggerCoalescer(
+        lambda resource_id, primary_key_values, batch_id: extract_and_broadcast(
+            [resource_id], primary_key_values, batch_id
+        )
+    )
     consumer = ExtractorConsumer(
         broker=os.getenv("KAFKA_BOOTSTRAP_SERVERS"),
         topics=CONSUMED_TOPIC,
         group_id=CONSUMER_GROUP_ID,
-        process_event=process_event_with_producer(producer),
+        process_event=process_event_with_coalescer(coalescer, extract_and_schedule),
         manage_error=manage_kafka_error,
+        on_poll=coalescer.flush_due,
     )
 
+    # Resume the extractions of the batches which were interrupted
+    for batch_id, resource_id in extractor.unfinished_checkpoints():
+        # The resource_id of a shared scan is the list of the ids of its resources
+        extract_and_schedule(resource_id.split(SHARED_SCAN_SEPARATOR), None, batch_id)
+
     try:
         consumer.run_consumer()
     except (KafkaException, KafkaError) as err:
         logger.error(err)
+    finally:
+        coalescer.flush()
+        scheduler.stop()
@@ -0,0 +1,111 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of threads running the transform stage of the pipeline
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", 2))
+# Maximum number of items which have been fetched but not consumed yet
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 64))
+
+# Put in the queue by the fetch stage once all the items have been fetched
+_DONE = object()
+
+
+def run_pipeline(
+    items, transform, consume, workers=PIPELINE_WORKERS, queue_size=PIPELINE_QUEUE_SIZE
+):
+    """ Run three overlapping stages on items:
+    - fetch: a thread iterates over items (typically a generator reading from a DB),
+    - transform: `workers` threads apply transform to the fetched items,
+    - consume: the calling thread gives the transformed items to consume, in the order
+      of items.
+    The stages are connected by a queue of at most queue_size items so that a slow
+    stage blocks the previous ones instead of piling up items in memory.
+    An exception raised by a stage stops the pipeline and is raised by run_pipeline.
+
+    :return: the number of consumed items
+    """
+    futures = queue.Queue(maxsize=queue_size)
+    stopped = threading.Event()
+    n_items = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        def fetch():
+            try:
+                for item in items:
+                    if stopped.is_set():
+                        return
+                    futures.put(executor.submit(transform, item))
+            except Exception as e:
+                futures.put(e)
+            finally:
+                futures.put(_DONE)
+
+        fetcher = threading.Thread(target=fetch, daemon=True)
+        fetcher.start()
+
+        try:
+            while True:
+                future = futures.get()
+                if future is _DONE:
+                    break
+                if isinstance(future, Exception):
+                    raise future
+                consume(future.result())
+                n_items += 1
+        finally:
+            # Unblock the fetch stage if it is waiting for room in the queue
+            stopped.set()
+            while fetcher.is_alive():
+                try:
+                    futures.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    return n_items
+
+
+def fan_out(items, consumers, queue_size=PIPELINE_QUEUE_SIZE):
+    """ Give the same items to several consumers, each of them running in its own thread
+    and iterating over its own queue of at most queue_size items, so that a slow
+    consumer blocks the iteration over items instead of piling them up in memory.
+    The items are no longer given to a consumer which raised an exception.
+
+    :param consumers: functions taking an iterable of items as argument
+    :return: the list of the values returned by the consumers
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in consumers]
+
+    def iterate(items_queue):
+        while True:
+            item = items_queue.get()
+            if item is _DONE:
+                return
+            yield item
+
+    with ThreadPoolExecutor(max_workers=len(consumers)) as executor:
+        futures = [
+            executor.submit(consumer, iterate(items_queue))
+            for consumer, items_queue in zip(consumers, queues)
+        ]
+        try:
+            for item in items:
+                for items_queue, future in zip(queues, futures):
+                    _put(items_queue, item, future)
+        finally:
+            for items_queue, future in zip(queues, futures):
+                _put(items_queue, _DONE, future)
+
+        return [future.result() for future in futures]
+
+
+def _put(items_queue, item, future):
+    # The consumer of the queue may have stopped, in which case the queue is never emptied
+    while not future.done():
+        try:
+            items_queue.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
@@ -0,0 +1,42 @@
+import os
+
+from extractor.src.config.logger import create_logger
+from extractor.src.extract import Extractor
+from extractor.src.extract.lru_cache import LRUCache
+
+logger = create_logger("preview_cache")
+
+# Maximum number of preview results (see /extract) kept in cache
+PREVIEW_CACHE_SIZE = int(os.getenv("PREVIEW_CACHE_SIZE", 128))
+# Number of seconds after which a preview result is extracted again from the source DB
+PREVIEW_CACHE_TTL = int(os.getenv("PREVIEW_CACHE_TTL", 60))
+
+
+class PreviewCache:
+    """ Cache of the rows extracted for the previews of the /extract endpoint, by
+    (resource id, version of the mapping and concept maps, primary key values): the
+    previews of a mapping being edited are cached until the mapping or its concept maps
+    change, or until they expire.
+    """
+
+    def __init__(self, maxsize=PREVIEW_CACHE_SIZE, ttl=PREVIEW_CACHE_TTL):
+        self.cache = LRUCache(maxsize, ttl=ttl)
+
+    def get_or_extract(
+        self, resource_id, resource_mapping, analysis, primary_key_values, extract_rows
+    ):
+        """ Get the cached rows of the preview or extract them with extract_rows().
+        """
+        cache_key = (
+            resource_id,
+            Extractor.resource_version(resource_mapping, analysis),
+            tuple(primary_key_values),
+        )
+        rows = self.cache.get(cache_key)
+        if rows is not None:
+            logger.debug("Preview of resource %s found in cache", resource_id)
+            return rows
+
+        rows = extract_rows()
+        self.cache.set(cache_key, rows)
+        return rows
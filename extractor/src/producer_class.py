@@ -2,6 +2,7 @@
 
 import json
 import datetime
+import decimal
 from confluent_kafka import Producer
 from extractor.src.config.logger import create_logger
 
@@ -50,14 +51,44 @@ class ExtractorProducer:
         except ValueError as error:
             logger.error(error)
 
+    def produce_serialized_event(self, topic, value):
+        """
+        Produce an event which is already serialized in json, without waiting
+        for its delivery
+        :param topic: str
+        :param value: str
+        :return:
+        """
+        while True:
+            try:
+                self.producer.produce(
+                    topic=topic,
+                    value=value,
+                    callback=lambda err, msg, obj=value: self.callback_function(err, msg, obj),
+                )
+                break
+            except BufferError:
+                # The local queue of the producer is full, wait for some deliveries
+                self.producer.poll(1)
+        self.producer.poll(0)  # Callback function
+
+    def flush(self):
+        """
+        Wait for the delivery of all the produced events
+        :return:
+        """
+        self.producer.flush()
+
     @staticmethod
     def default_json_encoder(o):
         """
-        Json Encoder for datetime
+        Json Encoder for datetime and decimal
         :return:
         """
         if isinstance(o, (datetime.date, datetime.datetime)):
             return o.isoformat()
+        if isinstance(o, decimal.Decimal):
+            return float(o)
 
     @staticmethod
     def callback_fn(err, msg, obj):
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+
+from extractor.src.extract.state_store import StateStore
+from extractor.src.producer_class import ExtractorProducer
+
+# If true, a content hash is attached to each extracted record and the records which
+# did not change since they were last sent to the transformer are skipped
+SKIP_UNCHANGED_RECORDS = os.getenv("SKIP_UNCHANGED_RECORDS", "false").lower() == "true"
+
+
+class RecordHashIndex:
+    """ Hashes of the records of a resource which were sent to the transformer, stored
+    in a StateStore by primary key value. A record whose hash did not change produces
+    the same documents, so it does not need to be sent again.
+    The hashes of the added records are only stored when save() is called, which
+    should be done once their events are delivered.
+    """
+
+    def __init__(self, store: StateStore, resource_id, pk_col, salt=""):
+        """
+        :param store: where the hashes are stored
+        :param resource_id: id of the resource of the records
+        :param pk_col: name of the primary key column of the records
+        :param salt: added to the hashes, typically the version of the mapping, which
+            changes the documents produced by the records
+        """
+        self.store = store
+        self.resource_id = resource_id
+        self.pk_col = pk_col
+        self.salt = salt
+        self.pending = {}
+
+    def record_hash(self, record):
+        """ Hash the content of a {column: [values]} record. The hash doesn't depend on
+        the order of the columns or on the order of the rows of the record, which can
+        change from an extraction to another. The columns with a single value (those of
+        the main table in a record aggregated by the extractor) apply to all the rows.
+        """
+        columns = sorted(record)
+        n_rows = max(len(values) for values in record.values())
+        row_hashes = sorted(
+            hashlib.blake2b(
+                json.dumps(row, default=ExtractorProducer.default_json_encoder).encode(),
+                digest_size=16,
+            ).digest()
+            for row in zip(
+                *(
+                    record[column] * n_rows if len(record[column]) == 1 else record[column]
+                    for column in columns
+                )
+            )
+        )
+        record_hash = hashlib.blake2b(digest_size=16)
+        record_hash.update(json.dumps([self.salt, columns]).encode())
+        for row_hash in row_hashes:
+            record_hash.update(row_hash)
+        return record_hash.hexdigest()
+
+    def key(self, record):
+        return f"{self.resource_id}:{record[self.pk_col][0]}"
+
+    def is_unchanged(self, record, record_hash):
+        return self.store.get(self.key(record)) == record_hash
+
+    def add(self, record, record_hash):
+        self.pending[self.key(record)] = record_hash
+
+    def save(self):
+        """ Store the hashes of the records added since the last save.
+        """
+        if self.pending:
+            self.store.set_many(self.pending.items())
+            self.pending = {}
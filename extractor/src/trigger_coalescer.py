@@ -0,0 +1,82 @@
+import os
+import time
+
+from extractor.src.config.logger import create_logger
+
+logger = create_logger("trigger_coalescer")
+
+# Number of seconds during which the triggers of some primary keys of a resource are
+# buffered so that they are extracted together. 0 disables the coalescing.
+TRIGGER_COALESCE_WINDOW = float(os.getenv("TRIGGER_COALESCE_WINDOW", 0))
+# The buffered primary keys of a resource are extracted as soon as there are this many
+TRIGGER_COALESCE_MAX_PK_VALUES = int(os.getenv("TRIGGER_COALESCE_MAX_PK_VALUES", 1000))
+
+
+class TriggerCoalescer:
+    """ Merge the triggers of extraction of some primary keys of a resource received
+    during a time window, so that a change feed sending the primary keys one at a time
+    leads to one extraction per window instead of one per primary key.
+    The triggers are buffered by (resource_id, batch_id) so that the extracted events
+    keep their batch_id. Triggers of whole resources are not buffered.
+    Note that buffered triggers are lost if the extractor stops before flushing them.
+    """
+
+    def __init__(
+        self,
+        extract,
+        window=TRIGGER_COALESCE_WINDOW,
+        max_pk_values=TRIGGER_COALESCE_MAX_PK_VALUES,
+        clock=time.monotonic,
+    ):
+        """
+        :param extract: function taking (resource_id, primary_key_values, batch_id)
+            as arguments, which runs an extraction
+        :param window: number of seconds during which triggers are buffered
+        :param max_pk_values: number of buffered primary keys of a resource after
+            which they are extracted without waiting for the end of the window
+        :param clock: function returning the current time in seconds
+        """
+        self.extract = extract
+        self.window = window
+        self.max_pk_values = max_pk_values
+        self.clock = clock
+
+        # (resource_id, batch_id) -> (deadline, {primary key value: None})
+        self.pending = {}
+
+    def add(self, resource_id, primary_key_values, batch_id=None):
+        """ Buffer a trigger, or run its extraction if it is not coalesced.
+        """
+        if not self.window or primary_key_values is None:
+            self.extract(resource_id, primary_key_values, batch_id)
+            return
+
+        key = (resource_id, batch_id)
+        if key not in self.pending:
+            self.pending[key] = (self.clock() + self.window, {})
+        _, pk_values = self.pending[key]
+        # A dict keeps the order of the primary keys while removing duplicates
+        pk_values.update(dict.fromkeys(primary_key_values))
+
+        if len(pk_values) >= self.max_pk_values:
+            self.flush_key(key)
+
+    def flush_due(self):
+        """ Extract the buffered primary keys whose window is over. This should be
+        called regularly, even if no trigger is received.
+        """
+        now = self.clock()
+        for key in [key for key, (deadline, _) in self.pending.items() if deadline <= now]:
+            self.flush_key(key)
+
+    def flush(self):
+        """ Extract all the buffered primary keys.
+        """
+        for key in list(self.pending):
+            self.flush_key(key)
+
+    def flush_key(self, key):
+        _, pk_values = self.pending.pop(key)
+        resource_id, batch_id = key
+        logger.info(f"Extracting {len(pk_values)} coalesced primary keys of {resource_id}")
+        self.extract(resource_id, list(pk_values), batch_id)
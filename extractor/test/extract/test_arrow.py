@@ -0,0 +1,73 @@
+from decimal import Decimal
+
+import pyarrow as pa
+from unittest import mock
+
+from sqlalchemy import create_engine
+
+from extractor.src.extract.arrow import fetch_record_batches, split_record_batches
+from extractor.src.extract.budget import ChunkSizer
+from extractor.src.extract.extractor import Extractor
+from extractor.src.extract.grouping import split_groups
+from extractor.src.event_batcher import EventBatcher
+
+from extractor.test.extract.test_extractor import create_sqlite_extractor
+
+
+def test_fetch_record_batches():
+    engine = create_engine("sqlite://")
+    result = engine.execute("SELECT 1 AS id, 'a' AS code UNION ALL SELECT 2, NULL")
+
+    batches = list(fetch_record_batches(result, ChunkSizer(1)))
+
+    assert [batch.to_pydict() for batch in batches] == [
+        {"id": [1], "code": ["a"]},
+        {"id": [2], "code": [None]},
+    ]
+
+
+def test_split_record_batches():
+    batches = [
+        pa.RecordBatch.from_arrays(
+            [pa.array([1, 2, 1, 3]), pa.array(["a", "b", "c", "d"])], names=["pk", "code"]
+        ),
+        pa.RecordBatch.from_arrays(
+            [pa.array([3, None]), pa.array(["e", "f"])], names=["pk", "code"]
+        ),
+    ]
+
+    assert list(split_record_batches(batches, "pk")) == [
+        {"pk": [1, 1], "code": ["a", "c"]},
+        {"pk": [2], "code": ["b"]},
+        {"pk": [3, 3], "code": ["d", "e"]},
+        {"pk": [None], "code": ["f"]},
+    ]
+
+
+@mock.patch("extractor.src.extract.extractor.EXTRACT_BACKEND", "arrow")
+def test_extract_arrow_backend(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db", 3)
+
+    records = extractor.extract_partitions(resource_mapping, analysis, list)
+
+    assert records == [[{"patients_subject_id": [i], "patients_gender": ["F"]} for i in range(3)]]
+
+
+def test_numeric_values_serialized_by_both_backends():
+    rows = [(1, Decimal("1.50")), (1, Decimal("2")), (2, Decimal("-3.25"))]
+
+    def fetch_records(fetch_chunks, split_chunks):
+        result = mock.Mock()
+        result.keys.return_value = ["pk", "amount"]
+        result.fetchmany.side_effect = [rows, []]
+        return split_chunks(fetch_chunks(result, ChunkSizer(10)), "pk")
+
+    arrow_records = fetch_records(fetch_record_batches, split_record_batches)
+    pandas_records = fetch_records(
+        Extractor.fetch_dataframes,
+        lambda chunks, pk_col: split_groups(chunks, pk_col, Extractor.group_by_primary_key),
+    )
+
+    serialized = [EventBatcher.serialize(record) for record in arrow_records]
+    assert serialized == [EventBatcher.serialize(record) for record in pandas_records]
+    assert serialized[0] == (["pk", "amount"], "[[1, 1], [1.5, 2.0]]")
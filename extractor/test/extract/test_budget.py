@@ -0,0 +1,42 @@
+from pytest import raises
+from unittest import mock
+
+from extractor.src.errors import RowLimitExceeded
+from extractor.src.extract.budget import ChunkSizer, ResourceLimits
+
+
+def test_chunk_sizer():
+    chunk_sizer = ChunkSizer(1000, memory_budget=10000, sample_size=10)
+    assert chunk_sizer.size == 10
+
+    chunk_sizer.observe(10, 1000)
+    assert chunk_sizer.size == 100
+    # Rows twice bigger
+    chunk_sizer.observe(100, 20000)
+    assert chunk_sizer.size == 66
+    # Small rows
+    for _ in range(5):
+        chunk_sizer.observe(100, 100)
+    assert chunk_sizer.size == 1000
+
+    chunk_sizer = ChunkSizer(1000)
+    chunk_sizer.observe(10, 10 ** 9)
+    assert chunk_sizer.size == 1000
+
+
+@mock.patch("extractor.src.extract.budget.EXTRACT_MAX_ROWS", 100)
+@mock.patch(
+    "extractor.src.extract.budget.EXTRACT_RESOURCE_LIMITS",
+    {"big": {"max_rows": 0, "statement_timeout": 60}, "small": {"max_rows": 10}},
+)
+def test_resource_limits():
+    limits = ResourceLimits.for_resources(["big"])
+    assert (limits.statement_timeout, limits.max_rows) == (60, None)
+    limits = ResourceLimits.for_resources(["other"])
+    assert (limits.statement_timeout, limits.max_rows) == (None, 100)
+    limits = ResourceLimits.for_resources(["big", "small"])
+    assert (limits.statement_timeout, limits.max_rows) == (60, 10)
+
+    limits.count_rows(6)
+    with raises(RowLimitExceeded):
+        limits.count_rows(6)
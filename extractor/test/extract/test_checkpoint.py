@@ -0,0 +1,17 @@
+from extractor.src.extract.checkpoint import SharedProgress
+
+
+def test_shared_progress():
+    saved = []
+    progress = SharedProgress(2, "pk", saved.append)
+    records = list(progress.track({"pk": [pk]} for pk in ["a", "b", "c"]))
+
+    progress.save(0, records[1])
+    assert saved == []
+    progress.save(1, records[0])
+    assert saved == [{"pk": ["a"]}]
+    progress.save(1, records[2])
+    assert saved == [{"pk": ["a"]}, {"pk": ["b"]}]
+    progress.save(0, records[2])
+    assert saved == [{"pk": ["a"]}, {"pk": ["b"]}, {"pk": ["c"]}]
+    assert progress.positions == {}
@@ -0,0 +1,36 @@
+from unittest import mock
+
+from sqlalchemy import bindparam, column, select, table
+from sqlalchemy.dialects import postgresql
+
+from extractor.src.extract.explain import explain_query
+
+patients = table("patients", column("subject_id"))
+compiled_query = (
+    select([patients.c.subject_id])
+    .where(patients.c.subject_id >= bindparam("pk_low"))
+    .compile(dialect=postgresql.psycopg2.dialect())
+)
+
+
+def test_explain_postgresql():
+    plan = {"Plan": {"Node Type": "Seq Scan", "Plan Rows": 1000, "Total Cost": 12.5}}
+    connection = mock.MagicMock()
+    connection.dialect.name = "postgresql"
+    connection.execute.return_value.scalar.return_value = [plan]
+
+    assert explain_query(connection, compiled_query, {"pk_low": 3}) == {
+        "rows": 1000,
+        "cost": 12.5,
+        "plan": plan,
+    }
+    sql, params = connection.execute.call_args[0]
+    assert sql.startswith("EXPLAIN (FORMAT JSON) SELECT patients.subject_id")
+    assert params == {"pk_low": 3}
+
+
+def test_explain_not_supported():
+    connection = mock.MagicMock()
+    connection.dialect.name = "sqlite"
+
+    assert explain_query(connection, compiled_query) is None
@@ -1,13 +1,33 @@
+from functools import partial
+import json
+import threading
+
+import pandas as pd
 from pytest import raises
 from unittest import mock
 
-from sqlalchemy import Table, Column, MetaData
+from sqlalchemy import create_engine, event, func, Table, Column, Enum, Integer, MetaData, String
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm.query import Query
 
 from analyzer.src.analyze.sql_column import SqlColumn
 from analyzer.src.analyze.sql_join import SqlJoin
 
+from analyzer.src.analyze.analysis import Analysis
+from analyzer.src.analyze.attribute import Attribute
+from analyzer.src.analyze.cleaning_script import CleaningScript
+from analyzer.src.analyze.concept_map import ConceptMap
+from analyzer.src.analyze.mapping import build_squash_rules, SQUASHED_COLUMN
+
+from extractor.src.errors import RowLimitExceeded
+from extractor.src.event_batcher import EventBatcher
+from extractor.src.extract.budget import ChunkSizer
 from extractor.src.extract.extractor import Extractor
+from extractor.src.extract.state_store import StateStore
+
+from transformer.src.transform.dataframe import apply_str, clean_data
 
 meta = MetaData()
 tables = {
@@ -28,6 +48,37 @@ def mock_get_table(_, sql_column):
     return tables[sql_column.table]
 
 
+def create_sqlite_extractor(path, n_patients=10):
+    """ Build an extractor connected to a sqlite DB containing a patients table.
+    """
+    extractor = Extractor()
+    extractor.engine = create_engine(f"sqlite:///{path}")
+    extractor.session = sessionmaker(extractor.engine)()
+
+    extractor.watermarks = StateStore("watermarks", path=str(path) + ".state")
+    extractor.checkpoints = StateStore("checkpoints", path=str(path) + ".state")
+
+    table = Table(
+        "patients",
+        MetaData(),
+        Column("subject_id", Integer),
+        Column("gender", String),
+        Column("updated_at", Integer),
+    )
+    table.create(extractor.engine)
+    extractor.engine.execute(
+        table.insert(),
+        [{"subject_id": i, "gender": "F", "updated_at": 0} for i in range(n_patients)],
+    )
+
+    analysis = Analysis()
+    analysis.primary_key_column = SqlColumn("patients", "subject_id")
+    analysis.columns = {analysis.primary_key_column, SqlColumn("patients", "gender")}
+    resource_mapping = {"definitionId": "Patient", "filters": []}
+
+    return extractor, resource_mapping, analysis
+
+
 def test_build_db_url():
     # With postgres DB
     credentials = {
@@ -89,7 +140,8 @@ def test_sqlalchemy_query():
         "SELECT patients.subject_id AS patients_subject_id, patients.row_id AS patients_row_id, "
         "admissions.admittime AS admissions_admittime \n"
         "FROM patients LEFT OUTER JOIN admissions ON admissions.row_id = patients.row_id \n"
-        "WHERE admissions.admittime LIKE :admittime_1"
+        "WHERE admissions.admittime LIKE :admittime_1 "
+        "ORDER BY patients.subject_id"
     )
 
 
@@ -156,3 +208,795 @@ def test_apply_filters():
     for call, binary_expression in zip(base_query.filter.call_args_list, binary_expressions):
         args, _ = call
         assert args[0].compare(binary_expression)
+
+
+def test_run_sql_query_by_chunks():
+    extractor = Extractor()
+    extractor.engine = create_engine("sqlite://")
+    table = Table("patients", MetaData(), Column("subject_id", Integer))
+    table.create(extractor.engine)
+    extractor.engine.execute(table.insert(), [{"subject_id": i} for i in range(5)])
+
+    query = Query(table.c.subject_id.label("patients_subject_id"))
+    chunks = list(extractor.run_sql_query(query, chunksize=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert pd.concat(chunks)["patients_subject_id"].tolist() == [0, 1, 2, 3, 4]
+
+
+def test_split_records():
+    analysis = Analysis()
+    analysis.primary_key_column = SqlColumn("patients", "subject_id")
+
+    # The rows of the primary key 2 are split between the first two chunks
+    chunks = [
+        pd.DataFrame({"patients_subject_id": [1, 2, 2], "admissions_row_id": [10, 20, 21]}),
+        pd.DataFrame(columns=["patients_subject_id", "admissions_row_id"]),
+        pd.DataFrame({"patients_subject_id": [2, 3], "admissions_row_id": [22, 30]}),
+    ]
+
+    records = list(Extractor.split_records(chunks, analysis))
+
+    assert records == [
+        {"patients_subject_id": [1], "admissions_row_id": [10]},
+        {"patients_subject_id": [2, 2, 2], "admissions_row_id": [20, 21, 22]},
+        {"patients_subject_id": [3], "admissions_row_id": [30]},
+    ]
+    assert list(Extractor.split_records([], analysis)) == []
+
+
+@mock.patch("extractor.src.extract.extractor.AGGREGATE_JOINS", True)
+def test_aggregated_query():
+    typed_tables = {
+        "patients": Table(
+            "patients", MetaData(), Column("subject_id", Integer), Column("gender", String)
+        ),
+        "admissions": Table(
+            "admissions",
+            MetaData(),
+            Column("subject_id", Integer),
+            Column("language", String),
+            Column("status", Enum("a", "b", name="status")),
+            Column("hadm_id", postgresql.UUID),
+        ),
+    }
+    extractor = Extractor()
+    extractor.engine = mock.MagicMock()
+    extractor.engine.dialect.name = "postgresql"
+    extractor.session = mock.MagicMock()
+    extractor.session.query = lambda *columns: Query([*columns])
+
+    analysis = Analysis()
+    analysis.primary_key_column = SqlColumn("patients", "subject_id")
+    analysis.columns = {
+        analysis.primary_key_column,
+        SqlColumn("patients", "gender"),
+        SqlColumn("admissions", "language"),
+    }
+    analysis.joins = {SqlJoin(analysis.primary_key_column, SqlColumn("admissions", "subject_id"))}
+    analysis.squash_rules = build_squash_rules(analysis.columns, analysis.joins, "patients")
+
+    with mock.patch(
+        "extractor.src.extract.extractor.Extractor.get_table",
+        lambda _, column: typed_tables[column.table],
+    ):
+        assert extractor.aggregate_joins(analysis)
+
+        query = extractor.sqlalchemy_query(
+            [
+                analysis.primary_key_column,
+                SqlColumn("patients", "gender"),
+                SqlColumn("admissions", "language"),
+            ],
+            analysis.joins,
+            analysis.primary_key_column,
+            {"filters": []},
+            None,
+            main_column_names=extractor.main_table_column_names(analysis),
+        )
+        assert str(query.statement.compile(dialect=postgresql.dialect())) == (
+            "SELECT anon_1.patients_subject_id, "
+            "(array_agg(anon_1.patients_gender))[%(array_agg_1)s] AS patients_gender, "
+            "array_agg(anon_1.admissions_language) AS admissions_language, "
+            "%(param_1)s AS __squashed__ \n"
+            "FROM (SELECT patients.subject_id AS patients_subject_id, "
+            "patients.gender AS patients_gender, admissions.language AS admissions_language \n"
+            "FROM patients LEFT OUTER JOIN admissions "
+            "ON admissions.subject_id = patients.subject_id) AS anon_1 "
+            "GROUP BY anon_1.patients_subject_id ORDER BY anon_1.patients_subject_id"
+        )
+
+        # Only the types whose arrays are decoded by the driver are aggregated
+        analysis.columns.add(SqlColumn("admissions", "hadm_id"))
+        assert not extractor.aggregate_joins(analysis)
+        analysis.columns.remove(SqlColumn("admissions", "hadm_id"))
+        analysis.columns.add(SqlColumn("admissions", "status"))
+        assert not extractor.aggregate_joins(analysis)
+
+
+def test_split_records_aggregated():
+    analysis = Analysis()
+    analysis.primary_key_column = SqlColumn("patients", "subject_id")
+    analysis.columns = {analysis.primary_key_column, SqlColumn("patients", "gender")}
+    analysis.attributes = [Attribute("language", [SqlColumn("admissions", "language")])]
+
+    chunks = [
+        pd.DataFrame(
+            {
+                "patients_subject_id": [1, 2],
+                "patients_gender": ["F", "M"],
+                "admissions_language": [["fr", "en"], [None]],
+                SQUASHED_COLUMN: [True, True],
+            }
+        )
+    ]
+
+    assert list(Extractor.split_records(chunks, analysis)) == [
+        {
+            "patients_subject_id": [1],
+            "patients_gender": ["F"],
+            "admissions_language": ["fr", "en"],
+            SQUASHED_COLUMN: [True],
+        },
+        {
+            "patients_subject_id": [2],
+            "patients_gender": ["M"],
+            "admissions_language": [None],
+            SQUASHED_COLUMN: [True],
+        },
+    ]
+
+
+def test_group_by_primary_key_not_contiguous():
+    df = pd.DataFrame({"patients_subject_id": [1, 2, 1, 3, 2], "row_id": [0, 1, 2, 3, 4]})
+
+    groups = list(Extractor.group_by_primary_key(df, "patients_subject_id"))
+
+    assert [group["row_id"] for group in groups] == [[0, 2], [1, 4], [3]]
+
+
+def test_primary_key_ranges(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db")
+
+    assert extractor.primary_key_ranges(resource_mapping, analysis, 3) == [
+        (None, 3),
+        (3, 7),
+        (7, None),
+    ]
+    # There can't be more ranges than primary key values
+    assert len(extractor.primary_key_ranges(resource_mapping, analysis, 20)) == 10
+
+
+def test_bounds_queries_release_connection(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db")
+    extractor.engine = create_engine(f"sqlite:///{tmp_path / 'mimic.db'}", poolclass=QueuePool)
+    extractor.session = sessionmaker(extractor.engine)()
+    analysis.joins = {
+        SqlJoin(analysis.primary_key_column, SqlColumn("admissions", "subject_id"))
+    }
+
+    # The admissions table doesn't exist: only the primary key table is queried
+    assert extractor.primary_key_ranges(resource_mapping, analysis, 2) == [(None, 5), (5, None)]
+    assert extractor.engine.pool.checkedout() == 0
+
+    analysis.watermark_column = SqlColumn("patients", "updated_at")
+    assert extractor.watermark_bounds(resource_mapping, analysis) == (None, 0)
+    assert extractor.engine.pool.checkedout() == 0
+
+
+def test_extract_partitions(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db")
+
+    def process_records(records):
+        return [record["patients_subject_id"][0] for record in records]
+
+    pk_values_by_range = extractor.extract_partitions(
+        resource_mapping, analysis, process_records, partitions=3
+    )
+    assert pk_values_by_range == [[0, 1, 2], [3, 4, 5, 6], [7, 8, 9]]
+
+    pk_values_by_range = extractor.extract_partitions(
+        resource_mapping, analysis, process_records, pk_values=[2, 8], partitions=None
+    )
+    assert pk_values_by_range == [[2, 8]]
+
+
+def test_extract_incremental(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db")
+    analysis.resource_id = "patient_resource_id"
+    analysis.watermark_column = SqlColumn("patients", "updated_at")
+
+    def process_records(records):
+        return [record["patients_subject_id"][0] for record in records]
+
+    # First extraction: all the rows are extracted
+    pk_values_by_range = extractor.extract_partitions(resource_mapping, analysis, process_records)
+    assert pk_values_by_range == [list(range(10))]
+    assert extractor.watermarks.get("patient_resource_id:patients.updated_at") == 0
+
+    # Nothing changed
+    assert extractor.extract_partitions(resource_mapping, analysis, process_records) == []
+
+    extractor.engine.execute("UPDATE patients SET updated_at = 1 WHERE subject_id IN (3, 5)")
+    pk_values_by_range = extractor.extract_partitions(
+        resource_mapping, analysis, process_records, partitions=2
+    )
+    assert sum(pk_values_by_range, []) == [3, 5]
+    assert extractor.watermarks.get("patient_resource_id:patients.updated_at") == 1
+
+    # Extractions of some primary keys are never incremental
+    pk_values_by_range = extractor.extract_partitions(
+        resource_mapping, analysis, process_records, pk_values=[1]
+    )
+    assert pk_values_by_range == [[1]]
+
+
+@mock.patch(
+    "extractor.src.extract.extractor.EXTRACT_WATERMARK_COLUMNS",
+    {"patient_resource_id": {"owner": None, "table": "patients", "column": "updated_at"}},
+)
+def test_configure_watermark():
+    analysis = Analysis()
+    analysis.resource_id = "patient_resource_id"
+
+    assert Extractor.configure_watermark(analysis).watermark_column == SqlColumn(
+        "patients", "updated_at"
+    )
+
+    # The watermark column of the mapping is kept
+    analysis.watermark_column = SqlColumn("patients", "row_id")
+    assert Extractor.configure_watermark(analysis).watermark_column == SqlColumn(
+        "patients", "row_id"
+    )
+
+    analysis = Analysis()
+    analysis.resource_id = "other"
+    assert Extractor.configure_watermark(analysis).watermark_column is None
+
+
+def test_extract_incremental_joined_watermark(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db", 3)
+    table = Table(
+        "admissions",
+        MetaData(),
+        Column("subject_id", Integer),
+        Column("value", Integer),
+        Column("updated_at", Integer),
+    )
+    table.create(extractor.engine)
+    extractor.engine.execute(
+        table.insert(),
+        [
+            {"subject_id": i, "value": 10 * i + j, "updated_at": 0}
+            for i in range(3)
+            for j in range(2)
+        ],
+    )
+    analysis.resource_id = "patient_resource_id"
+    analysis.columns.add(SqlColumn("admissions", "value"))
+    analysis.joins = {SqlJoin(analysis.primary_key_column, SqlColumn("admissions", "subject_id"))}
+    analysis.watermark_column = SqlColumn("admissions", "updated_at")
+
+    def process_records(records):
+        return list(records)
+
+    assert len(extractor.extract_partitions(resource_mapping, analysis, process_records)[0]) == 3
+
+    extractor.engine.execute("UPDATE admissions SET updated_at = 1 WHERE value = 11")
+    [records] = extractor.extract_partitions(resource_mapping, analysis, process_records)
+
+    # The admission which didn't change is extracted as well, the document stays complete
+    assert records == [
+        {"patients_subject_id": [1, 1], "patients_gender": ["F", "F"], "admissions_value": [10, 11]}
+    ]
+
+
+def test_extract_compiled_query_cache(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db")
+
+    def extract_pk_values(resource_mapping, pk_values):
+        df_chunks = extractor.extract(resource_mapping, analysis, pk_values)
+        return pd.concat(df_chunks)["patients_subject_id"].tolist()
+
+    with mock.patch.object(Extractor, "sqlalchemy_query", wraps=extractor.sqlalchemy_query) as m:
+        assert extract_pk_values(resource_mapping, [1, 2]) == [1, 2]
+        assert extract_pk_values(resource_mapping, [3, 4, 5]) == [3, 4, 5]
+        assert m.call_count == 1
+
+        # Modifying the mapping invalidates the query
+        resource_mapping["filters"] = [
+            {
+                "relation": ">",
+                "value": 3,
+                "sqlColumn": {"owner": None, "table": "patients", "column": "subject_id"},
+            }
+        ]
+        assert extract_pk_values(resource_mapping, [3, 4, 5]) == [4, 5]
+        assert m.call_count == 2
+
+
+@mock.patch("extractor.src.extract.extractor.PK_VALUES_CHUNK_SIZE", 3)
+def test_extract_pk_values_chunks(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db")
+
+    def process_records(records):
+        return [record["patients_subject_id"][0] for record in records]
+
+    with mock.patch.object(Extractor, "extract", wraps=extractor.extract) as m:
+        pk_values_by_range = extractor.extract_partitions(
+            resource_mapping, analysis, process_records, pk_values=[9, 1, 5, 2, 7, 1, 8, 3]
+        )
+        assert m.call_count == 3
+
+    assert pk_values_by_range == [[1, 2, 3, 5, 7, 8, 9]]
+
+
+def test_extract_branches(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(
+        tmp_path / "mimic.db", n_patients=3
+    )
+    for table_name, rows_per_patient in [("admissions", 2), ("labevents", 3)]:
+        table = Table(
+            table_name, MetaData(), Column("subject_id", Integer), Column("value", Integer)
+        )
+        table.create(extractor.engine)
+        extractor.engine.execute(
+            table.insert(),
+            [
+                {"subject_id": i, "value": 10 * i + j}
+                for i in range(1, 3)
+                for j in range(rows_per_patient)
+            ],
+        )
+    pk_column = analysis.primary_key_column
+    analysis.columns |= {SqlColumn("admissions", "value"), SqlColumn("labevents", "value")}
+    analysis.joins = {
+        SqlJoin(pk_column, SqlColumn("admissions", "subject_id")),
+        SqlJoin(pk_column, SqlColumn("labevents", "subject_id")),
+    }
+
+    branches = extractor.join_branches(resource_mapping, analysis)
+    branches_columns = [{str(column) for column in columns} for columns, _ in branches]
+    assert branches_columns[0] == {"patients.subject_id", "patients.gender"}
+    assert sorted(branches_columns[1:], key=sorted) == [
+        {"patients.subject_id", "admissions.value"},
+        {"patients.subject_id", "labevents.value"},
+    ]
+
+    def process_records(records):
+        return list(records)
+
+    [single_query_records] = extractor.extract_partitions(
+        resource_mapping, analysis, process_records, decompose=False
+    )
+    [records] = extractor.extract_partitions(
+        resource_mapping, analysis, process_records, decompose=True
+    )
+
+    # 3 rows per patient instead of 2 * 3
+    assert [len(record["patients_subject_id"]) for record in single_query_records] == [1, 6, 6]
+    assert [len(record["patients_subject_id"]) for record in records] == [1, 3, 3]
+    assert records[1] == {
+        "patients_subject_id": [1, 1, 1],
+        "patients_gender": ["F", "F", "F"],
+        "admissions_value": [10, 11, 11],
+        "labevents_value": [10, 11, 12],
+    }
+    # A patient without admissions has a row of missing values, as with a single query
+    assert pd.isna(records[0]["admissions_value"]).all()
+    for record, single_query_record in zip(records[1:], single_query_records[1:]):
+        for column, values in record.items():
+            assert set(values) == set(single_query_record[column])
+
+    # A filter on a joined table applies to whole rows, the resource can't be decomposed
+    resource_mapping["filters"] = [
+        {
+            "relation": ">",
+            "value": 10,
+            "sqlColumn": {"owner": None, "table": "labevents", "column": "value"},
+        }
+    ]
+    assert extractor.join_branches(resource_mapping, analysis) is None
+
+
+@mock.patch("extractor.src.extract.extractor.Extractor.prepare_query", return_value=(None, {}))
+@mock.patch("extractor.src.extract.extractor.Extractor.run_sql_query", return_value=[])
+def test_extract_branches_oracle_snapshot(_, __):
+    extractor = Extractor()
+    extractor.engine = mock.MagicMock()
+    connection = extractor.engine.connect.return_value.__enter__.return_value
+    connection.dialect.name = "oracle"
+    analysis = Analysis()
+    analysis.primary_key_column = SqlColumn("patients", "subject_id")
+
+    records = extractor.extract_branches({"definitionId": "Patient"}, analysis, [([], [])] * 2)
+
+    assert list(records) == []
+    # The branch queries see the same snapshot
+    assert connection.execute.call_args_list == [mock.call("SET TRANSACTION READ ONLY")]
+
+
+def test_extract_checkpoint(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db")
+    analysis.resource_id = "patient_resource_id"
+
+    def process_records_and_crash(records, save_progress):
+        for record in records:
+            if record["patients_subject_id"][0] == 6:
+                raise ValueError("crash")
+            save_progress(record)
+
+    with raises(ValueError, match="crash"):
+        extractor.extract_partitions(
+            resource_mapping, analysis, process_records_and_crash, partitions=2, batch_id="b"
+        )
+    assert extractor.unfinished_checkpoints() == [("b", "patient_resource_id")]
+
+    def process_records(records, save_progress):
+        return [record["patients_subject_id"][0] for record in records]
+
+    # The extraction of the batch is resumed after the last processed primary keys
+    pk_values_by_range = extractor.extract_partitions(
+        resource_mapping, analysis, process_records, partitions=2, batch_id="b"
+    )
+    assert pk_values_by_range == [[], [6, 7, 8, 9]]
+    assert extractor.unfinished_checkpoints() == []
+
+
+@mock.patch("extractor.src.extract.checkpoint.CHECKPOINT_MAX_ATTEMPTS", 2)
+def test_extract_checkpoint_max_attempts(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db")
+    analysis.resource_id = "patient_resource_id"
+
+    def process_records_and_crash(records, save_progress):
+        for record in records:
+            save_progress(record)
+            raise ValueError("crash")
+
+    with raises(ValueError, match="crash"):
+        extractor.extract_partitions(
+            resource_mapping, analysis, process_records_and_crash, batch_id="b"
+        )
+    assert extractor.unfinished_checkpoints() == [("b", "patient_resource_id")]
+
+    # The checkpoint is dropped when the last attempt fails
+    with raises(ValueError, match="crash"):
+        extractor.extract_partitions(
+            resource_mapping, analysis, process_records_and_crash, batch_id="b"
+        )
+    assert extractor.unfinished_checkpoints() == []
+
+
+def test_unfinished_checkpoints_expiry(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db")
+    analysis.resource_id = "patient_resource_id"
+
+    def process_records_and_crash(records, save_progress):
+        raise ValueError("crash")
+
+    with mock.patch("extractor.src.extract.checkpoint.time.time", return_value=1000):
+        with raises(ValueError, match="crash"):
+            extractor.extract_partitions(
+                resource_mapping, analysis, process_records_and_crash, batch_id="b"
+            )
+    assert len(extractor.checkpoints.items()) == 1
+
+    with mock.patch("extractor.src.extract.checkpoint.CHECKPOINT_TTL", 60), mock.patch(
+        "extractor.src.extract.checkpoint.time.time", return_value=1061
+    ):
+        assert extractor.unfinished_checkpoints() == []
+    assert extractor.checkpoints.items() == []
+
+
+def test_shared_scan(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db")
+    resource_mapping["source"] = {"credential": {"host": "localhost"}}
+    analysis.resource_id = "patient"
+
+    other_analysis = Analysis()
+    other_analysis.resource_id = "observation"
+    other_analysis.primary_key_column = SqlColumn("patients", "subject_id")
+    other_analysis.columns = {analysis.primary_key_column, SqlColumn("patients", "updated_at")}
+    other_mapping = {**resource_mapping, "definitionId": "Observation"}
+
+    assert extractor.shared_scan_key(resource_mapping, analysis) == extractor.shared_scan_key(
+        other_mapping, other_analysis
+    )
+    other_analysis.joins = {
+        SqlJoin(analysis.primary_key_column, SqlColumn("admissions", "subject_id"))
+    }
+    assert extractor.shared_scan_key(resource_mapping, analysis) != extractor.shared_scan_key(
+        other_mapping, other_analysis
+    )
+    other_analysis.joins = set()
+
+    shared_analysis = extractor.shared_analysis([other_analysis, analysis])
+    assert shared_analysis.resource_id == "observation,patient"
+
+    [records] = extractor.extract_partitions(resource_mapping, shared_analysis, list)
+    assert records[0] == {
+        "patients_subject_id": [0],
+        "patients_gender": ["F"],
+        "patients_updated_at": [0],
+    }
+
+
+@mock.patch(
+    "extractor.src.extract.pushdown.CLEANING_SCRIPTS_SQL",
+    {"map_gender": {"sqlite": lambda column: func.lower(column)}},
+)
+@mock.patch("analyzer.src.analyze.cleaning_script.scripts.get_script")
+def test_extract_cleaning_scripts_pushdown(_, tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db", 2)
+    analysis.resource_id = "patient_resource_id"
+    gender = SqlColumn("patients", "gender", cleaning_script=CleaningScript("map_gender"))
+    subject_id = SqlColumn("patients", "subject_id", cleaning_script=CleaningScript("other"))
+    analysis.attributes = [Attribute("gender", [gender]), Attribute("id", [subject_id])]
+
+    assert extractor.cleaned_columns(analysis) == [gender]
+
+    records = list(extractor.split_records(extractor.extract(resource_mapping, analysis), analysis))
+    assert records == [
+        {"patients_subject_id": [i], "patients_gender": ["F"], "patients_gender__map_gender": ["f"]}
+        for i in range(2)
+    ]
+
+
+@mock.patch(
+    "analyzer.src.analyze.ConceptMap.fetch",
+    return_value={
+        "id": "cm_gender",
+        "title": "gender",
+        "group": [{"element": [{"code": "F", "target": [{"code": "female"}]}]}],
+    },
+)
+def test_extract_concept_maps_pushdown(_, tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db", 2)
+    analysis.resource_id = "patient_resource_id"
+    gender = SqlColumn("patients", "gender", concept_map=ConceptMap("cm_gender"))
+    # Not a string column
+    subject_id = SqlColumn("patients", "subject_id", concept_map=ConceptMap("cm_gender"))
+    analysis.attributes = [Attribute("gender", [gender]), Attribute("id", [subject_id])]
+
+    records = list(extractor.split_records(extractor.extract(resource_mapping, analysis), analysis))
+    assert records == [
+        {
+            "patients_subject_id": [i],
+            "patients_gender": ["F"],
+            "patients_gender__cm_gender": ["female"],
+        }
+        for i in range(2)
+    ]
+
+    # The compiled query is not reused when the concept map changes
+    gender.concept_map.mapping = {"F": "f"}
+    records = list(extractor.split_records(extractor.extract(resource_mapping, analysis), analysis))
+    assert [record["patients_gender__cm_gender"] for record in records] == [["f"], ["f"]]
+
+    with mock.patch("extractor.src.extract.extractor.CONCEPT_MAP_PUSHDOWN_MAX_SIZE", 0):
+        assert extractor.translated_columns(analysis) == []
+
+
+@mock.patch(
+    "analyzer.src.analyze.ConceptMap.fetch",
+    return_value={
+        "id": "cm_gender",
+        "title": "gender",
+        "group": [{"element": [{"code": "F", "target": [{"code": "female"}]}]}],
+    },
+)
+def test_concept_maps_pushdown_same_as_transformer(_, tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db", 3)
+    table = Table("admissions", MetaData(), Column("subject_id", Integer), Column("code", String))
+    table.create(extractor.engine)
+    # The codes of the admissions of a patient are all known to the concept map, or one of
+    # them is unknown or NULL
+    extractor.engine.execute(
+        table.insert(),
+        [
+            {"subject_id": 0, "code": "F"},
+            {"subject_id": 0, "code": "F"},
+            {"subject_id": 1, "code": "F"},
+            {"subject_id": 1, "code": "M"},
+            {"subject_id": 2, "code": "F"},
+            {"subject_id": 2, "code": None},
+        ],
+    )
+    analysis.resource_id = "patient_resource_id"
+    code = SqlColumn("admissions", "code", concept_map=ConceptMap("cm_gender"))
+    analysis.columns.add(code)
+    analysis.joins = {SqlJoin(analysis.primary_key_column, SqlColumn("admissions", "subject_id"))}
+    analysis.attributes = [Attribute("code", [code])]
+
+    def clean_records():
+        records = extractor.split_records(extractor.extract(resource_mapping, analysis), analysis)
+        return [
+            clean_data(apply_str(record), analysis.attributes, analysis.primary_key_column)
+            for record in records
+        ]
+
+    translated_records = clean_records()
+    with mock.patch("extractor.src.extract.extractor.CONCEPT_MAP_PUSHDOWN_MAX_SIZE", 0):
+        assert translated_records == clean_records()
+    # The rows of a patient are not ordered
+    codes = [
+        sorted(record[("code", ("admissions", "code"))], key=str) for record in translated_records
+    ]
+    assert codes == [
+        ["female", "female"],
+        ["F", "M"],
+        ["F", None],
+    ]
+
+
+def test_extract_static_resource(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db")
+    analysis.resource_id = "organization_resource_id"
+    analysis.is_static = True
+    analysis.columns = set()
+    statements = []
+    event.listen(
+        extractor.engine, "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+    events = []
+    batcher = EventBatcher(
+        events.append, {"batch_id": "b", "resource_type": "Organization", "resource_id": "r"}
+    )
+
+    def process_records(records, save_progress=None):
+        n_records = 0
+        for record in records:
+            batcher.add_serialized(*EventBatcher.serialize(record))
+            n_records += 1
+        batcher.flush()
+        return n_records
+
+    assert extractor.extract_partitions(
+        resource_mapping, analysis, process_records, batch_id="b"
+    ) == [1]
+    assert statements == []
+    assert [json.loads(value)["dataframes"] for value in events] == [[[]]]
+
+
+def test_set_statement_timeout_oracle():
+    connection = mock.MagicMock()
+    connection.dialect.name = "oracle"
+    dbapi_connection = connection.connection.connection
+
+    Extractor.set_statement_timeout(connection, 1.5)
+    assert dbapi_connection.callTimeout == 1500
+    Extractor.set_statement_timeout(connection, None)
+    assert dbapi_connection.callTimeout == 0
+
+    # cx_Oracle < 7.2
+    connection.connection.connection = mock.Mock(spec=[])
+    Extractor.set_statement_timeout(connection, 1.5)
+    assert not hasattr(connection.connection.connection, "callTimeout")
+
+
+@mock.patch("extractor.src.extract.budget.EXTRACT_RESOURCE_LIMITS", {"patient": {"max_rows": 5}})
+def test_extract_row_limit(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db")
+    analysis.resource_id = "patient"
+
+    def process_records(records):
+        return len(list(records))
+
+    with raises(RowLimitExceeded):
+        extractor.extract_partitions(resource_mapping, analysis, process_records, partitions=3)
+
+    analysis.resource_id = "other"
+    assert extractor.extract_partitions(
+        resource_mapping, analysis, process_records, partitions=3
+    ) == [3, 4, 3]
+
+
+@mock.patch("extractor.src.extract.extractor.EXTRACT_MEMORY_BUDGET", 1000)
+@mock.patch("extractor.src.extract.extractor.ChunkSizer", partial(ChunkSizer, sample_size=10))
+def test_run_sql_query_memory_budget(tmp_path):
+    extractor, _, _ = create_sqlite_extractor(tmp_path / "mimic.db", n_patients=100)
+    query = Query(tables["patients"].c.subject_id.label("patients_subject_id"))
+
+    sizes = [len(chunk) for chunk in extractor.run_sql_query(query)]
+
+    # The first chunk samples the size of the rows
+    assert sizes[0] == 10 and 10 < sizes[1] < 100
+    assert sum(sizes) == 100
+
+
+@mock.patch("extractor.src.extract.extractor.STRATEGY_ROWS_PER_PARTITION", 100)
+@mock.patch("extractor.src.extract.extractor.STRATEGY_MAX_PARTITIONS", 4)
+def test_choose_strategy():
+    def choose_strategy(rows, branch_rows=()):
+        explanation = {
+            "estimated_rows": rows,
+            "branches": [{"estimated_rows": rows} for rows in branch_rows],
+        }
+        strategy = Extractor.choose_strategy(explanation)
+        return strategy["strategy"], strategy["partitions"], strategy["decompose"]
+
+    assert choose_strategy(None) == (None, None, None)
+    assert choose_strategy(50) == ("single", 1, False)
+    assert choose_strategy(250) == ("partitioned", 3, False)
+    assert choose_strategy(10000) == ("partitioned", 4, False)
+    assert choose_strategy(250, [100, 100]) == ("partitioned", 3, False)
+    assert choose_strategy(1000, [100, 100]) == ("decomposed", 2, True)
+
+
+@mock.patch("extractor.src.extract.extractor.AUTO_STRATEGY", True)
+def test_extract_auto_strategy(tmp_path):
+    extractor, resource_mapping, analysis = create_sqlite_extractor(tmp_path / "mimic.db")
+    analysis.resource_id = "patient_resource_id"
+
+    def process_records(records):
+        return [record["patients_subject_id"][0] for record in records]
+
+    # sqlite has no supported EXPLAIN, the default strategy is used
+    explanation = extractor.explain(resource_mapping, analysis)
+    assert explanation["strategy"] is None
+    assert extractor.extract_partitions(resource_mapping, analysis, process_records) == [
+        list(range(10))
+    ]
+
+    extractor.strategies.clear()
+    explanation = {**explanation, "strategy": "partitioned", "partitions": 2, "decompose": False}
+    with mock.patch.object(extractor, "explain", return_value=explanation) as explain:
+        pk_values_by_range = extractor.extract_partitions(
+            resource_mapping, analysis, process_records
+        )
+        extractor.extract_partitions(resource_mapping, analysis, process_records)
+    assert pk_values_by_range == [[0, 1, 2, 3, 4], [5, 6, 7, 8, 9]]
+    # The strategy is cached
+    assert explain.call_count == 1
+
+
+@mock.patch("extractor.src.extract.extractor.AUTO_STRATEGY", True)
+def test_extraction_strategy_explicit_settings():
+    extractor = Extractor()
+    analysis = Analysis()
+    analysis.resource_id = "patient"
+    auto_strategy = {
+        "strategy": "decomposed",
+        "estimated_rows": 10 ** 6,
+        "partitions": 4,
+        "decompose": True,
+    }
+
+    with mock.patch.object(extractor, "explain", return_value=auto_strategy), mock.patch.object(
+        extractor, "join_branches", return_value=["branch"]
+    ):
+        assert extractor.extraction_strategy({}, analysis, None, None, None) == (4, ["branch"])
+        # The settings which are configured or provided are kept
+        with mock.patch("extractor.src.extract.extractor.EXTRACT_PARTITIONS", 2):
+            assert extractor.extraction_strategy({}, analysis, None, None, None) == (
+                2,
+                ["branch"],
+            )
+        with mock.patch("extractor.src.extract.extractor.DECOMPOSE_JOINS", False):
+            assert extractor.extraction_strategy({}, analysis, None, None, None) == (4, None)
+        assert extractor.extraction_strategy({}, analysis, None, 3, False) == (3, None)
+        # No automatic strategy for some primary key values
+        assert extractor.extraction_strategy({}, analysis, [1], None, None) == (None, None)
+
+
+@mock.patch("extractor.src.extract.extractor.AUTO_STRATEGY", True)
+def test_auto_strategy_concurrent_resources():
+    extractor = Extractor()
+    patient, encounter = Analysis(), Analysis()
+    patient.resource_id, encounter.resource_id = "patient", "encounter"
+    explaining, explained = threading.Event(), threading.Event()
+
+    def explain(resource_mapping, analysis):
+        if analysis is patient:
+            explaining.set()
+            assert explained.wait(5)
+        return {"strategy": "single", "estimated_rows": 1, "partitions": 1, "decompose": False}
+
+    with mock.patch.object(extractor, "explain", side_effect=explain):
+        thread = threading.Thread(target=extractor.auto_strategy, args=({}, patient))
+        thread.start()
+        assert explaining.wait(5)
+        # The strategy of another resource is chosen while the first one is explained
+        assert extractor.auto_strategy({}, encounter) == (1, False)
+        explained.set()
+        thread.join()
@@ -0,0 +1,46 @@
+import threading
+from unittest import mock
+
+from extractor.src.extract.lru_cache import LRUCache
+
+
+def test_lru_cache_eviction():
+    on_evict = mock.Mock()
+    cache = LRUCache(2, on_evict=on_evict)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    # b is the least recently used item
+    cache.set("c", 3)
+
+    on_evict.assert_called_once_with(2)
+    assert cache.get("b") is None
+    assert cache.get_or_set("a", lambda: 0) == 1
+
+
+def test_lru_cache_get_or_set_concurrent_builds():
+    cache = LRUCache(10)
+    building = threading.Event()
+    release = threading.Event()
+
+    def build_slow():
+        building.set()
+        release.wait(5)
+        return "slow"
+
+    build = mock.Mock(side_effect=build_slow)
+    threads = [threading.Thread(target=cache.get_or_set, args=("slow", build)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    assert building.wait(5)
+
+    # The slow build of a key doesn't block the other keys
+    assert cache.get_or_set("fast", lambda: "fast") == "fast"
+
+    release.set()
+    for thread in threads:
+        thread.join()
+    # The value of a key is built once
+    build.assert_called_once()
+    assert cache.get("slow") == "slow"
+    assert cache.build_locks == {}
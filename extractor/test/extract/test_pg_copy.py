@@ -0,0 +1,101 @@
+from pytest import raises
+from unittest import mock
+
+from sqlalchemy import bindparam, column, create_engine, select, table, Integer, String, text
+from sqlalchemy.dialects import postgresql
+
+from extractor.src.extract.budget import ChunkSizer
+from extractor.src.extract.extractor import Extractor
+from extractor.src.extract.pg_copy import copy_chunks, copy_supported, render_query
+
+patients = table("patients", column("subject_id", String), column("gender", String))
+query = (
+    select([patients.c.subject_id, patients.c.gender])
+    .where(patients.c.subject_id.in_(bindparam("pk_values", expanding=True)))
+    .where(patients.c.gender != bindparam("gender"))
+)
+compiled_query = query.compile(dialect=postgresql.psycopg2.dialect())
+
+
+def mogrify(sql, values):
+    return (sql % {name: repr(value) for name, value in values.items()}).encode()
+
+
+def test_render_query():
+    cursor = mock.MagicMock(mogrify=mogrify)
+
+    sql = render_query(cursor, compiled_query, {"pk_values": [1, 2], "gender": "M"})
+    assert sql == (
+        "SELECT patients.subject_id, patients.gender \n"
+        "FROM patients \n"
+        "WHERE patients.subject_id IN (1, 2) AND patients.gender != 'M'"
+    )
+
+    sql = render_query(cursor, compiled_query, {"pk_values": [], "gender": "M"})
+    assert "patients.subject_id IN (NULL)" in sql
+
+
+def test_copy_chunks():
+    def copy_expert(sql, pipe):
+        assert sql.startswith("COPY (SELECT")
+        assert sql.endswith(") TO STDOUT WITH (FORMAT csv, HEADER, NULL '\\N')")
+        pipe.write(b"subject_id,gender\n")
+        for pk in range(5):
+            gender = "F" if pk % 2 else "\\N"
+            pipe.write(f"{pk},{gender}\n".encode())
+
+    cursor = mock.MagicMock(mogrify=mogrify, copy_expert=copy_expert)
+    connection = mock.MagicMock(cursor=lambda: cursor)
+
+    chunks = list(
+        copy_chunks(connection, compiled_query, {"pk_values": [1], "gender": "M"}, ChunkSizer(2))
+    )
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert chunks[0].to_dict(orient="list") == {"subject_id": ["0", "1"], "gender": [None, "F"]}
+
+    cursor.copy_expert = mock.Mock(side_effect=ValueError("copy error"))
+    with raises(ValueError, match="copy error"):
+        list(
+            copy_chunks(
+                connection, compiled_query, {"pk_values": [1], "gender": "M"}, ChunkSizer(2)
+            )
+        )
+
+
+def test_copy_supported():
+    assert copy_supported(compiled_query)
+
+    admissions = table("admissions", column("row_id", Integer), column("admission_type", String))
+    mixed_query = select([admissions.c.row_id, admissions.c.admission_type])
+    assert not copy_supported(mixed_query.compile(dialect=postgresql.psycopg2.dialect()))
+
+
+def test_copy_chunks_same_as_cursor():
+    rows = [("1", "F"), ("2", ""), ("3", None), ("4", "NA"), ("5", "a,\"b\"\nc")]
+
+    # The rows fetched through a cursor
+    engine = create_engine("sqlite://")
+    engine.execute("CREATE TABLE patients (subject_id TEXT, gender TEXT)")
+    engine.execute("INSERT INTO patients VALUES (?, ?)", rows)
+    result = engine.execute(text("SELECT subject_id, gender FROM patients"))
+    (cursor_df,) = Extractor.fetch_dataframes(result, ChunkSizer(10))
+
+    # The same rows as PostgreSQL exports them with COPY
+    def copy_expert(sql, pipe):
+        pipe.write(
+            b"subject_id,gender\n"
+            b"1,F\n"
+            b'2,""\n'
+            b"3,\\N\n"
+            b"4,NA\n"
+            b'5,"a,""b""\nc"\n'
+        )
+
+    cursor = mock.MagicMock(mogrify=mogrify, copy_expert=copy_expert)
+    connection = mock.MagicMock(cursor=lambda: cursor)
+    (copy_df,) = copy_chunks(
+        connection, compiled_query, {"pk_values": [1], "gender": "M"}, ChunkSizer(10)
+    )
+
+    assert copy_df.to_dict(orient="list") == cursor_df.to_dict(orient="list")
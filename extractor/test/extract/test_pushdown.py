@@ -0,0 +1,44 @@
+from sqlalchemy import Column, Date, DateTime, Integer, MetaData, String, Table
+from sqlalchemy.dialects import oracle, postgresql
+
+from extractor.src.extract.pushdown import cleaning_script_sql
+
+table = Table(
+    "patients",
+    MetaData(),
+    Column("name", String),
+    Column("age", Integer),
+    Column("birth_date", Date),
+    Column("admission", DateTime),
+    Column("discharge", DateTime(timezone=True)),
+)
+
+
+def compile_sql(expression, dialect):
+    return str(expression.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+
+
+def test_cleaning_script_sql():
+    sql = compile_sql(
+        cleaning_script_sql("strip", "postgresql", table.c.name), postgresql.dialect()
+    )
+    assert "btrim(patients.name" in sql
+
+    sql = compile_sql(
+        cleaning_script_sql("clean_date", "postgresql", table.c.birth_date), postgresql.dialect()
+    )
+    assert "to_char(patients.birth_date, 'YYYY-MM-DD')" in sql
+
+    sql = compile_sql(cleaning_script_sql("map_gender", "oracle", table.c.name), oracle.dialect())
+    assert "WHEN (patients.name IN ('M', 'HL7:M')) THEN 'male'" in sql
+    assert "trim(patients.name) IS NULL" in sql
+
+
+def test_cleaning_script_sql_not_supported():
+    # Unknown script or dialect
+    assert cleaning_script_sql("make_title", "postgresql", table.c.name) is None
+    assert cleaning_script_sql("strip", "oracle", table.c.name) is None
+    # Type of column which the script can't be applied to
+    assert cleaning_script_sql("strip", "postgresql", table.c.age) is None
+    assert cleaning_script_sql("clean_date", "postgresql", table.c.name) is None
+    assert cleaning_script_sql("clean_date", "postgresql", table.c.discharge) is None
@@ -0,0 +1,117 @@
+import pickle
+import threading
+from unittest import mock
+
+from sqlalchemy import create_engine, Column, Integer, MetaData, Table
+
+from extractor.src.extract.schema_cache import SchemaCache
+
+
+def create_source_db(path):
+    engine = create_engine(f"sqlite:///{path}")
+    Table("patients", MetaData(), Column("subject_id", Integer)).create(engine)
+    return engine
+
+
+def test_get_table_reflects_once(tmp_path):
+    engine = create_source_db(tmp_path / "source.db")
+    cache = SchemaCache(path=None)
+
+    with mock.patch.object(SchemaCache, "reflect_table", wraps=SchemaCache.reflect_table) as m:
+        table = cache.get_table(engine, None, "patients")
+        assert cache.get_table(engine, None, "patients") is table
+        # The cache survives a new engine on the same database
+        assert cache.get_table(create_engine(engine.url), None, "patients") is table
+        assert m.call_count == 1
+
+    assert list(table.c.keys()) == ["subject_id"]
+
+
+def test_get_table_ttl_and_invalidate(tmp_path):
+    engine = create_source_db(tmp_path / "source.db")
+
+    with mock.patch.object(SchemaCache, "reflect_table", wraps=SchemaCache.reflect_table) as m:
+        cache = SchemaCache(path=None, ttl=0)
+        cache.get_table(engine, None, "patients")
+        cache.get_table(engine, None, "patients")
+        assert m.call_count == 2
+
+        cache = SchemaCache(path=None)
+        cache.get_table(engine, None, "patients")
+        cache.invalidate(engine, table_name="patients")
+        cache.get_table(engine, None, "patients")
+        assert m.call_count == 4
+
+
+def test_save_and_load(tmp_path):
+    engine = create_source_db(tmp_path / "source.db")
+    cache_path = str(tmp_path / "schema_cache.pickle")
+
+    SchemaCache(path=cache_path).get_table(engine, None, "patients")
+
+    with mock.patch.object(SchemaCache, "reflect_table") as m:
+        table = SchemaCache(path=cache_path).get_table(engine, None, "patients")
+        m.assert_not_called()
+
+    assert list(table.c.keys()) == ["subject_id"]
+
+
+def test_get_table_concurrent_reflections(tmp_path):
+    engine = create_source_db(tmp_path / "source.db")
+    Table("admissions", MetaData(), Column("row_id", Integer)).create(engine)
+    cache = SchemaCache(path=None)
+    reflecting = threading.Event()
+    release = threading.Event()
+    reflect_table = SchemaCache.reflect_table
+
+    def slow_reflect_table(engine, metadata, owner, table_name):
+        if table_name == "patients":
+            reflecting.set()
+            release.wait(5)
+        return reflect_table(engine, metadata, owner, table_name)
+
+    with mock.patch.object(SchemaCache, "reflect_table", side_effect=slow_reflect_table):
+        thread = threading.Thread(target=cache.get_table, args=(engine, None, "patients"))
+        thread.start()
+        assert reflecting.wait(5)
+
+        # The slow reflection of a table doesn't block the reflection of another one
+        assert list(cache.get_table(engine, None, "admissions").c.keys()) == ["row_id"]
+
+        release.set()
+        thread.join()
+    assert list(cache.get_table(engine, None, "patients").c.keys()) == ["subject_id"]
+
+
+def test_save_outside_lock(tmp_path):
+    engine = create_source_db(tmp_path / "source.db")
+    Table("admissions", MetaData(), Column("row_id", Integer)).create(engine)
+    cache_path = str(tmp_path / "schema_cache.pickle")
+    cache = SchemaCache(path=cache_path)
+    writing = threading.Event()
+    release = threading.Event()
+    dump = pickle.dump
+
+    def slow_dump(content, f):
+        if not writing.is_set():
+            writing.set()
+            release.wait(5)
+        dump(content, f)
+
+    with mock.patch("extractor.src.extract.schema_cache.pickle.dump", side_effect=slow_dump):
+        thread = threading.Thread(target=cache.get_table, args=(engine, None, "patients"))
+        thread.start()
+        assert writing.wait(5)
+
+        # Another table is reflected while the cache file is written
+        assert list(cache.get_table(engine, None, "admissions").c.keys()) == ["row_id"]
+
+        release.set()
+        thread.join()
+
+    # The writing thread also saved the table reflected meanwhile
+    with mock.patch.object(SchemaCache, "reflect_table") as m:
+        loaded_cache = SchemaCache(path=cache_path)
+        loaded_cache.get_table(engine, None, "patients")
+        loaded_cache.get_table(engine, None, "admissions")
+        m.assert_not_called()
@@ -0,0 +1,89 @@
+import threading
+from unittest import mock
+
+from extractor.src.extract.source_limiter import SourceLimiter
+
+
+def test_source_limiter_concurrency():
+    limiter = SourceLimiter()
+    fetching, fetched = threading.Event(), threading.Event()
+
+    def fetch_chunks():
+        yield 1
+        fetching.set()
+        assert fetched.wait(5)
+        yield 2
+
+    with mock.patch.dict(
+        "extractor.src.extract.source_limiter.SOURCE_LIMITS", {"db:5432/a": {"max_concurrency": 1}}
+    ):
+        chunks = limiter.limit("db:5432/a", fetch_chunks())
+        # The slot is free while a chunk is processed
+        assert next(chunks) == 1
+        with limiter.slot("db:5432/a"):
+            pass
+
+        # The slot of the source is held while a chunk is fetched
+        thread = threading.Thread(target=lambda: list(chunks))
+        thread.start()
+        assert fetching.wait(5)
+        acquired = threading.Event()
+
+        def run_query():
+            with limiter.slot("db:5432/a"):
+                acquired.set()
+
+        query_thread = threading.Thread(target=run_query)
+        query_thread.start()
+        assert not acquired.wait(0.1)
+
+        # Other sources are not limited
+        with limiter.slot("db:5432/b"):
+            pass
+
+        fetched.set()
+        thread.join()
+        query_thread.join()
+        assert acquired.is_set()
+
+
+def test_source_limiter_rate():
+    now = 0.0
+    sleeps = []
+
+    def sleep(duration):
+        sleeps.append(duration)
+
+    limiter = SourceLimiter(clock=lambda: now, sleep=sleep)
+    with mock.patch.dict(
+        "extractor.src.extract.source_limiter.SOURCE_LIMITS",
+        {"db:5432/a": {"max_queries_per_second": 2}},
+    ):
+        for _ in range(3):
+            with limiter.slot("db:5432/a"):
+                pass
+        now = 2.0
+        with limiter.slot("db:5432/a"):
+            pass
+        # The rate only applies to the start of the queries, not to their chunks
+        assert list(limiter.limit("db:5432/a", iter([1, 2, 3]))) == [1, 2, 3]
+
+    assert sleeps == [0.5, 1.0, 0.5]
+
+
+def test_source_limiter_processes():
+    sleeps = []
+    limiter = SourceLimiter(processes=3, clock=lambda: 0.0, sleep=sleeps.append)
+    with mock.patch.dict(
+        "extractor.src.extract.source_limiter.SOURCE_LIMITS",
+        {"db:5432/a": {"max_concurrency": 7, "max_queries_per_second": 6}},
+    ):
+        semaphore, interval = limiter.source_limits("db:5432/a")
+        for _ in range(2):
+            with limiter.slot("db:5432/a"):
+                pass
+
+    # Each of the 3 processes runs 2 queries at a time, and 2 queries per second
+    assert [semaphore.acquire(blocking=False) for _ in range(3)] == [True, True, False]
+    assert interval == 0.5
+    assert sleeps == [0.5]
@@ -0,0 +1,55 @@
+import datetime
+import json
+
+from extractor.src.event_batcher import EventBatcher
+
+header = {"batch_id": "b", "resource_type": "Patient", "resource_id": "r"}
+
+
+def test_event_batcher_max_records():
+    events = []
+    batcher = EventBatcher(lambda value: events.append(json.loads(value)), header, max_records=2)
+
+    for pk in range(3):
+        record = {"patients_id": [pk, pk], "admissions_id": [2 * pk, 2 * pk + 1]}
+        batcher.add_serialized(*EventBatcher.serialize(record))
+    batcher.flush()
+
+    assert events == [
+        {
+            **header,
+            "columns": ["patients_id", "admissions_id"],
+            "dataframes": [[[0, 0], [0, 1]], [[1, 1], [2, 3]]],
+        },
+        {**header, "columns": ["patients_id", "admissions_id"], "dataframes": [[[2, 2], [4, 5]]]},
+    ]
+
+
+def test_event_batcher_max_bytes():
+    events = []
+    batcher = EventBatcher(lambda value: events.append(json.loads(value)), header, max_bytes=40)
+
+    for pk, date in [(1, datetime.date(2150, 8, 29)), (2, datetime.date(2150, 8, 30))]:
+        batcher.add_serialized(*EventBatcher.serialize({"id": [pk], "date": [date]}))
+    # A record with other columns starts a new event
+    batcher.add_serialized(*EventBatcher.serialize({"id": [3]}))
+    batcher.flush()
+
+    assert [event["dataframes"] for event in events] == [
+        [[[1], ["2150-08-29"]]],
+        [[[2], ["2150-08-30"]]],
+        [[[3]]],
+    ]
+
+
+def test_event_batcher_hashes():
+    events = []
+    batcher = EventBatcher(lambda value: events.append(json.loads(value)), header)
+
+    for pk in range(2):
+        batcher.add_serialized(*EventBatcher.serialize({"id": [pk]}), record_hash=f"hash{pk}")
+    batcher.flush()
+
+    assert events == [
+        {**header, "columns": ["id"], "hashes": ["hash0", "hash1"], "dataframes": [[[0]], [[1]]]}
+    ]
@@ -0,0 +1,49 @@
+import threading
+
+from extractor.src.fair_scheduler import FairScheduler
+
+
+def test_fair_scheduler_serves_sources_in_turn():
+    done = []
+    scheduler = FairScheduler(workers=1)
+    for task in ["A1", "A2", "A3", "B1", "C1"]:
+        scheduler.submit(task[0], lambda task=task: done.append(task))
+    scheduler.start()
+    scheduler.stop()
+
+    assert done == ["A1", "B1", "C1", "A2", "A3"]
+
+
+def test_fair_scheduler_max_tasks_per_source():
+    release = threading.Event()
+    b_done = threading.Event()
+    done = []
+
+    def blocking_task():
+        release.wait(5)
+        done.append("A1")
+
+    scheduler = FairScheduler(workers=2, max_tasks_per_source=1)
+    scheduler.submit("A", blocking_task)
+    scheduler.submit("A", lambda: done.append("A2"))
+    scheduler.submit("B", lambda: (done.append("B1"), b_done.set()))
+    scheduler.start()
+
+    # The second task of A waits for the first one while B is served
+    assert b_done.wait(5)
+    assert done == ["B1"]
+
+    release.set()
+    scheduler.stop()
+    assert done == ["B1", "A1", "A2"]
+
+
+def test_fair_scheduler_task_error():
+    done = []
+    scheduler = FairScheduler(workers=1)
+    scheduler.submit("A", lambda: 1 / 0)
+    scheduler.submit("A", lambda: done.append("A2"))
+    scheduler.start()
+    scheduler.stop()
+
+    assert done == ["A2"]
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from extractor.src.pipeline import fan_out, run_pipeline
+
+
+def test_run_pipeline_order():
+    consumed = []
+
+    def transform(item):
+        # The last items are transformed first
+        time.sleep((10 - item) / 1000)
+        return item * 2
+
+    n_items = run_pipeline(range(10), transform, consumed.append, workers=4)
+
+    assert n_items == 10
+    assert consumed == [2 * item for item in range(10)]
+
+
+def test_run_pipeline_backpressure():
+    fetched = []
+    consumer_blocked = threading.Event()
+
+    def items():
+        for item in range(100):
+            fetched.append(item)
+            yield item
+
+    def consume(item):
+        if item == 0:
+            # Give the fetch stage time to run ahead of the consumer
+            time.sleep(0.1)
+            consumer_blocked.set()
+            assert len(fetched) <= 5
+
+    run_pipeline(items(), lambda item: item, consume, workers=2, queue_size=3)
+
+    assert consumer_blocked.is_set()
+    assert len(fetched) == 100
+
+
+def test_run_pipeline_errors():
+    def items():
+        yield 1
+        raise ValueError("fetch error")
+
+    with pytest.raises(ValueError, match="fetch error"):
+        run_pipeline(items(), lambda item: item, lambda item: None)
+
+    def transform(item):
+        raise ValueError("transform error")
+
+    with pytest.raises(ValueError, match="transform error"):
+        run_pipeline(range(100), transform, lambda item: None, queue_size=2)
+
+
+def test_fan_out():
+    def consumer(factor):
+        return lambda items: [factor * item for item in items]
+
+    def failing_consumer(items):
+        for item in items:
+            raise ValueError("consumer error")
+
+    assert fan_out(range(100), [consumer(1), consumer(2)], queue_size=2) == [
+        list(range(100)),
+        list(range(0, 200, 2)),
+    ]
+
+    # The other consumers still get all the items
+    results = []
+    with pytest.raises(ValueError, match="consumer error"):
+        fan_out(range(100), [results.extend, failing_consumer], queue_size=2)
+    assert results == list(range(100))
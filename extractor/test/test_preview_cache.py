@@ -0,0 +1,78 @@
+from unittest import mock
+
+from analyzer.src.analyze.analysis import Analysis
+from analyzer.src.analyze.attribute import Attribute
+from analyzer.src.analyze.concept_map import ConceptMap
+from analyzer.src.analyze.sql_column import SqlColumn
+
+from extractor.src.preview_cache import PreviewCache
+
+resource_mapping = {"definitionId": "Patient", "filters": []}
+analysis = Analysis()
+
+
+def test_preview_cache_hit():
+    cache = PreviewCache(maxsize=2, ttl=60)
+    extract_rows = mock.Mock(return_value=[{"patients_subject_id": [1]}])
+
+    assert cache.get_or_extract("patient", resource_mapping, analysis, [1], extract_rows) == [
+        {"patients_subject_id": [1]}
+    ]
+    assert cache.get_or_extract("patient", resource_mapping, analysis, [1], extract_rows) == [
+        {"patients_subject_id": [1]}
+    ]
+    assert extract_rows.call_count == 1
+
+    # Other primary key values
+    cache.get_or_extract("patient", resource_mapping, analysis, [2], extract_rows)
+    assert extract_rows.call_count == 2
+
+
+def test_preview_cache_ttl():
+    cache = PreviewCache(maxsize=2, ttl=60)
+    extract_rows = mock.Mock(return_value=[])
+
+    with mock.patch("extractor.src.extract.lru_cache.time.time", return_value=1000):
+        cache.get_or_extract("patient", resource_mapping, analysis, [1], extract_rows)
+    with mock.patch("extractor.src.extract.lru_cache.time.time", return_value=1060):
+        cache.get_or_extract("patient", resource_mapping, analysis, [1], extract_rows)
+    assert extract_rows.call_count == 1
+
+    # The preview expired
+    with mock.patch("extractor.src.extract.lru_cache.time.time", return_value=1061):
+        cache.get_or_extract("patient", resource_mapping, analysis, [1], extract_rows)
+    assert extract_rows.call_count == 2
+
+
+def test_preview_cache_mapping_change():
+    cache = PreviewCache(maxsize=2, ttl=60)
+    extract_rows = mock.Mock(return_value=[])
+
+    cache.get_or_extract("patient", resource_mapping, analysis, [1], extract_rows)
+    modified_mapping = {
+        **resource_mapping,
+        "filters": [{"relation": "=", "value": "F", "sqlColumn": {"column": "gender"}}],
+    }
+    cache.get_or_extract("patient", modified_mapping, analysis, [1], extract_rows)
+    assert extract_rows.call_count == 2
+
+
+@mock.patch(
+    "analyzer.src.analyze.ConceptMap.fetch",
+    return_value={
+        "id": "cm_gender",
+        "title": "gender",
+        "group": [{"element": [{"code": "F", "target": [{"code": "female"}]}]}],
+    },
+)
+def test_preview_cache_concept_map_change(_):
+    cache = PreviewCache(maxsize=2, ttl=60)
+    extract_rows = mock.Mock(return_value=[])
+    translated_analysis = Analysis()
+    gender = SqlColumn("patients", "gender", concept_map=ConceptMap("cm_gender"))
+    translated_analysis.attributes = [Attribute("gender", [gender])]
+
+    cache.get_or_extract("patient", resource_mapping, translated_analysis, [1], extract_rows)
+    gender.concept_map.mapping = {"F": "f"}
+    cache.get_or_extract("patient", resource_mapping, translated_analysis, [1], extract_rows)
+    assert extract_rows.call_count == 2
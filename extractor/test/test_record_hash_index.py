@@ -0,0 +1,73 @@
+import datetime
+from unittest import mock
+
+from analyzer.src.analyze.analysis import Analysis
+from analyzer.src.analyze.attribute import Attribute
+from analyzer.src.analyze.concept_map import ConceptMap
+from analyzer.src.analyze.sql_column import SqlColumn
+
+from extractor.src.extract.extractor import Extractor
+from extractor.src.extract.state_store import StateStore
+from extractor.src.record_hash_index import RecordHashIndex
+
+
+def test_record_hash():
+    index = RecordHashIndex(None, "r", "patients_id", salt="v1")
+    record = {"patients_id": [1, 1], "admissions_date": [datetime.date(2020, 1, 1), None]}
+    record_hash = index.record_hash(record)
+
+    # The order of the rows and of the columns doesn't matter
+    assert index.record_hash(
+        {"admissions_date": [None, datetime.date(2020, 1, 1)], "patients_id": [1, 1]}
+    ) == record_hash
+    assert index.record_hash({**record, "admissions_date": [None, None]}) != record_hash
+    assert RecordHashIndex(None, "r", "patients_id", salt="v2").record_hash(record) != record_hash
+    # The single value of a column of an aggregated record applies to all the rows
+    assert index.record_hash({**record, "patients_id": [1]}) == record_hash
+
+
+def test_record_hash_index(tmp_path):
+    store = StateStore("record_hashes", path=str(tmp_path / "state.sqlite"))
+    index = RecordHashIndex(store, "r", "patients_id")
+    record = {"patients_id": [1], "patients_name": ["alice"]}
+    record_hash = index.record_hash(record)
+
+    index.add(record, record_hash)
+    # The hashes are only stored once saved
+    assert not index.is_unchanged(record, record_hash)
+    index.save()
+    assert index.is_unchanged(record, record_hash)
+    assert not index.is_unchanged(record, index.record_hash({**record, "patients_name": ["bob"]}))
+    assert not RecordHashIndex(store, "other", "patients_id").is_unchanged(record, record_hash)
+
+
+@mock.patch(
+    "analyzer.src.analyze.ConceptMap.fetch",
+    return_value={
+        "id": "cm_gender",
+        "title": "gender",
+        "group": [{"element": [{"code": "F", "target": [{"code": "female"}]}]}],
+    },
+)
+def test_record_hash_index_concept_map_change(_, tmp_path):
+    store = StateStore("record_hashes", path=str(tmp_path / "state.sqlite"))
+    resource_mapping = {"id": "r", "definitionId": "Patient"}
+    analysis = Analysis()
+    gender = SqlColumn("patients", "gender", concept_map=ConceptMap("cm_gender"))
+    analysis.attributes = [Attribute("gender", [gender])]
+
+    def create_index():
+        salt = Extractor.resource_version(resource_mapping, analysis)
+        return RecordHashIndex(store, "r", "patients_id", salt=salt)
+
+    index = create_index()
+    record = {"patients_id": [1], "patients_gender": ["F"]}
+    index.add(record, index.record_hash(record))
+    index.save()
+    index = create_index()
+    assert index.is_unchanged(record, index.record_hash(record))
+
+    # The documents of the records change with the concept map
+    gender.concept_map.mapping = {"F": "f"}
+    index = create_index()
+    assert not index.is_unchanged(record, index.record_hash(record))
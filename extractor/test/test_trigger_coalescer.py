@@ -0,0 +1,52 @@
+from extractor.src.trigger_coalescer import TriggerCoalescer
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+def test_trigger_coalescer_window():
+    extractions = []
+    clock = FakeClock()
+    coalescer = TriggerCoalescer(
+        lambda *args: extractions.append(args), window=10, max_pk_values=100, clock=clock
+    )
+
+    coalescer.add("patient", [1], "batch")
+    clock.time = 5
+    coalescer.add("patient", [2, 1], "batch")
+    coalescer.add("encounter", [3], "batch")
+    coalescer.flush_due()
+    assert extractions == []
+
+    clock.time = 10
+    coalescer.flush_due()
+    assert extractions == [("patient", [1, 2], "batch")]
+
+    clock.time = 15
+    coalescer.flush_due()
+    assert extractions == [("patient", [1, 2], "batch"), ("encounter", [3], "batch")]
+
+
+def test_trigger_coalescer_max_pk_values():
+    extractions = []
+    coalescer = TriggerCoalescer(
+        lambda *args: extractions.append(args), window=10, max_pk_values=3, clock=FakeClock()
+    )
+
+    coalescer.add("patient", [1, 2])
+    coalescer.add("patient", [3, 4])
+    assert extractions == [("patient", [1, 2, 3, 4], None)]
+
+    # Triggers of whole resources and of other batches are not merged
+    coalescer.add("patient", [5])
+    coalescer.add("patient", [6], "other batch")
+    coalescer.add("patient", None)
+    assert extractions[1:] == [("patient", None, None)]
+
+    coalescer.flush()
+    assert extractions[2:] == [("patient", [5], None), ("patient", [6], "other batch")]
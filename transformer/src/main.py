@@ -49,12 +49,13 @@ def process_event_with_producer(producer):
         logger.debug("Transformer")
         logger.debug(msg_value)
 
-        try:
-            fhir_document = transform_row(msg_value["resource_id"], msg_value["dataframe"])
-            producer.produce_event(topic=PRODUCED_TOPIC, record=fhir_document)
+        for row in unpack_dataframes(msg_value):
+            try:
+                fhir_document = transform_row(msg_value["resource_id"], row)
+                producer.produce_event(topic=PRODUCED_TOPIC, record=fhir_document)
 
-        except Exception as err:
-            logger.error(err)
+            except Exception as err:
+                logger.error(err)
 
     return process_event
 
@@ -68,6 +69,19 @@ def manage_kafka_error(msg):
     logger.error(msg.error())
 
 
+def unpack_dataframes(event):
+    """
+    Get the rows of an extract event. Events contain either a single dataframe or,
+    when they are batched, a list of dataframes sharing the same columns.
+    :param event: deserialized extract event
+    :return: list of {column: [values]} dicts
+    """
+    if "dataframes" in event:
+        columns = event["columns"]
+        return [dict(zip(columns, values)) for values in event["dataframes"]]
+    return [event["dataframe"]]
+
+
 def transform_row(resource_id, row):
     logger.debug("Get Analysis")
     analysis = analyzer.get_analysis(resource_id)
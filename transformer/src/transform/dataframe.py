@@ -24,6 +24,8 @@ def clean_data(data, attributes: List[Attribute], primary_key):
         ...
     }
     and where all values are cleaned (with cleaning scripts and concept maps).
+    Cleaning scripts and concept maps are skipped when the Extractor already applied
+    them (see SqlColumn.cleaned_column_name and SqlColumn.translated_column_name).
     """
     cleaned_data = {}
     for attribute in attributes:
@@ -34,14 +36,26 @@ def clean_data(data, attributes: List[Attribute], primary_key):
             # We use col.table because it's needed in squash_rows
             attr_col_name = (attribute.path, (col.table, col.column))
 
-            # Get the original column
-            cleaned_data[attr_col_name] = data[dict_col_name]
-
-            # Apply cleaning script
-            if col.cleaning_script:
-                cleaned_data[attr_col_name] = col.cleaning_script.apply(
-                    cleaned_data[attr_col_name], dict_col_name, primary_key
-                )
+            translated_values = data.get(col.translated_column_name())
+            if translated_values is not None and None not in translated_values:
+                # The cleaning script and the concept map were applied by the extractor.
+                # Otherwise some values are unknown to the concept map, which is applied
+                # below to handle them as usual.
+                cleaned_data[attr_col_name] = translated_values
+                continue
+
+            if col.cleaned_column_name() in data:
+                # The cleaning script was applied by the extractor
+                cleaned_data[attr_col_name] = data[col.cleaned_column_name()]
+            else:
+                # Get the original column
+                cleaned_data[attr_col_name] = data[dict_col_name]
+
+                # Apply cleaning script
+                if col.cleaning_script:
+                    cleaned_data[attr_col_name] = col.cleaning_script.apply(
+                        cleaned_data[attr_col_name], dict_col_name, primary_key
+                    )
 
             # Apply concept map
             if col.concept_map:
@@ -126,6 +140,30 @@ def squash_rows(data, squash_rules, parent_cols=[]):
     return squashed_data
 
 
+def squash_aggregated_rows(data, main_table):
+    """
+    Build the output of squash_rows for a record whose rows were aggregated by the
+    extractor (see Extractor.aggregated_query): the columns of main_table (the table
+    of the primary key) have a single value and the columns of the joined tables have
+    one value per joined row.
+
+    args:
+        data (dict): the dict returned by clean_data for the aggregated record
+        main_table (str): name of the table of the primary key
+    """
+    joined_cols = [col for col in data if col[1][0] != main_table]
+    if not joined_cols:
+        return data
+
+    squashed_data = {col: values[0] for col, values in data.items() if col[1][0] == main_table}
+    # As with squash_rows, the rows which are identical once cleaned are merged
+    joined_rows = set(zip(*(data[col] for col in joined_cols)))
+    for index, col in enumerate(joined_cols):
+        squashed_data[col] = tuple(row[index] for row in joined_rows)
+
+    return squashed_data
+
+
 def merge_attributes(
     data, attributes: List[Attribute], primary_key,
 ):
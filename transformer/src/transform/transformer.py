@@ -1,9 +1,12 @@
 from uuid import uuid4
 
+from analyzer.src.analyze.mapping import SQUASHED_COLUMN
+
 from transformer.src.transform.fhir import build_fhir_object, build_metadata, clean_fhir_object
 from transformer.src.transform.dataframe import (
     apply_str,
     clean_data,
+    squash_aggregated_rows,
     squash_rows,
     merge_attributes,
 )
@@ -15,12 +18,19 @@ logger = create_logger("transformer")
 
 class Transformer:
     def transform_data(self, data, analysis):
+        if analysis.is_static:
+            # The instance is only built from the static inputs of the analysis
+            return {}
+
         # Get primary key value for logs
         try:
             primary_key = data[analysis.primary_key_column.dataframe_column_name()][0]
         except KeyError as e:
             logger.error(f"Trying to access column not present in dataframe: {e}")
 
+        # The joined rows may have been aggregated by primary key by the extractor
+        squashed = data.pop(SQUASHED_COLUMN, None) is not None
+
         # Change values to strings
         logger.debug("Apply Map String")
         data = apply_str(data)
@@ -31,7 +41,10 @@ class Transformer:
 
         # Apply join rule to merge some lines from the same resource
         logger.debug("Apply Squash Rows")
-        data = squash_rows(data, analysis.squash_rules)
+        if squashed:
+            data = squash_aggregated_rows(data, analysis.primary_key_column.table)
+        else:
+            data = squash_rows(data, analysis.squash_rules)
 
         # Apply merging scripts on data
         logger.debug("Apply Merging Scripts")
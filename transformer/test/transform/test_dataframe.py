@@ -78,6 +78,53 @@ def test_clean_data(_):
     assert cleaned_data == expected
 
 
+@mock.patch("analyzer.src.analyze.cleaning_script.scripts.get_script", return_value=mock_get_script)
+def test_clean_data_cleaned_in_query(_):
+    data = {
+        "PATIENTS_NAME": ["alice", "bob"],
+        "PATIENTS_NAME__clean1": ["ALICE", "BOB"],
+        "PATIENTS_ID": ["id1", "id2"],
+    }
+    name = SqlColumn("PATIENTS", "NAME", cleaning_script=CleaningScript("clean1"))
+    attributes = [
+        Attribute("name", columns=[name]),
+        Attribute("id", columns=[SqlColumn("PATIENTS", "ID", cleaning_script=CleaningScript("c"))]),
+    ]
+
+    cleaned_data = transform.clean_data(data, attributes, SqlColumn("PATIENTS", "ID"))
+
+    assert cleaned_data == {
+        ("name", ("PATIENTS", "NAME")): ["ALICE", "BOB"],
+        ("id", ("PATIENTS", "ID")): ["id1cleaned", "id2cleaned"],
+    }
+
+
+@mock.patch("analyzer.src.analyze.cleaning_script.scripts.get_script", return_value=mock_get_script)
+@mock.patch("analyzer.src.analyze.ConceptMap.fetch", mock_fetch_maps)
+def test_clean_data_translated_in_query(_):
+    data = {
+        "ADMISSIONS_LANGUAGE": ["M", "F"],
+        "ADMISSIONS_LANGUAGE__id_cm_gender": ["male", "female"],
+        "ADMISSIONS_ID": ["ABC", "DEF"],
+        "ADMISSIONS_ID__clean2__id_cm_code": ["abc", "def"],
+    }
+    language = SqlColumn("ADMISSIONS", "LANGUAGE", concept_map=ConceptMap("id_cm_gender"))
+    admid = SqlColumn(
+        "ADMISSIONS",
+        "ID",
+        cleaning_script=CleaningScript("clean2"),
+        concept_map=ConceptMap("id_cm_code"),
+    )
+    attributes = [Attribute("language", columns=[language]), Attribute("code", columns=[admid])]
+
+    cleaned_data = transform.clean_data(data, attributes, SqlColumn("ADMISSIONS", "ID"))
+
+    assert cleaned_data == {
+        ("language", ("ADMISSIONS", "LANGUAGE")): ["male", "female"],
+        ("code", ("ADMISSIONS", "ID")): ["abc", "def"],
+    }
+
+
 def test_squash_rows():
     data = {
         ("name", ("PATIENTS", "NAME")): ["bob", "bob", "bob", "bob"],
@@ -101,6 +148,27 @@ def test_squash_rows():
     )
 
 
+def test_squash_aggregated_rows():
+    data = {
+        ("name", ("PATIENTS", "NAME")): ["bob"],
+        ("id", ("PATIENTS", "ID")): ["id1"],
+        ("language", ("ADMISSIONS", "LANGUAGE")): ["lang1", "lang2", "lang2"],
+        ("code", ("ADMISSIONS", "ID")): ["id1", "id2", "id2"],
+    }
+
+    actual = transform.squash_aggregated_rows(data, "PATIENTS")
+
+    assert actual[("name", ("PATIENTS", "NAME"))] == "bob"
+    assert actual[("id", ("PATIENTS", "ID"))] == "id1"
+    # Identical joined rows are merged, as with squash_rows
+    TestCase().assertCountEqual(
+        zip(
+            actual[("language", ("ADMISSIONS", "LANGUAGE"))], actual[("code", ("ADMISSIONS", "ID"))]
+        ),
+        (("lang1", "id1"), ("lang2", "id2")),
+    )
+
+
 @mock.patch("analyzer.src.analyze.merging_script.scripts.get_script", return_value=mock_get_script)
 def test_merge_attributes(_):
     attr_name = Attribute("name", columns=[SqlColumn("PATIENTS", "NAME")])
@@ -0,0 +1,53 @@
+from analyzer.src.analyze.analysis import Analysis
+from analyzer.src.analyze.attribute import Attribute
+from analyzer.src.analyze.mapping import SQUASHED_COLUMN
+from analyzer.src.analyze.sql_column import SqlColumn
+
+from transformer.src.transform.transformer import Transformer
+
+
+def test_transform_static_resource():
+    analysis = Analysis()
+    analysis.is_static = True
+    analysis.source_id = "source_id"
+    analysis.resource_id = "resource_id"
+    analysis.definition = {
+        "type": "Organization",
+        "kind": "resource",
+        "derivation": "specialization",
+    }
+    analysis.attributes = [Attribute("name", static_inputs=["Hospital"])]
+    transformer = Transformer()
+
+    data = transformer.transform_data({}, analysis)
+    fhir_document = transformer.create_fhir_document(data, analysis)
+
+    assert data == {}
+    assert fhir_document["resourceType"] == "Organization"
+    assert fhir_document["name"] == "Hospital"
+
+
+def test_transform_aggregated_rows():
+    analysis = Analysis()
+    analysis.primary_key_column = SqlColumn("patients", "subject_id")
+    analysis.attributes = [
+        Attribute("id", columns=[analysis.primary_key_column]),
+        Attribute("language", columns=[SqlColumn("admissions", "language")]),
+    ]
+    analysis.squash_rules = ["patients", [["admissions", []]]]
+    flat_data = {"patients_subject_id": [1, 1, 1], "admissions_language": ["fr", "en", "fr"]}
+    aggregated_data = {
+        "patients_subject_id": [1],
+        "admissions_language": ["fr", "en", "fr"],
+        SQUASHED_COLUMN: [True],
+    }
+    transformer = Transformer()
+
+    data = transformer.transform_data(aggregated_data, analysis)
+
+    assert data["id"] == "1"
+    assert sorted(data["language"]) == ["en", "fr"]
+    # Same output as without aggregation, up to the order of the joined rows
+    flat_output = transformer.transform_data(flat_data, analysis)
+    assert flat_output["id"] == data["id"]
+    assert sorted(flat_output["language"]) == sorted(data["language"])